@@ -7,10 +7,62 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sms_analizator_service.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from users_app import bot_webhook, phone_directory, sms_history, telegram_client  # noqa: E402  (нужны загруженные приложения Django)
+from users_app.db import run_db  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+async def on_startup():
+    # Единственный event loop процесса: общий клиент Telegram живет в нем
+    telegram_client.bind_loop()
+    # Application бота в режиме вебхука создается один раз на процесс
+    await bot_webhook.startup()
+    if settings.PROVIDER_WEBHOOK_TOKEN:
+        # Справочник номеров общего вебхука провайдера загружается до первой SMS
+        await run_db(phone_directory.load)
+
+
+async def on_shutdown():
+    # Сначала бот дообрабатывает принятые обновления, затем закрывается общий клиент
+    await bot_webhook.shutdown()
+    await telegram_client.shutdown_bot()
+    # Дописываем буфер истории SMS, пока есть рабочий event loop и пул БД
+    await run_db(sms_history.flush)
+
+
+async def lifespan(receive, send):
+    """Обработка ASGI lifespan: Django сам его не поддерживает."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await on_startup()
+            except Exception as e:
+                # Не мешаем работе SMS-вебхука: бот запустится при первом обновлении
+                logger.error(f"Ошибка при запуске приложения: {e}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            try:
+                await on_shutdown()
+            except Exception as e:
+                logger.error(f"Ошибка при остановке приложения: {e}")
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    await django_application(scope, receive, send)
@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
 from pathlib import Path
-import sys
 
 
 from dotenv import load_dotenv
@@ -50,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы профиль включал остальные middleware; при PROFILING_ENABLED=False отключается сам
+    'users_app.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,14 +80,22 @@ TEMPLATES = [
 
 
 
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# Доля успешных запросов вебхука, для которых пишется итоговая строка лога
+# (ошибки логируются всегда)
+WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv('WEBHOOK_LOG_SAMPLE_RATE', 1.0))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,  # чтобы не отключить встроенные логгеры
     'handlers': {
         'console': {
             'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'stream': sys.stdout,  # можно также использовать sys.stderr
+            # Запись в stdout выполняется в отдельном потоке и не блокирует event loop
+            'class': 'utils.log_queue.QueueStreamHandler',
+            'stream': 'ext://sys.stdout',  # можно также использовать sys.stderr
+            'formatter': 'verbose',
         },
     },
     'formatters': {
@@ -107,14 +116,10 @@ LOGGING = {
         },
         'users_app': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            # DEBUG включает подробности по каждому правилу вебхука
+            'level': LOG_LEVEL,
             'propagate': False,
         },
-        'users_app.views': {  # <--- добавь это
-             'handlers': ['console'],
-             'level': 'DEBUG',
-             'propagate': False,
-        },
     },
 }
 
@@ -141,7 +146,10 @@ DATABASES = {
             # Автоматическое переподключение
             'isolation_level': None,
         },
-        'CONN_MAX_AGE': 0,  # Не использовать persistent connections
+        # Соединения запросов Django не переиспользуем: под ASGI каждый запрос
+        # выполняется в своем потоке. Постоянные соединения держит пул
+        # users_app/db.py (DB_POOL_SIZE, DB_CONN_MAX_AGE)
+        'CONN_MAX_AGE': 0,
         'CONN_HEALTH_CHECKS': True,  # Django 4.1+
     }
 }
@@ -193,3 +201,142 @@ LOGIN_REDIRECT_URL = '/index/'
 LOGOUT_REDIRECT_URL = '/login/'
 
 TOKEN_BOT = os.getenv('TOKEN_BOT')
+# Адрес Bot API (меняется для локального сервера Bot API или бенчмарка)
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
+# Режим приема обновлений бота: polling (отдельный процесс run_bot) или
+# webhook (маршрут telegram/webhook/ в ASGI-приложении, см. users_app/bot_webhook.py).
+# TELEGRAM_WEBHOOK_URL — публичный адрес маршрута, регистрируется в Telegram
+# при старте; TELEGRAM_WEBHOOK_SECRET сверяется с заголовком
+# X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_BOT_MODE = os.getenv('TELEGRAM_BOT_MODE', 'polling')
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
+# Сколько обновлений бота обрабатывать одновременно (обновления одного
+# пользователя или чата всегда идут по очереди, см. users_app/update_processor.py)
+TELEGRAM_BOT_CONCURRENT_UPDATES = int(os.getenv('TELEGRAM_BOT_CONCURRENT_UPDATES', 16))
+
+# Сколько секунд живет скомпилированный индекс правил пользователя в памяти
+# процесса (см. users_app/rules_index.py)
+RULES_INDEX_TTL = int(os.getenv('RULES_INDEX_TTL', 300))
+
+# Кеш token_url -> пользователь для вебхука (см. users_app/user_cache.py)
+WEBHOOK_TOKEN_CACHE_SIZE = int(os.getenv('WEBHOOK_TOKEN_CACHE_SIZE', 10000))
+WEBHOOK_TOKEN_CACHE_TTL = int(os.getenv('WEBHOOK_TOKEN_CACHE_TTL', 60))
+WEBHOOK_TOKEN_NEGATIVE_TTL = int(os.getenv('WEBHOOK_TOKEN_NEGATIVE_TTL', 30))
+# Сколько секунд помнить формат SMS, распознанный для токена (см. users_app/sms_formats.py)
+SMS_FORMAT_CACHE_TTL = int(os.getenv('SMS_FORMAT_CACHE_TTL', 3600))
+
+# Кеш поиска пользователей ботом по telegram_id и телефону (см. users_app/user_cache.py);
+# BOT_USER_NEGATIVE_TTL — для записей "пользователь не найден"
+BOT_USER_CACHE_SIZE = int(os.getenv('BOT_USER_CACHE_SIZE', 10000))
+BOT_USER_CACHE_TTL = int(os.getenv('BOT_USER_CACHE_TTL', 300))
+BOT_USER_NEGATIVE_TTL = int(os.getenv('BOT_USER_NEGATIVE_TTL', 30))
+
+# Очередь доставки в Telegram (см. users_app/outbox.py). Если включена, вебхук
+# только ставит сообщения в очередь, а отправляет их `manage.py run_outbox`
+TELEGRAM_OUTBOX_ENABLED = os.getenv('TELEGRAM_OUTBOX_ENABLED', 'False') == 'True'
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1.0))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_LOCK_TIMEOUT = int(os.getenv('OUTBOX_LOCK_TIMEOUT', 300))
+
+# Сколько Telegram-чатов обслуживать одновременно при рассылке одной SMS
+# (сообщения в один и тот же чат всегда уходят по порядку)
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv('TELEGRAM_SEND_CONCURRENCY', 10))
+
+# Пул соединений общего клиента Telegram Bot API (см. users_app/telegram_client.py)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', 20))
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv('TELEGRAM_KEEPALIVE_EXPIRY', 60))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', 10))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', 10))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', 5))
+
+# Лимиты Telegram Bot API на процесс (см. users_app/rate_limit.py)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_GROUP_RATE_PER_MINUTE', 20))
+TELEGRAM_PRIVATE_RATE = float(os.getenv('TELEGRAM_PRIVATE_RATE', 1))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))
+TELEGRAM_RETRY_AFTER_MAX_RETRIES = int(os.getenv('TELEGRAM_RETRY_AFTER_MAX_RETRIES', 3))
+# Какую паузу (ограничителя скорости или RetryAfter) вебхук пережидает на
+# месте; воркер очереди дольше OUTBOX_RETRY_AFTER_MAX_WAIT не ждет и переносит сообщение
+TELEGRAM_RETRY_AFTER_MAX_WAIT = float(os.getenv('TELEGRAM_RETRY_AFTER_MAX_WAIT', 10))
+OUTBOX_RETRY_AFTER_MAX_WAIT = float(os.getenv('OUTBOX_RETRY_AFTER_MAX_WAIT', 1))
+
+# Пул потоков с постоянными соединениями к БД для вебхука и бота (см. users_app/db.py)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 600))
+# Поиск пользователя, номера и правил вебхука через async ORM Django (aget,
+# async for) вместо пула. Async ORM выполняет запросы в потоке запроса ASGI,
+# поэтому соединение с БД открывается заново на каждый запрос
+WEBHOOK_ASYNC_ORM = os.getenv('WEBHOOK_ASYNC_ORM', 'False') == 'True'
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_HEALTH_CHECK_INTERVAL', 30))
+
+# Максимальное количество SMS в одном запросе к webhook/<token>/batch/
+WEBHOOK_BATCH_MAX_SIZE = int(os.getenv('WEBHOOK_BATCH_MAX_SIZE', 500))
+
+# Общий вебхук провайдера provider/webhook/<PROVIDER_WEBHOOK_TOKEN>/ с
+# маршрутизацией по caller_did (пусто — выключен, см. users_app/phone_directory.py).
+# PHONE_DIRECTORY_TTL — период полной перезагрузки справочника номеров,
+# PHONE_DIRECTORY_NEGATIVE_TTL — сколько помнить номера, не найденные в БД
+PROVIDER_WEBHOOK_TOKEN = os.getenv('PROVIDER_WEBHOOK_TOKEN', '')
+PHONE_DIRECTORY_TTL = int(os.getenv('PHONE_DIRECTORY_TTL', 300))
+PHONE_DIRECTORY_NEGATIVE_TTL = int(os.getenv('PHONE_DIRECTORY_NEGATIVE_TTL', 30))
+
+# История входящих SMS: записи копятся в памяти и сохраняются пачками
+SMS_HISTORY_ENABLED = os.getenv('SMS_HISTORY_ENABLED', 'True') == 'True'
+SMS_HISTORY_BATCH_SIZE = int(os.getenv('SMS_HISTORY_BATCH_SIZE', 200))
+SMS_HISTORY_FLUSH_INTERVAL = float(os.getenv('SMS_HISTORY_FLUSH_INTERVAL', 2))
+SMS_HISTORY_MAX_BUFFER = int(os.getenv('SMS_HISTORY_MAX_BUFFER', 10000))
+
+# Дедупликация повторных запросов провайдера: окно (сек), в течение которого
+# такая же SMS считается повтором, и размер кэша отпечатков в памяти
+WEBHOOK_DEDUP_ENABLED = os.getenv('WEBHOOK_DEDUP_ENABLED', 'True') == 'True'
+WEBHOOK_DEDUP_WINDOW = int(os.getenv('WEBHOOK_DEDUP_WINDOW', 600))
+WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv('WEBHOOK_DEDUP_CACHE_SIZE', 50000))
+
+# Метрики Prometheus: /metrics требует Authorization: Bearer METRICS_TOKEN
+# и/или адрес из METRICS_ALLOWED_IPS (если не задано ни то, ни другое, /metrics
+# закрыт). Процессы бота и воркера отдают метрики на METRICS_BIND_ADDR,
+# бот — на порту BOT_METRICS_PORT (0 — выключено)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+METRICS_BIND_ADDR = os.getenv('METRICS_BIND_ADDR', '127.0.0.1')
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 0))
+
+# Профилирование запросов (cProfile + журнал SQL), см. users_app/profiling.py.
+# Доля случайных запросов PROFILING_SAMPLE_RATE или запросы, в которых
+# заголовок PROFILING_HEADER равен PROFILING_SECRET (пусто — по заголовку не
+# профилируется); PROFILING_ALLOWED_IPS (пусто — любые адреса) дополнительно
+# ограничивает REMOTE_ADDR
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile')
+PROFILING_SECRET = os.getenv('PROFILING_SECRET', '')
+PROFILING_ALLOWED_IPS = [ip.strip() for ip in os.getenv('PROFILING_ALLOWED_IPS', '').split(',') if ip.strip()]
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', 200))
+
+# Повторы запросов к БД без соединения (потеряно или не открывается; экспоненциальная задержка
+# со случайным разбросом) и автоматический выключатель: после
+# DB_BREAKER_FAILURE_THRESHOLD ошибок подряд запросы к БД отклоняются сразу
+# в течение DB_BREAKER_RESET_TIMEOUT секунд
+DB_RETRY_ATTEMPTS = int(os.getenv('DB_RETRY_ATTEMPTS', 3))
+DB_RETRY_BASE_DELAY = float(os.getenv('DB_RETRY_BASE_DELAY', 0.5))
+DB_RETRY_MAX_DELAY = float(os.getenv('DB_RETRY_MAX_DELAY', 5))
+DB_BREAKER_FAILURE_THRESHOLD = int(os.getenv('DB_BREAKER_FAILURE_THRESHOLD', 5))
+DB_BREAKER_RESET_TIMEOUT = float(os.getenv('DB_BREAKER_RESET_TIMEOUT', 30))
+
+# Сколько правил, ключей и номеров показывать на одной странице настроек
+SETTINGS_PAGE_SIZE = int(os.getenv('SETTINGS_PAGE_SIZE', 30))
+
+# Массовый импорт правил (см. users_app/rules_io.py): максимум строк в файле и
+# размер пачки bulk_create / выгрузки
+RULES_IMPORT_MAX_ROWS = int(os.getenv('RULES_IMPORT_MAX_ROWS', 50000))
+RULES_IMPORT_BATCH_SIZE = int(os.getenv('RULES_IMPORT_BATCH_SIZE', 1000))
+
+# REST API настроек (см. users_app/api/views.py): размер страницы курсорной
+# пагинации и максимум объектов в массовом создании/удалении
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 1000))
+API_BULK_MAX_SIZE = int(os.getenv('API_BULK_MAX_SIZE', 1000))
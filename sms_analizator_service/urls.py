@@ -6,6 +6,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from users_app import views as users_views
+
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -22,6 +24,9 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('admin/profiles/', users_views.profiles_list, name='profiles'),
+    path('admin/profiles/<str:filename>', users_views.profile_download, name='profile_download'),
     path('admin/', admin.site.urls),
+    path('api/', include('users_app.api.urls')),
     path('', include('users_app.urls')),
 ]
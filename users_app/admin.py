@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from users_app.models import User, Key, NumbersService, Rules, TelegramChats
+from users_app.models import User, Key, NumbersService, Rules, TelegramChats, TelegramOutbox, InboundSms
 
 
 @admin.register(User)
@@ -30,3 +30,18 @@ class TelegramChatsAdmin(admin.ModelAdmin):
 @admin.register(Rules)
 class RulesAdmin(admin.ModelAdmin):
     list_display = ('from_whom', 'to_whom')
+
+
+@admin.register(TelegramOutbox)
+class TelegramOutboxAdmin(admin.ModelAdmin):
+    list_display = ('chat_id', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('chat_id',)
+
+
+@admin.register(InboundSms)
+class InboundSmsAdmin(admin.ModelAdmin):
+    list_display = ('caller_id', 'caller_did', 'user', 'delivery_status', 'received_at')
+    list_filter = ('delivery_status',)
+    search_fields = ('caller_id', 'caller_did', 'text')
+    list_select_related = ('user',)
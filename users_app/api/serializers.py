@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
-from users_app.models import User
+from users_app.models import Key, NumbersService, Rules, TelegramChats, User
+from users_app.rules_io import text_condition_error
+from users_app.validators import clean_service_phone
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -15,3 +17,110 @@ class UserSerializer(serializers.ModelSerializer):
             'email',
             'balance',
         ]
+
+
+class OwnedPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """
+    Ссылка на объект текущего пользователя.
+
+    Все объекты пользователя загружаются одним запросом на сериализатор
+    (и на весь список при массовом создании), а не запросом на каждое поле.
+    """
+
+    def __init__(self, model, **kwargs):
+        self.model = model
+        super().__init__(queryset=model.objects.none(), **kwargs)
+
+    def get_queryset(self):
+        return self.model.objects.filter(user=self.context['request'].user)
+
+    def to_internal_value(self, data):
+        # Контекст корневого сериализатора: при many=True он общий у всех элементов
+        cache = self.context.setdefault('owned_objects', {})
+        if self.model not in cache:
+            cache[self.model] = {str(obj.pk): obj for obj in self.get_queryset()}
+        obj = cache[self.model].get(str(data))
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class NumbersServiceListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        # Уникальность номеров проверяется одним запросом на весь список
+        telephones = [item['telephone'] for item in attrs]
+        taken = set(
+            NumbersService.objects.filter(telephone__in=telephones).values_list('telephone', flat=True)
+        )
+        seen = set()
+        errors = []
+        for telephone in telephones:
+            if telephone in taken or telephone in seen:
+                errors.append({'telephone': ['Этот номер уже подключен.']})
+            else:
+                errors.append({})
+            seen.add(telephone)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return attrs
+
+
+class NumbersServiceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NumbersService
+        fields = ['id', 'name', 'telephone']
+        # Уникальность проверяется в validate и в NumbersServiceListSerializer
+        extra_kwargs = {'telephone': {'validators': []}}
+        list_serializer_class = NumbersServiceListSerializer
+
+    def validate_telephone(self, value):
+        return clean_service_phone(value)
+
+    def validate(self, attrs):
+        if self.parent is None and 'telephone' in attrs:
+            taken = NumbersService.objects.filter(telephone=attrs['telephone'])
+            if self.instance is not None:
+                taken = taken.exclude(pk=self.instance.pk)
+            if taken.exists():
+                raise serializers.ValidationError({'telephone': ['Этот номер уже подключен.']})
+        return attrs
+
+
+class TelegramChatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TelegramChats
+        fields = ['id', 'title', 'chat_id']
+
+
+class KeySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Key
+        fields = ['id', 'name', 'title', 'token']
+
+
+class RulesSerializer(serializers.ModelSerializer):
+    from_whom = OwnedPrimaryKeyField(NumbersService)
+    to_whom = OwnedPrimaryKeyField(TelegramChats)
+    telephone = serializers.CharField(source='from_whom.telephone', read_only=True)
+    chat_id = serializers.CharField(source='to_whom.chat_id', read_only=True)
+    chat_title = serializers.CharField(source='to_whom.title', read_only=True)
+
+    class Meta:
+        model = Rules
+        fields = [
+            'id', 'sender', 'from_whom', 'to_whom', 'telephone', 'chat_id', 'chat_title',
+            'text_match', 'text_pattern',
+        ]
+
+    def validate(self, attrs):
+        text_match = attrs.get('text_match', getattr(self.instance, 'text_match', 'any'))
+        text_pattern = attrs.get('text_pattern', getattr(self.instance, 'text_pattern', '')).strip()
+        if text_match == 'any':
+            text_pattern = ''
+        compiled_patterns = self.context.setdefault('compiled_patterns', {})
+        error = text_condition_error(text_match, text_pattern, compiled_patterns)
+        if error:
+            raise serializers.ValidationError({'text_pattern': [error]})
+        attrs['text_match'] = text_match
+        attrs['text_pattern'] = text_pattern
+        return attrs
@@ -1,7 +1,12 @@
-from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import include, path
+from rest_framework.routers import DefaultRouter
 
-urlpatterns = [
-    path('auth/', include('users_app.api.auth.urls')),
-]
+from users_app.api.views import KeyViewSet, NumbersServiceViewSet, RulesViewSet, TelegramChatsViewSet
+
+router = DefaultRouter()
+router.register('rules', RulesViewSet, basename='api-rules')
+router.register('numbers', NumbersServiceViewSet, basename='api-numbers')
+router.register('chats', TelegramChatsViewSet, basename='api-chats')
+router.register('keys', KeyViewSet, basename='api-keys')
+
+# Маршруты авторизации (users_app/api/auth/urls.py) пока отключены
+urlpatterns = router.urls
@@ -0,0 +1,179 @@
+"""
+REST API настроек пользователя: правила, номера, Telegram-каналы и ключи.
+
+Списки отдаются с курсорной пагинацией. Ответы GET помечаются ETag по версии
+настроек пользователя (users_app/config_version.py): при совпадении
+If-None-Match возвращается 304 без запроса списка и сериализации.
+"""
+import hashlib
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import serializers, status, viewsets
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from users_app import config_version, phone_directory, rules_index
+from users_app.api.serializers import (
+    KeySerializer, NumbersServiceSerializer, RulesSerializer, TelegramChatsSerializer
+)
+from users_app.models import Key, NumbersService, Rules, TelegramChats
+
+
+class ConfigCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class UserConfigViewSet(viewsets.ModelViewSet):
+    """
+    Объекты настроек текущего пользователя.
+
+    POST bulk/ — создание списка объектов одним bulk_create,
+    POST bulk_delete/ — удаление по списку ids в одной транзакции.
+
+    MySQL не возвращает id из bulk_create: созданные строки перечитываются
+    одним запросом в той же транзакции (fetch_created_ids).
+    """
+    authentication_classes = [SessionAuthentication, TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    pagination_class = ConfigCursorPagination
+    model = None
+    related_fields = ()
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # Генерация схемы drf-yasg идет без пользователя
+            return self.model.objects.none()
+        queryset = self.model.objects.filter(user=self.request.user)
+        if self.related_fields:
+            queryset = queryset.select_related(*self.related_fields)
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def get_etag(self, request):
+        # Разные страницы и параметры одного списка — разные представления
+        digest = hashlib.md5(request.get_full_path().encode()).hexdigest()[:16]
+        return f'W/"{config_version.get(request.user.id)}-{digest}"'
+
+    def conditional(self, request, handler, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, super().retrieve, *args, **kwargs)
+
+    def check_bulk_size(self, size):
+        if size > settings.API_BULK_MAX_SIZE:
+            raise serializers.ValidationError(f'Не больше {settings.API_BULK_MAX_SIZE} объектов за запрос')
+
+    def fetch_created_ids(self, objects, last_id):
+        """
+        Проставляет id объектам после bulk_create без RETURNING.
+
+        Строки пользователя с id > last_id сопоставляются с объектами по
+        значениям полей: параллельная вставка того же пользователя не
+        перепутает id, а у одинаковых строк id взаимозаменяемы.
+        """
+        fields = [field.attname for field in self.model._meta.concrete_fields if not field.primary_key]
+        created = defaultdict(deque)
+        rows = self.model.objects.filter(user=self.request.user, id__gt=last_id).order_by('id')
+        for row in rows.values_list('id', *fields):
+            created[row[1:]].append(row[0])
+        for obj in objects:
+            obj.pk = created[tuple(getattr(obj, name) for name in fields)].popleft()
+
+    def after_bulk_create(self, objects):
+        """Действия вместо сигналов post_save, которые bulk_create не отправляет."""
+        config_version.bump(self.request.user.id)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError('Ожидается список объектов')
+        self.check_bulk_size(len(request.data))
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        objects = [self.model(user=request.user, **attrs) for attrs in serializer.validated_data]
+        with transaction.atomic():
+            last_id = None
+            if not connection.features.can_return_rows_from_bulk_insert:
+                last_id = self.model.objects.filter(user=request.user).aggregate(last_id=Max('id'))['last_id'] or 0
+            self.model.objects.bulk_create(objects, batch_size=settings.RULES_IMPORT_BATCH_SIZE)
+            if last_id is not None:
+                self.fetch_created_ids(objects, last_id)
+            self.after_bulk_create(objects)
+        return Response(self.get_serializer(objects, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], serializer_class=BulkDeleteSerializer)
+    def bulk_delete(self, request):
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        self.check_bulk_size(len(ids))
+        with transaction.atomic():
+            deleted = self.model.objects.filter(user=request.user, id__in=ids).delete()[1].get(
+                self.model._meta.label, 0
+            )
+        return Response({'deleted': deleted})
+
+
+class RulesViewSet(UserConfigViewSet):
+    model = Rules
+    serializer_class = RulesSerializer
+    related_fields = ('from_whom', 'to_whom')
+
+    def after_bulk_create(self, objects):
+        super().after_bulk_create(objects)
+        user_id = self.request.user.id
+        transaction.on_commit(lambda: rules_index.invalidate(user_id))
+
+
+class NumbersServiceViewSet(UserConfigViewSet):
+    model = NumbersService
+    serializer_class = NumbersServiceSerializer
+
+    def after_bulk_create(self, objects):
+        super().after_bulk_create(objects)
+
+        def update_directory():
+            for number in objects:
+                phone_directory.number_saved(number)
+
+        transaction.on_commit(update_directory)
+
+
+class TelegramChatsViewSet(UserConfigViewSet):
+    model = TelegramChats
+    serializer_class = TelegramChatsSerializer
+
+
+class KeyViewSet(UserConfigViewSet):
+    model = Key
+    serializer_class = KeySerializer
@@ -0,0 +1,127 @@
+"""
+Прием обновлений Telegram-бота через вебхук (TELEGRAM_BOT_MODE=webhook).
+
+Application бота создается один раз на event loop ASGI-приложения при старте
+(lifespan, см. sms_analizator_service/asgi.py) и работает поверх общего Bot
+из users_app/telegram_client.py: обработчики /start и контакта используют тот
+же пул соединений к Bot API, пул потоков БД и кеши, что и SMS-вебхук, а
+отдельный процесс run_bot с long-poll не нужен.
+
+Вьюха telegram/webhook/ только кладет обновление в update_queue и сразу
+отвечает Telegram; обработчики выполняет цикл Application в фоне.
+"""
+import asyncio
+import hmac
+import logging
+
+from django.conf import settings
+from telegram import Update
+
+from users_app import telegram_client
+
+logger = logging.getLogger(__name__)
+
+_application = None
+_application_loop = None
+_application_started = None
+
+
+def is_enabled():
+    return settings.TELEGRAM_BOT_MODE == 'webhook'
+
+
+def check_secret(token):
+    """Сверяет заголовок X-Telegram-Bot-Api-Secret-Token с TELEGRAM_WEBHOOK_SECRET."""
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    if not secret:
+        # Без секрета вебхук бота открыт для всех: такие запросы не принимаем
+        return False
+    return hmac.compare_digest((token or '').encode(), secret.encode())
+
+
+async def _start_application():
+    from users_app.telegram_bot import build_application
+
+    application = build_application(await telegram_client.get_bot(), polling=False)
+    await application.initialize()
+    await application.start()
+    logger.info("🤖 BOT WEBHOOK: Application бота запущен")
+    return application
+
+
+async def get_application():
+    """
+    Возвращает запущенный Application бота для текущего event loop.
+
+    Обычно он запускается при старте ASGI-приложения; если сервер не
+    поддерживает lifespan, Application запускается при первом обновлении.
+    """
+    global _application, _application_loop, _application_started
+
+    loop = asyncio.get_running_loop()
+    if _application_started is None or _application_loop is not loop:
+        _application_loop = loop
+        # Одновременные первые обновления ждут один и тот же запуск
+        _application_started = loop.create_task(_start_application())
+
+    started = _application_started
+    try:
+        _application = await started
+    except Exception:
+        if _application_started is started:
+            _application_loop = _application_started = None
+        raise
+    return _application
+
+
+async def set_webhook(application):
+    """Регистрирует TELEGRAM_WEBHOOK_URL в Telegram (если адрес задан)."""
+    url = settings.TELEGRAM_WEBHOOK_URL
+    if not url:
+        logger.info("🤖 BOT WEBHOOK: TELEGRAM_WEBHOOK_URL не задан, вебхук в Telegram не меняется")
+        return
+    await application.bot.set_webhook(
+        url=url,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET or None,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logger.info(f"🤖 BOT WEBHOOK: вебхук бота установлен на {url}")
+
+
+async def startup():
+    """Запуск Application при старте ASGI-приложения."""
+    if not is_enabled():
+        return
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        logger.error("🤖 BOT WEBHOOK: TELEGRAM_WEBHOOK_SECRET не задан, обновления бота будут отклоняться")
+    application = await get_application()
+    await set_webhook(application)
+
+
+async def process(data):
+    """
+    Передает обновление от Telegram в очередь Application.
+
+    Args:
+        data: JSON-тело запроса Telegram
+    """
+    application = await get_application()
+    update = Update.de_json(data, application.bot)
+    await application.update_queue.put(update)
+
+
+async def shutdown():
+    """Обрабатывает очередь обновлений и останавливает Application."""
+    global _application, _application_loop, _application_started
+
+    if _application_started is None:
+        return
+    started, _application, _application_loop, _application_started = _application_started, None, None, None
+    try:
+        application = await started
+        await application.stop()
+        # Закрывает и общий Bot: shutdown_bot после этого ничего не делает
+        await application.shutdown()
+        logger.info("🤖 BOT WEBHOOK: Application бота остановлен")
+    except Exception as e:
+        logger.error(f"Ошибка остановки Application бота: {e}")
@@ -0,0 +1,48 @@
+"""
+Версия настроек пользователя для условных GET-запросов API.
+
+Любое изменение Rules, NumbersService, TelegramChats и Key увеличивает
+ConfigVersion.version пользователя (сигналы в users_app/signals.py, явные
+вызовы после bulk_create). Версия входит в ETag ответов API, поэтому
+клиент, опрашивающий настройки, получает 304 без запроса списка и
+сериализации, пока ничего не менялось.
+
+Версия хранится в БД и одинакова для всех процессов. Внутри транзакции
+увеличение откладывается до коммита и выполняется один раз на пользователя,
+сколько бы объектов ни изменилось (массовое удаление сотен правил — одно
+UPDATE, а не сотни).
+"""
+import functools
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from users_app.models import ConfigVersion
+
+
+def get(user_id):
+    """Текущая версия настроек пользователя (0, если настройки не менялись)."""
+    return ConfigVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+
+def _increment(user_id):
+    if ConfigVersion.objects.filter(user_id=user_id).update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ConfigVersion.objects.create(user_id=user_id, version=1)
+    except IntegrityError:
+        # Запись создал параллельный запрос или пользователь уже удален
+        ConfigVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+
+
+def bump(user_id):
+    """Увеличивает версию настроек пользователя после коммита текущей транзакции."""
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for _, func, _ in connection.run_on_commit:
+            if getattr(func, 'config_version_user_id', None) == user_id:
+                return
+    callback = functools.partial(_increment, user_id)
+    callback.config_version_user_id = user_id
+    transaction.on_commit(callback)
@@ -0,0 +1,142 @@
+"""
+Управление соединениями с БД для бота и вебхука.
+
+Синхронный ORM-код выполняется в отдельном пуле из DB_POOL_SIZE потоков.
+Каждый поток держит одно постоянное соединение с MySQL и переиспользует его
+между запросами: перед работой соединение проверяется ping-ом, только если оно
+простаивало дольше DB_HEALTH_CHECK_INTERVAL, и пересоздается по возрасту
+(DB_CONN_MAX_AGE) или после ошибок потери соединения 2006/2013. Соединение
+открывается до вызова функции, и ошибка подключения (сервер недоступен,
+2002/2003) поднимается как ConnectError: ее считают повторы и выключатель БД
+(users_app/retry.py).
+
+Обычный sync_to_async для этого не подходит: под ASGI Django выполняет
+синхронный код каждого запроса в новом потоке, и соединение в нем не
+переживает запрос (поэтому CONN_MAX_AGE в настройках остается 0).
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.utils import OperationalError
+
+# Коды MySQL "server has gone away" и "lost connection during query"
+CONNECTION_LOST_ERRORS = (2006, 2013)
+# Коды MySQL "can't connect to local/remote MySQL server"
+CONNECT_ERRORS = (2002, 2003)
+
+_executor = None
+_executor_lock = threading.Lock()
+_state = threading.local()
+
+
+class ConnectError(OperationalError):
+    """Не удалось открыть соединение с БД."""
+
+
+def _error_code(error):
+    return error.args[0] if isinstance(error, OperationalError) and error.args else None
+
+
+def is_connection_lost(error):
+    return _error_code(error) in CONNECTION_LOST_ERRORS
+
+
+def is_connect_failed(error):
+    return isinstance(error, ConnectError) or _error_code(error) in CONNECT_ERRORS
+
+
+def is_connection_error(error):
+    """Нет связи с БД: соединение потеряно или не открывается."""
+    return is_connection_lost(error) or is_connect_failed(error)
+
+
+def prepare_connection(using='default'):
+    """
+    Готовит соединение текущего потока к запросу.
+
+    Новое соединение не открывается без необходимости: живое соединение
+    переиспользуется, ping выполняется только после простоя.
+    """
+    conn = connections[using]
+    now = time.monotonic()
+
+    if conn.connection is not None:
+        idle = now - getattr(_state, 'last_used_at', now)
+        age = now - getattr(_state, 'opened_at', now)
+        if age > settings.DB_CONN_MAX_AGE:
+            conn.close()
+        elif conn.errors_occurred or idle > settings.DB_HEALTH_CHECK_INTERVAL:
+            if conn.is_usable():
+                conn.errors_occurred = False
+            else:
+                conn.close()
+
+    if conn.connection is None:
+        # Соединение откроется при первом запросе
+        _state.opened_at = now
+    _state.last_used_at = now
+
+
+def reset_connection(using='default'):
+    """Закрывает соединение текущего потока после потери связи с сервером."""
+    connections[using].close()
+
+
+def _call(func, args, kwargs):
+    prepare_connection()
+    try:
+        connections['default'].ensure_connection()
+    except OperationalError as e:
+        raise ConnectError(*e.args) from e
+    try:
+        return func(*args, **kwargs)
+    except OperationalError as e:
+        if is_connection_lost(e):
+            reset_connection()
+        raise
+    finally:
+        _state.last_used_at = time.monotonic()
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.DB_POOL_SIZE,
+                    thread_name_prefix='db',
+                )
+    return _executor
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполняет синхронный ORM-код в пуле потоков с постоянными соединениями.
+
+    Args:
+        func: Синхронная функция, работающая с БД
+        *args, **kwargs: Аргументы func
+
+    Returns:
+        Результат func
+    """
+    loop = asyncio.get_running_loop()
+    # Контекст запроса (contextvars) виден в потоке БД, как и в sync_to_async
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), context.run, _call, func, args, kwargs)
+
+
+def database_sync_to_async(func):
+    """Декоратор: аналог sync_to_async, но через run_db."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,144 @@
+"""
+Защита от повторной доставки одной и той же SMS.
+
+Если вебхук отвечает медленно, провайдер присылает запрос повторно, и SMS
+уходила в Telegram дважды. Для каждой SMS считается отпечаток (пользователь,
+caller_id, caller_did, текст и ID сообщения провайдера, если он есть).
+Недавние отпечатки проверяются в памяти процесса без обращения к БД, а
+уникальный индекс WebhookFingerprint.fingerprint защищает от дублей между
+воркерами. Отпечаток старше WEBHOOK_DEDUP_WINDOW дублем не считается: та же
+SMS, пришедшая позже, обрабатывается заново.
+
+Старые отпечатки удаляются командой manage.py cleanup_fingerprints.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from users_app.models import WebhookFingerprint
+from utils.cache import MISSING, TTLCache
+
+# Поля, в которых провайдеры передают ID сообщения
+PROVIDER_ID_KEYS = ('id', 'message_id', 'sms_id', 'msg_id')
+
+_recent = TTLCache(
+    maxsize=settings.WEBHOOK_DEDUP_CACHE_SIZE,
+    ttl=settings.WEBHOOK_DEDUP_WINDOW,
+)
+
+
+def provider_message_id(sms_data, data=None):
+    """Ищет ID сообщения провайдера в данных SMS или в корне запроса."""
+    for source in (sms_data, data):
+        if not isinstance(source, dict):
+            continue
+        for key in PROVIDER_ID_KEYS:
+            if source.get(key) not in (None, ''):
+                return str(source[key])
+    return ''
+
+
+def fingerprint(user_id, sms_data, data=None):
+    """
+    Считает отпечаток SMS.
+
+    Args:
+        user_id: ID пользователя
+        sms_data: dict с caller_id, caller_did, text
+        data: Весь JSON запроса (для поиска ID сообщения вне блока SMS)
+
+    Returns:
+        str: sha256 в hex
+    """
+    parts = (
+        str(user_id),
+        str(sms_data.get('caller_id', '')),
+        str(sms_data.get('caller_did', '')),
+        str(sms_data.get('text', '')),
+        provider_message_id(sms_data, data),
+    )
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def is_recent(fp):
+    """Был ли отпечаток недавно обработан этим процессом."""
+    return _recent.get(fp) is not MISSING
+
+
+def claim(user_id, fingerprints):
+    """
+    Занимает отпечатки в БД за постоянное число запросов на всю пачку.
+
+    Существующие отпечатки читаются одним запросом; новые вставляются одним
+    bulk_create(ignore_conflicts=True), отпечатки за пределами окна
+    продлеваются одним UPDATE. ignore_conflicts не сообщает, какие строки
+    вставил именно этот вызов, поэтому занятыми считаются строки с
+    created_at == now этого вызова: вставку, проигранную параллельному
+    воркеру, и UPDATE, который уже не нашел устаревшую строку, видно по
+    чужому created_at.
+
+    Args:
+        user_id: ID пользователя
+        fingerprints: Список отпечатков
+
+    Returns:
+        list[bool]: True, если SMS новая и ее нужно обработать,
+        False для дубля. В том же порядке, что и fingerprints
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.WEBHOOK_DEDUP_WINDOW)
+    # Повтор внутри самой пачки — дубль первой SMS
+    unique = list(dict.fromkeys(fingerprints))
+    existing = dict(
+        WebhookFingerprint.objects.filter(fingerprint__in=unique).values_list('fingerprint', 'created_at')
+    )
+    new = [fp for fp in unique if fp not in existing]
+    # Отпечаток за пределами окна: это уже не повтор, а новая SMS
+    expired = [fp for fp, created_at in existing.items() if created_at < cutoff]
+
+    if new:
+        WebhookFingerprint.objects.bulk_create(
+            [WebhookFingerprint(fingerprint=fp, user_id=user_id, created_at=now) for fp in new],
+            ignore_conflicts=True,
+        )
+    if expired:
+        WebhookFingerprint.objects.filter(fingerprint__in=expired, created_at__lt=cutoff).update(created_at=now)
+
+    owned = set()
+    if new or expired:
+        owned = set(
+            WebhookFingerprint.objects
+            .filter(fingerprint__in=new + expired, created_at=now)
+            .values_list('fingerprint', flat=True)
+        )
+
+    claimed = []
+    for fp in fingerprints:
+        is_new = fp in owned
+        # Следующее вхождение того же отпечатка в пачке — дубль
+        owned.discard(fp)
+        if is_new:
+            _recent.set(fp, True)
+        claimed.append(is_new)
+    return claimed
+
+
+def release(fingerprints):
+    """Освобождает отпечатки, если обработка SMS не удалась: повтор провайдера будет обработан."""
+    for fp in fingerprints:
+        _recent.pop(fp, None)
+    WebhookFingerprint.objects.filter(fingerprint__in=fingerprints).delete()
+
+
+def cleanup():
+    """
+    Удаляет отпечатки старше окна дедупликации.
+
+    Returns:
+        int: Количество удаленных записей
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.WEBHOOK_DEDUP_WINDOW)
+    deleted, _ = WebhookFingerprint.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,78 @@
+"""
+Отправка SMS в Telegram-каналы по сработавшим правилам.
+
+Используется и вебхуком (прямая отправка), и воркером очереди
+(users_app/outbox.py), чтобы формат сообщения и учет ошибок были одинаковыми.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+
+from users_app.rate_limit import get_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSkipped(Exception):
+    """Сообщение не отправлялось: предыдущее сообщение в тот же чат не доставлено."""
+
+
+def format_sms_message(caller_id, caller_did, text):
+    return (f'Пришло сообщение от {caller_id}\n'
+            f'На номер: {caller_did}\n'
+            f'Текст: {text}')
+
+
+async def send_to_chats(bot, deliveries, concurrency=None, max_retry_wait=None, stop_chat_on_error=False):
+    """
+    Отправляет сообщения в Telegram параллельно.
+
+    Сообщения группируются по chat_id: разные чаты обслуживаются одновременно
+    (не более concurrency штук), а внутри одного чата сообщения уходят строго
+    по очереди в исходном порядке. Лимиты Telegram соблюдаются через
+    users_app/rate_limit.py.
+
+    Args:
+        bot: telegram.Bot
+        deliveries: Список пар (chat_id, text)
+        concurrency: Сколько чатов обслуживать одновременно
+            (по умолчанию settings.TELEGRAM_SEND_CONCURRENCY)
+        max_retry_wait: См. TelegramRateLimiter.send_message
+        stop_chat_on_error: После первой ошибки в чате не отправлять в него
+            остальные сообщения (результат для них — ChatSkipped), чтобы
+            очередь могла повторить их в исходном порядке
+
+    Returns:
+        list: Для каждой пары None при успехе или исключение при ошибке,
+        в том же порядке, что и deliveries
+    """
+    results = [None] * len(deliveries)
+
+    # chat_id -> индексы сообщений в deliveries
+    by_chat = {}
+    for position, (chat_id, _) in enumerate(deliveries):
+        by_chat.setdefault(str(chat_id), []).append(position)
+
+    semaphore = asyncio.Semaphore(concurrency or settings.TELEGRAM_SEND_CONCURRENCY)
+    limiter = get_limiter()
+
+    async def send_chat(positions):
+        async with semaphore:
+            for number, position in enumerate(positions):
+                chat_id, text = deliveries[position]
+                try:
+                    await limiter.send_message(bot, chat_id, text, max_retry_wait=max_retry_wait)
+                except Exception as e:
+                    logger.error(f"💥 DELIVERY: ошибка отправки в чат {chat_id}: {e}")
+                    results[position] = e
+                    if stop_chat_on_error:
+                        for skipped in positions[number + 1:]:
+                            results[skipped] = ChatSkipped(f'Ожидает доставки предыдущего сообщения в чат {chat_id}')
+                        return
+
+    if len(by_chat) == 1:
+        await send_chat(next(iter(by_chat.values())))
+    else:
+        await asyncio.gather(*(send_chat(positions) for positions in by_chat.values()))
+    return results
@@ -1,9 +1,10 @@
 import re
 
 from django import forms
-from django.core.exceptions import ValidationError
 
-from users_app.models import KEY_TYPES, NumbersService, TelegramChats
+from users_app.models import KEY_TYPES, TEXT_MATCH_TYPES, NumbersService, TelegramChats
+from users_app.rules_index import compile_pattern, parse_keywords
+from users_app.validators import clean_service_phone
 
 
 class ServiceForm(forms.Form):
@@ -25,6 +26,19 @@ class ServiceForm(forms.Form):
 
     any_sender = forms.BooleanField(required=False, label="Любой отправитель")
 
+    # Необязательное условие по тексту SMS
+    text_match = forms.ChoiceField(
+        choices=TEXT_MATCH_TYPES,
+        initial='any',
+        required=False,
+        label='Условие по тексту'
+    )
+    text_pattern = forms.CharField(
+        required=False,
+        widget=forms.Textarea,
+        label='Шаблон текста'
+    )
+
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
@@ -34,6 +48,36 @@ class ServiceForm(forms.Form):
             self.fields['telephone'].queryset = NumbersService.objects.filter(user=user)
             self.fields['telegram_chat'].queryset = TelegramChats.objects.filter(user=user)
 
+    def clean(self):
+        cleaned_data = super().clean()
+        text_match = cleaned_data.get('text_match') or 'any'
+        text_pattern = cleaned_data.get('text_pattern', '').strip()
+
+        if text_match == 'keywords' and not parse_keywords(text_pattern):
+            self.add_error('text_pattern', 'Укажите хотя бы одно ключевое слово.')
+        elif text_match == 'regex':
+            try:
+                compile_pattern(text_pattern)
+            except re.error as e:
+                self.add_error('text_pattern', f'Некорректное регулярное выражение: {e}')
+            if not text_pattern:
+                self.add_error('text_pattern', 'Укажите регулярное выражение.')
+        elif text_match == 'any':
+            text_pattern = ''
+
+        cleaned_data['text_match'] = text_match
+        cleaned_data['text_pattern'] = text_pattern
+        return cleaned_data
+
+
+class RulesImportForm(forms.Form):
+    file = forms.FileField(label='Файл CSV или JSON')
+    format = forms.ChoiceField(
+        choices=[('', 'По расширению файла'), ('csv', 'CSV'), ('json', 'JSON')],
+        required=False,
+        label='Формат'
+    )
+
 
 class ServiceKeyForm(forms.Form):
     service = forms.ChoiceField(
@@ -53,13 +97,5 @@ class ServiceKeyForm(forms.Form):
             self.fields['telephone'].required = False  # Иначе оно не обязательно
 
     def clean_telephone(self):
-        telephone = self.cleaned_data.get('telephone', '').strip()
-
-        # Убираем все нецифровые символы
-        telephone = re.sub(r'\D', '', telephone)
-
-        # Проверяем, что номер начинается с 7 и состоит из 11 цифр
-        if len(telephone) != 11 or not telephone.startswith('7'):
-            raise ValidationError('Номер телефона должен быть в формате 7XXXXXXXXXX (11 цифр, начинающихся с 7).')
-
-        return telephone
+        # Тот же формат 7XXXXXXXXXX, что и в API (NumbersServiceSerializer)
+        return clean_service_phone(self.cleaned_data.get('telephone', ''))
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from telegram import Update
+
+from users_app.management.commands.bench_webhook import FakeTelegramServer
+from users_app.models import TelegramChats, User
+from users_app.telegram_bot import build_application
+from users_app.telegram_client import build_bot
+
+
+class DatabaseLatency:
+    """Добавляет задержку к каждому SQL-запросу (имитация сетевой БД)."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+    def on_connection_created(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self.on_connection_created)
+
+
+def build_updates(phone_prefix, telegram_base, users):
+    """
+    Для каждого пользователя: два одинаковых контакта подряд (гонка регистрации)
+    и /start в группе после регистрации. На каждое обновление бот отвечает
+    одним сообщением.
+    """
+    now = int(time.time())
+    updates = []
+
+    def message(i, chat, **fields):
+        return {
+            'update_id': len(updates) + 1,
+            'message': {
+                'message_id': len(updates) + 1,
+                'date': now,
+                'chat': chat,
+                'from': {'id': telegram_base + i, 'is_bot': False, 'first_name': f'Bench {i}'},
+                **fields,
+            },
+        }
+
+    for i in range(users):
+        private = {'id': telegram_base + i, 'type': 'private'}
+        contact = {'phone_number': f'+{phone_prefix}{i:05d}', 'first_name': f'Bench {i}', 'user_id': telegram_base + i}
+        for _ in range(2):
+            updates.append(message(i, private, contact=contact))
+    for i in range(users):
+        group = {'id': -(telegram_base + i), 'type': 'group', 'title': f'Bench group {i}'}
+        updates.append(message(i, group, text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}]))
+    return updates
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks Telegram bot update processing at different concurrency limits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--concurrency', default='1,16', help='Comma-separated TELEGRAM_BOT_CONCURRENT_UPDATES values')
+        parser.add_argument('--telegram-latency', type=float, default=0.05, help='Fake Bot API latency, seconds')
+        parser.add_argument('--db-latency', type=float, default=0.005, help='Added latency per SQL query, seconds')
+        parser.add_argument('--keep-password-hasher', action='store_true',
+                            help='Keep the configured password hasher (CPU-bound PBKDF2 hides the I/O gain)')
+        parser.add_argument('--timeout', type=float, default=120)
+        parser.add_argument('--keep-data', action='store_true', help='Do not delete registered users')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    async def run_phase(self, options, concurrency, updates):
+        server = FakeTelegramServer(latency=options['telegram_latency'])
+        port = await server.start()
+        errors = []
+
+        async def on_error(update, context):
+            errors.append(repr(context.error))
+
+        overrides = {
+            'TELEGRAM_API_BASE_URL': f'http://127.0.0.1:{port}/bot',
+            'TELEGRAM_BOT_CONCURRENT_UPDATES': concurrency,
+        }
+        if not options['keep_password_hasher']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        try:
+            with override_settings(**overrides):
+                application = build_application(build_bot(), polling=False)
+                application.add_error_handler(on_error)
+                await application.initialize()
+                await application.start()
+                try:
+                    started = time.perf_counter()
+                    for data in updates:
+                        await application.update_queue.put(Update.de_json(data, application.bot))
+                    # Каждое обновление заканчивается одним ответом бота или ошибкой
+                    deadline = started + options['timeout']
+                    while server.messages + len(errors) < len(updates) and time.perf_counter() < deadline:
+                        await asyncio.sleep(0.01)
+                    duration = time.perf_counter() - started
+                finally:
+                    await application.stop()
+                    await application.shutdown()
+        finally:
+            await server.stop()
+        return duration, server.messages, errors
+
+    def handle(self, *args, **options):
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        logging.getLogger('users_app.telegram_bot').setLevel(logging.WARNING)
+        if options['db_latency']:
+            DatabaseLatency(options['db_latency']).install()
+
+        phases = []
+        for concurrency in [int(value) for value in options['concurrency'].split(',') if value.strip()]:
+            # Свои пользователи на каждый прогон: все регистрируются заново
+            run = secrets.randbelow(10 ** 5)
+            phone_prefix = f'7{run:05d}'
+            telegram_base = 9 * 10 ** 11 + run * 10 ** 5
+            updates = build_updates(phone_prefix, telegram_base, options['users'])
+            try:
+                duration, replies, errors = asyncio.run(self.run_phase(options, concurrency, updates))
+                users = User.objects.filter(phone__startswith=phone_prefix)
+                phases.append({
+                    'concurrency': concurrency,
+                    'updates': len(updates),
+                    'duration_s': round(duration, 3),
+                    'updates_per_s': round(len(updates) / duration, 1) if duration else None,
+                    'replies': replies,
+                    'errors': len(errors),
+                    'error_samples': errors[:5],
+                    # Обе копии контакта должны дать одного пользователя
+                    'registered_users': users.count(),
+                    'chats_added': TelegramChats.objects.filter(user__in=users).count(),
+                })
+            finally:
+                if not options['keep_data']:
+                    User.objects.filter(phone__startswith=phone_prefix).delete()
+
+        baseline = phases[0]['updates_per_s'] if phases else None
+        for phase in phases:
+            phase['speedup'] = round(phase['updates_per_s'] / baseline, 2) if baseline and phase['updates_per_s'] else None
+
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'config': {
+                key: options[key] for key in (
+                    'users', 'concurrency', 'telegram_latency', 'db_latency', 'keep_password_hasher',
+                )
+            },
+            'phases': phases,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
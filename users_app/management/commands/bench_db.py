@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from users_app.db import prepare_connection
+from users_app.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measures DB queries per second with reconnect-per-query vs persistent connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500)
+
+    def run(self, queries, before_query):
+        started = time.perf_counter()
+        for _ in range(queries):
+            before_query()
+            User.objects.filter(telegram_id='bench').exists()
+        return queries / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        queries = options['queries']
+
+        def reconnect():
+            # Старое поведение хелперов бота: новое соединение на каждый запрос
+            connections.close_all()
+            connection.ensure_connection()
+
+        before = self.run(queries, reconnect)
+        connections.close_all()
+        after = self.run(queries, prepare_connection)
+
+        self.stdout.write(f'reconnect per query:   {before:10.1f} queries/s')
+        self.stdout.write(f'persistent connection: {after:10.1f} queries/s')
+        self.stdout.write(f'speedup:               {after / before:10.1f}x')
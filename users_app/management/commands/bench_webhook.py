@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import resource
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+import httpx
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from users_app.models import NumbersService, Rules, TelegramChats, User
+
+FORMATS = ('root', 'result', 'data')
+
+
+class FakeTelegramServer:
+    """
+    Минимальный HTTP/1.1 сервер вместо api.telegram.org: отвечает на getMe и
+    sendMessage, держит keep-alive и считает отправленные сообщения.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _result(self, method, body):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'sendMessage':
+            self.messages += 1
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            if not params:
+                params = json.loads(body or b'{}')
+            return {
+                'message_id': self.messages,
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'supergroup'},
+                'text': params.get('text', ''),
+            }
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                path = request_line.decode().split(' ')[1]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                payload = json.dumps({'ok': True, 'result': self._result(path.rsplit('/', 1)[-1], body)}).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: %d\r\n\r\n' % len(payload) + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class QueryCounter:
+    """Считает SQL-запросы во всех соединениях, открытых после install()."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def on_connection_created(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self.on_connection_created)
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга по отсортированному списку."""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def build_payload(sms, sms_format):
+    if sms_format == 'result':
+        return {'result': sms}
+    if sms_format == 'data':
+        return {'data': sms}
+    return sms
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the SMS webhook through the ASGI app against a fake Telegram Bot API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--rules-per-user', type=int, default=20)
+        parser.add_argument('--fanout', type=int, default=2, help='Rules (chats) matched by every SMS')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--formats', default='root', help='Comma-separated: root,result,data')
+        parser.add_argument('--telegram-latency', type=float, default=0.0, help='Fake Bot API latency, seconds')
+        parser.add_argument('--outbox', action='store_true', help='Enqueue to the outbox instead of sending')
+        parser.add_argument('--keep-rate-limits', action='store_true',
+                            help='Keep the configured Telegram rate limits (disabled by default)')
+        parser.add_argument('--keep-data', action='store_true', help='Do not delete generated users')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def create_data(self, options):
+        """Создает пользователей, номера, каналы и правила для нагрузки."""
+        run_id = secrets.token_hex(4)
+        fanout = min(options['fanout'], options['rules_per_user'])
+        targets = []
+        for i in range(options['users']):
+            user = User.objects.create_user(
+                email=f'bench-{run_id}-{i}@bench.local',
+                phone=f'bench-{run_id}-{i}',
+                password=None,
+            )
+            number = NumbersService.objects.create(user=user, name='Novofon', telephone=f'7900{run_id}{i:04d}')
+            chats = TelegramChats.objects.bulk_create([
+                TelegramChats(user=user, title=f'bench {k}', chat_id=str(-1000000 - k))
+                for k in range(max(fanout, 1))
+            ])
+            Rules.objects.bulk_create(
+                # Первые fanout правил срабатывают на каждую SMS, остальные — на других отправителей
+                Rules(
+                    user=user,
+                    sender='BENCH' if k < fanout else f'OTHER{k}',
+                    from_whom=number,
+                    to_whom=chats[k % len(chats)],
+                )
+                for k in range(options['rules_per_user'])
+            )
+            targets.append((user.token_url, number.telephone))
+        return run_id, targets
+
+    async def run_load(self, options, targets):
+        from sms_analizator_service.asgi import application, on_shutdown, on_startup
+
+        formats = [item.strip() for item in options['formats'].split(',') if item.strip() in FORMATS] or ['root']
+        warmup = options['warmup']
+        total = warmup + options['requests']
+        latencies = []
+        status_codes = {}
+        transport = httpx.ASGITransport(app=application)
+        # ASGITransport не отправляет lifespan: запускаем его обработчики сами
+        await on_startup()
+
+        async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+            async def worker(numbers, measure):
+                # Воркеры делят один итератор номеров запросов
+                for number in numbers:
+                    token, telephone = targets[number % len(targets)]
+                    sms = {'caller_id': 'BENCH', 'caller_did': telephone, 'text': f'Bench SMS {number}'}
+                    started = time.perf_counter()
+                    response = await client.post(
+                        f'/webhook/{token}/',
+                        json=build_payload(sms, formats[number % len(formats)]),
+                    )
+                    if measure:
+                        latencies.append((time.perf_counter() - started) * 1000)
+                        status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+            async def run_phase(numbers, measure):
+                numbers = iter(numbers)
+                await asyncio.gather(*(worker(numbers, measure) for _ in range(options['concurrency'])))
+
+            # Прогрев: построение индексов правил, соединения с БД и Bot API
+            await run_phase(range(warmup), measure=False)
+
+            self.queries.count = 0
+            started = time.perf_counter()
+            await run_phase(range(warmup, total), measure=True)
+            duration = time.perf_counter() - started
+            queries = self.queries.count
+
+        await on_shutdown()
+        return latencies, status_codes, duration, queries
+
+    async def run(self, options, targets):
+        server = FakeTelegramServer(latency=options['telegram_latency'])
+        port = await server.start()
+        overrides = {
+            'TELEGRAM_API_BASE_URL': f'http://127.0.0.1:{port}/bot',
+            'TELEGRAM_OUTBOX_ENABLED': options['outbox'],
+            # Бот ходит в фейковый сервер, настоящий токен не нужен
+            'TOKEN_BOT': '123:bench',
+        }
+        if not options['keep_rate_limits']:
+            overrides.update(
+                TELEGRAM_GLOBAL_RATE=1e9,
+                TELEGRAM_GROUP_RATE_PER_MINUTE=1e9,
+                TELEGRAM_PRIVATE_RATE=1e9,
+                TELEGRAM_CHAT_BURST=1e9,
+            )
+        try:
+            with override_settings(**overrides):
+                result = await self.run_load(options, targets)
+        finally:
+            await server.stop()
+        return result + (server.messages,)
+
+    def handle(self, *args, **options):
+        # httpx пишет INFO на каждый запрос
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        self.queries = QueryCounter()
+        self.queries.install()
+
+        run_id, targets = self.create_data(options)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            latencies, status_codes, duration, queries, messages = asyncio.run(self.run(options, targets))
+        finally:
+            if not options['keep_data']:
+                User.objects.filter(email__startswith=f'bench-{run_id}-').delete()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        latencies.sort()
+        measured = len(latencies)
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'config': {
+                key: options[key] for key in (
+                    'users', 'rules_per_user', 'fanout', 'requests', 'warmup', 'concurrency',
+                    'formats', 'telegram_latency', 'outbox', 'keep_rate_limits',
+                )
+            },
+            'requests': measured,
+            'status_codes': {str(code): count for code, count in sorted(status_codes.items())},
+            'duration_s': round(duration, 3),
+            'rps': round(measured / duration, 1) if duration else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'mean': round(sum(latencies) / measured, 2),
+                'max': round(latencies[-1], 2),
+            } if measured else None,
+            'db_queries_per_request': round(queries / measured, 2) if measured else None,
+            # Все сообщения, включая прогрев
+            'telegram_messages': messages,
+            'memory': {
+                # ru_maxrss в Linux измеряется в килобайтах
+                'max_rss_mb': round(rss_after / 1024, 1),
+                'rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+            },
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users_app import dedup
+
+
+class Command(BaseCommand):
+    help = 'Deletes webhook deduplication fingerprints older than WEBHOOK_DEDUP_WINDOW'
+
+    def handle(self, *args, **options):
+        deleted = dedup.cleanup()
+        self.stdout.write(f'Deleted fingerprints: {deleted}')
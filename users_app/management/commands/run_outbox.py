@@ -0,0 +1,21 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users_app.outbox import run_worker
+from utils.metrics import start_http_server
+
+
+class Command(BaseCommand):
+    help = 'Runs the Telegram delivery outbox worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=settings.OUTBOX_POLL_INTERVAL)
+        parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port')
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_http_server(options['metrics_port'], settings.METRICS_BIND_ADDR)
+        asyncio.run(run_worker(options['batch_size'], options['poll_interval']))
@@ -1,9 +1,26 @@
 import secrets
 
 from django.contrib.auth.models import BaseUserManager
+from django.db import models
+
+from users_app import user_cache
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # update() не вызывает save() и сигналы: кеши пользователей (токен
+        # вебхука, поиск ботом) сбрасываем сами по значениям до изменения
+        affected = list(self.values_list('id', 'token_url', 'telegram_id', 'phone'))
+        rows = super().update(**kwargs)
+        for user_id, token, telegram_id, phone in affected:
+            user_cache.invalidate_user(user_id, token, telegram_id=telegram_id, phone=phone)
+        return rows
 
 
 class UserManager(BaseUserManager):
+    def get_queryset(self):
+        return UserQuerySet(self.model, using=self._db)
+
     def create_user(self, password=None, **extra_fields):
         # Генерация токена, если не задан
         if 'token_url' not in extra_fields or not extra_fields['token_url']:
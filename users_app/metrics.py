@@ -0,0 +1,58 @@
+"""
+Метрики сервиса (отдаются по /metrics, см. utils/metrics.py).
+"""
+from utils.metrics import Counter, Histogram
+
+WEBHOOK_REQUESTS = Counter(
+    'webhook_requests_total',
+    'Запросы вебхука по эндпоинту и HTTP-статусу',
+    ['endpoint', 'status'],
+)
+
+# Этапы: parse, user_lookup, dedup, rule_load, match, send, enqueue, total
+WEBHOOK_STAGE_SECONDS = Histogram(
+    'webhook_stage_seconds',
+    'Длительность этапов обработки вебхука, сек',
+    ['stage'],
+)
+
+# remembered — подошел запомненный формат токена, detected — формат найден перебором
+SMS_FORMAT_DETECTIONS = Counter(
+    'sms_format_detections_total',
+    'Распознавание формата входящих SMS',
+    ['result'],
+)
+
+TELEGRAM_SEND_SECONDS = Histogram(
+    'telegram_send_seconds',
+    'Длительность одного вызова sendMessage, сек',
+    ['result'],
+)
+
+TELEGRAM_THROTTLED = Counter(
+    'telegram_throttled_total',
+    'Отправки, задержанные ограничителем скорости',
+)
+
+TELEGRAM_RETRY_AFTER = Counter(
+    'telegram_retry_after_total',
+    'Ответы RetryAfter от Telegram',
+)
+
+BOT_HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds',
+    'Длительность обработчиков Telegram-бота, сек',
+    ['handler'],
+)
+
+DB_RETRIES = Counter(
+    'db_retries_total',
+    'Повторы запросов к БД после потери соединения',
+    ['operation'],
+)
+
+CIRCUIT_BREAKER_OPENED = Counter(
+    'circuit_breaker_opened_total',
+    'Сколько раз размыкался автоматический выключатель',
+    ['name'],
+)
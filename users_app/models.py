@@ -2,7 +2,9 @@ import secrets
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
+from users_app import user_cache
 from users_app.managers import UserManager
 
 KEY_TYPES = (
@@ -11,6 +13,30 @@ KEY_TYPES = (
     ('Mango', 'Mango')
 )
 
+OUTBOX_STATUSES = (
+    ('pending', 'Ожидает отправки'),
+    ('sending', 'Отправляется'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Ошибка'),
+)
+
+SMS_DELIVERY_STATUSES = (
+    ('no_rules', 'Правило не найдено'),
+    ('sent', 'Отправлено'),
+    ('partial', 'Отправлено частично'),
+    ('failed', 'Ошибка отправки'),
+    ('queued', 'В очереди'),
+)
+
+TEXT_MATCH_TYPES = (
+    ('any', 'Любой текст'),
+    ('keywords', 'Ключевые слова'),
+    ('regex', 'Регулярное выражение'),
+)
+
+# Значение поля Rules.sender, при котором правило срабатывает на любого отправителя
+ANY_SENDER = 'Любой отправитель'
+
 
 class User(AbstractUser):
     username = None
@@ -56,6 +82,7 @@ class User(AbstractUser):
         if not self.token_url:
             self.token_url = secrets.token_urlsafe(32)
         super().save(*args, **kwargs)
+        user_cache.invalidate_user(self.pk, self.token_url, telegram_id=self.telegram_id, phone=self.phone)
 
 
 class Key(models.Model):
@@ -143,6 +170,18 @@ class Rules(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Куда'
     )
+    text_match = models.CharField(
+        max_length=20,
+        choices=TEXT_MATCH_TYPES,
+        default='any',
+        verbose_name='Условие по тексту'
+    )
+    text_pattern = models.TextField(
+        blank=True,
+        default='',
+        help_text='Ключевые слова через запятую или с новой строки, либо регулярное выражение',
+        verbose_name='Шаблон текста'
+    )
 
     class Meta:
         verbose_name = 'Правило'
@@ -150,3 +189,175 @@ class Rules(models.Model):
 
     def __str__(self):
         return f'{self.user}'
+
+
+class TelegramOutbox(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    rule = models.ForeignKey(
+        Rules,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Правило'
+    )
+    chat_id = models.CharField(
+        max_length=250,
+        verbose_name='ID чата ТГ'
+    )
+    text = models.TextField(
+        verbose_name='Текст сообщения'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=OUTBOX_STATUSES,
+        default='pending',
+        verbose_name='Статус'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Попыток отправки'
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Следующая попытка'
+    )
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Взято в работу'
+    )
+    last_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='Последняя ошибка'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создано'
+    )
+    sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Отправлено'
+    )
+    delivery_key = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name='Ключ SMS в истории'
+    )
+
+    class Meta:
+        verbose_name = 'Сообщение в очереди'
+        verbose_name_plural = 'Очередь сообщений'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['chat_id', 'status']),
+        ]
+
+    def __str__(self):
+        return f'{self.chat_id} ({self.status})'
+
+
+class InboundSms(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    caller_id = models.CharField(
+        max_length=250,
+        verbose_name='Отправитель'
+    )
+    caller_did = models.CharField(
+        max_length=250,
+        verbose_name='Номер получателя'
+    )
+    text = models.TextField(
+        verbose_name='Текст SMS'
+    )
+    received_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Получено'
+    )
+    matched_rule_ids = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Сработавшие правила'
+    )
+    delivery_status = models.CharField(
+        max_length=20,
+        choices=SMS_DELIVERY_STATUSES,
+        verbose_name='Статус доставки'
+    )
+    # Связь с сообщениями TelegramOutbox той же SMS (режим очереди)
+    delivery_key = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name='Ключ доставки'
+    )
+
+    class Meta:
+        verbose_name = 'Входящая SMS'
+        verbose_name_plural = 'Входящие SMS'
+        indexes = [
+            models.Index(fields=['user', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.caller_id} -> {self.caller_did}'
+
+
+class WebhookFingerprint(models.Model):
+    fingerprint = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='Отпечаток SMS'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Получено'
+    )
+
+    class Meta:
+        verbose_name = 'Отпечаток вебхука'
+        verbose_name_plural = 'Отпечатки вебхука'
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return self.fingerprint
+
+
+class ConfigVersion(models.Model):
+    """Версия настроек пользователя (правила, номера, каналы, ключи) для ETag API."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Пользователь'
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия'
+    )
+
+    class Meta:
+        verbose_name = 'Версия настроек'
+        verbose_name_plural = 'Версии настроек'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.version}'
@@ -0,0 +1,231 @@
+"""
+Очередь доставки сообщений в Telegram (transactional outbox).
+
+Вебхук записывает по строке TelegramOutbox на каждое сработавшее правило и
+сразу отвечает провайдеру. Воркер (manage.py run_outbox) забирает строки
+пачками, отправляет их и помечает результат. Строки, взятые в работу
+упавшим воркером, возвращаются в очередь через OUTBOX_LOCK_TIMEOUT секунд.
+
+Сообщения одного чата уходят в порядке постановки: чат, у которого есть
+более раннее неотправленное сообщение (перенесенное или отправляемое другим
+воркером), пропускается, пока это сообщение не будет обработано. Итог
+доставки переносится в историю SMS (InboundSms.delivery_key), когда все
+сообщения SMS отправлены или окончательно не доставлены.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef, Q
+from django.utils import timezone
+from telegram.error import RetryAfter
+
+from users_app.db import run_db
+from users_app.delivery import ChatSkipped, send_to_chats
+from users_app.models import InboundSms, TelegramOutbox
+from users_app.rate_limit import get_limiter, retry_after_seconds
+from users_app.telegram_client import build_bot
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(user_id, deliveries, delivery_keys=None, history=()):
+    """
+    Ставит сообщения в очередь одной транзакцией.
+
+    Args:
+        user_id: ID пользователя
+        deliveries: Пары (сработавшее правило CompiledRule, текст сообщения)
+        delivery_keys: Ключ записи истории для каждого сообщения ('' — без истории)
+        history: Записи InboundSms этих SMS; сохраняются в той же транзакции,
+            чтобы воркер мог обновить их статус
+
+    Returns:
+        int: Количество поставленных в очередь сообщений
+    """
+    keys = delivery_keys or [''] * len(deliveries)
+    items = [
+        TelegramOutbox(user_id=user_id, rule_id=rule.id, chat_id=rule.chat_id, text=text, delivery_key=key)
+        for (rule, text), key in zip(deliveries, keys)
+    ]
+    with transaction.atomic():
+        TelegramOutbox.objects.bulk_create(items)
+        if history:
+            InboundSms.objects.bulk_create(history)
+    return len(items)
+
+
+def claim_batch(limit):
+    """
+    Забирает пачку готовых к отправке сообщений и помечает их как 'sending'.
+
+    Args:
+        limit: Максимальный размер пачки
+
+    Returns:
+        list[TelegramOutbox]: Сообщения в порядке постановки в очередь
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # Возвращаем в очередь сообщения, зависшие у упавшего воркера
+        TelegramOutbox.objects.filter(
+            status='sending',
+            locked_at__lt=now - timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT),
+        ).update(status='pending', locked_at=None)
+
+        # Более раннее сообщение того же чата ждет повтора или уже отправляется
+        earlier_unsent = TelegramOutbox.objects.filter(
+            Q(status='sending') | Q(status='pending', next_attempt_at__gt=now),
+            chat_id=OuterRef('chat_id'),
+            id__lt=OuterRef('id'),
+        )
+        items = list(
+            TelegramOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .exclude(Exists(earlier_unsent))
+            .order_by('id')[:limit]
+        )
+        if items:
+            # Готовые сообщения, пропущенные skip_locked, забирает другой воркер:
+            # более поздние сообщения тех же чатов ждут следующей пачки
+            blocked = dict(
+                TelegramOutbox.objects
+                .filter(
+                    chat_id__in={item.chat_id for item in items},
+                    status__in=('pending', 'sending'),
+                    id__lt=items[-1].id,
+                )
+                .exclude(id__in=[item.id for item in items])
+                .values('chat_id')
+                .annotate(first_id=Min('id'))
+                .values_list('chat_id', 'first_id')
+            )
+            items = [item for item in items if item.id < blocked.get(item.chat_id, item.id + 1)]
+        if items:
+            TelegramOutbox.objects.filter(id__in=[item.id for item in items]).update(
+                status='sending',
+                locked_at=now,
+            )
+    return items
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повторной отправкой, сек."""
+    return min(5 * 2 ** (attempts - 1), 600)
+
+
+def complete_batch(items, results):
+    """
+    Сохраняет результаты отправки пачки.
+
+    Args:
+        items: Сообщения из claim_batch
+        results: Результаты send_to_chats в том же порядке
+    """
+    now = timezone.now()
+    sent_ids = [item.id for item, error in zip(items, results) if error is None]
+    if sent_ids:
+        TelegramOutbox.objects.filter(id__in=sent_ids).update(
+            status='sent',
+            sent_at=now,
+            locked_at=None,
+        )
+
+    for item, error in zip(items, results):
+        if error is None:
+            continue
+        item.last_error = str(error)[:1000]
+        item.locked_at = None
+        if isinstance(error, (RetryAfter, ChatSkipped)):
+            # Лимит Telegram или ожидание более раннего сообщения чата — не
+            # ошибка доставки: переносим без траты попытки
+            item.status = 'pending'
+            delay = retry_after_seconds(error) if isinstance(error, RetryAfter) else 0
+            item.next_attempt_at = now + timedelta(seconds=delay)
+            item.save(update_fields=['last_error', 'locked_at', 'status', 'next_attempt_at'])
+            continue
+
+        item.attempts += 1
+        if item.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            item.status = 'failed'
+            logger.error(f"💥 OUTBOX: сообщение {item.id} в чат {item.chat_id} не доставлено: {error}")
+        else:
+            item.status = 'pending'
+            item.next_attempt_at = now + timedelta(seconds=retry_delay(item.attempts))
+        item.save(update_fields=['attempts', 'last_error', 'locked_at', 'status', 'next_attempt_at'])
+
+    update_history({item.delivery_key for item in items if item.delivery_key})
+
+
+def update_history(keys):
+    """
+    Переносит итог доставки в историю SMS.
+
+    Args:
+        keys: Ключи доставки (InboundSms.delivery_key); SMS, у которых еще
+            есть сообщения в очереди, остаются в статусе 'queued'
+    """
+    if not keys:
+        return
+    statuses = {}
+    for key, status in TelegramOutbox.objects.filter(delivery_key__in=keys).values_list('delivery_key', 'status'):
+        statuses.setdefault(key, []).append(status)
+
+    keys_by_status = {}
+    for key, values in statuses.items():
+        if 'pending' in values or 'sending' in values:
+            continue
+        sent = values.count('sent')
+        delivery_status = 'sent' if sent == len(values) else 'partial' if sent else 'failed'
+        keys_by_status.setdefault(delivery_status, []).append(key)
+    for delivery_status, status_keys in keys_by_status.items():
+        InboundSms.objects.filter(delivery_key__in=status_keys).update(delivery_status=delivery_status)
+
+
+async def process_batch(bot, limit):
+    """
+    Отправляет одну пачку сообщений.
+
+    Returns:
+        int: Размер обработанной пачки
+    """
+    items = await run_db(claim_batch, limit)
+    if not items:
+        return 0
+
+    # Долгие паузы RetryAfter не пережидаем, а переносим в очереди
+    results = await send_to_chats(
+        bot,
+        [(item.chat_id, item.text) for item in items],
+        max_retry_wait=settings.OUTBOX_RETRY_AFTER_MAX_WAIT,
+        stop_chat_on_error=True,
+    )
+    await run_db(complete_batch, items, results)
+
+    sent_count = sum(1 for error in results if error is None)
+    deferred_count = sum(1 for error in results if isinstance(error, (RetryAfter, ChatSkipped)))
+    stats = get_limiter().stats
+    logger.info(
+        f"📊 OUTBOX: отправлено {sent_count} из {len(items)} сообщений, перенесено {deferred_count} "
+        f"(всего ограничено: {stats['throttled']}, отложено: {stats['deferred']})"
+    )
+    return len(items)
+
+
+async def run_worker(batch_size, poll_interval):
+    """Бесконечный цикл разбора очереди."""
+    logger.info("Запуск воркера очереди Telegram...")
+    async with build_bot() as bot:
+        while True:
+            try:
+                processed = await process_batch(bot, batch_size)
+            except Exception as e:
+                logger.error(f"💥 OUTBOX: ошибка обработки очереди: {e}")
+                processed = 0
+
+            # Пустая или неполная пачка — очередь разобрана, ждем новые сообщения
+            if processed < batch_size:
+                await asyncio.sleep(poll_interval)
@@ -0,0 +1,196 @@
+"""
+Справочник номеров для общего вебхука провайдера (provider/webhook/<token>/).
+
+Один аккаунт провайдера присылает SMS всех клиентов на один адрес, а клиент
+определяется по caller_did: NumbersService.telephone уникален на всю базу.
+Справочник телефон -> WebhookUser (id, phone, is_active) целиком лежит в
+памяти процесса: он загружается одним запросом при старте ASGI-приложения и
+обновляется сигналами NumbersService и User, поэтому запрос вебхука не ходит
+в БД за пользователем. Правила берутся из индекса users_app/rules_index.py.
+
+Изменения из других процессов видны после полной перезагрузки справочника
+раз в PHONE_DIRECTORY_TTL секунд. Номера запроса, которых нет в справочнике,
+проверяются одним запросом на все; отсутствующие номера запоминаются на
+PHONE_DIRECTORY_NEGATIVE_TTL секунд.
+"""
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from users_app.models import NumbersService
+from users_app.user_cache import WebhookUser
+from utils.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# телефон -> user_id
+_phones = {}
+# NumbersService.id -> телефон, чтобы убрать старый номер при его изменении
+_numbers = {}
+# user_id -> WebhookUser
+_users = {}
+_unknown_phones = TTLCache(
+    maxsize=settings.WEBHOOK_TOKEN_CACHE_SIZE,
+    ttl=settings.PHONE_DIRECTORY_NEGATIVE_TTL,
+)
+_loaded_at = None
+_reloading = False
+# Увеличивается при каждом изменении; загрузка, во время которой справочник
+# менялся, считается сразу устаревшей
+_generation = 0
+_lock = threading.Lock()
+
+
+def normalize_phone(value):
+    """Номер в формате NumbersService.telephone: только цифры."""
+    return re.sub(r'\D', '', str(value or ''))
+
+
+def _webhook_user(user):
+    return WebhookUser(user.id, user.phone, user.is_active)
+
+
+def load():
+    """
+    Загружает все номера с владельцами одним запросом.
+
+    Синхронная функция: из async-кода вызывается через run_db.
+
+    Returns:
+        Количество номеров в справочнике
+    """
+    global _phones, _numbers, _users, _loaded_at, _reloading
+    try:
+        generation = _generation
+        phones, numbers, users = {}, {}, {}
+        rows = NumbersService.objects.values_list(
+            'id', 'telephone', 'user_id', 'user__phone', 'user__is_active'
+        )
+        for number_id, telephone, user_id, phone, is_active in rows:
+            telephone = normalize_phone(telephone)
+            phones[telephone] = user_id
+            numbers[number_id] = telephone
+            users[user_id] = WebhookUser(user_id, phone, is_active)
+
+        with _lock:
+            _phones, _numbers, _users = phones, numbers, users
+            _loaded_at = time.monotonic() if _generation == generation else None
+        _unknown_phones.clear()
+    finally:
+        _reloading = False
+    logger.info("📒 Справочник номеров загружен: %s номеров, %s пользователей", len(phones), len(users))
+    return len(phones)
+
+
+def claim_reload():
+    """
+    Проверяет, пора ли перезагрузить справочник.
+
+    Returns:
+        True, если вызывающий должен выполнить load(); одновременно
+        перезагрузку получает только один запрос, остальные работают со
+        старыми данными
+    """
+    global _reloading
+    with _lock:
+        fresh = _loaded_at is not None and time.monotonic() - _loaded_at < settings.PHONE_DIRECTORY_TTL
+        if fresh or _reloading:
+            return False
+        _reloading = True
+        return True
+
+
+def get(phone):
+    """
+    Возвращает владельца номера из памяти.
+
+    Args:
+        phone: Номер из normalize_phone
+
+    Returns:
+        WebhookUser; None, если номер недавно не нашелся в БД; MISSING, если
+        номера нет в справочнике и его нужно проверить через load_phones
+    """
+    user_id = _phones.get(phone)
+    if user_id is not None:
+        return _users.get(user_id, MISSING)
+    return None if _unknown_phones.get(phone) is not MISSING else MISSING
+
+
+def load_phones(phones):
+    """
+    Ищет номера, которых нет в справочнике (например, добавлены в другом
+    процессе), одним запросом.
+
+    Синхронная функция: из async-кода вызывается через run_db.
+
+    Returns:
+        dict: телефон -> WebhookUser или None
+    """
+    return _remember_phones(phones, NumbersService.objects.select_related('user').filter(telephone__in=phones))
+
+
+async def aload_phones(phones):
+    """load_phones на async ORM (settings.WEBHOOK_ASYNC_ORM)."""
+    numbers = NumbersService.objects.select_related('user').filter(telephone__in=phones)
+    return _remember_phones(phones, [number async for number in numbers])
+
+
+def _remember_phones(phones, numbers):
+    found = {}
+    for number in numbers:
+        number_saved(number)
+        found[normalize_phone(number.telephone)] = _users.get(number.user_id)
+    for phone in phones:
+        if phone not in found:
+            _unknown_phones.set(phone, True)
+            found[phone] = None
+    return found
+
+
+def number_saved(number):
+    global _generation
+    telephone = normalize_phone(number.telephone)
+    user = _users.get(number.user_id)
+    if user is None:
+        # Связанный пользователь может потребовать запрос к БД — делаем его вне блокировки
+        user = _webhook_user(number.user)
+    with _lock:
+        _generation += 1
+        # Без id (bulk_create без RETURNING) старый номер не найти — только добавляем новый
+        if number.pk is not None:
+            old = _numbers.get(number.pk)
+            if old is not None and old != telephone and _phones.get(old) == number.user_id:
+                del _phones[old]
+            _numbers[number.pk] = telephone
+        _phones[telephone] = number.user_id
+        _users.setdefault(number.user_id, user)
+    _unknown_phones.pop(telephone)
+
+
+def number_deleted(number):
+    global _generation
+    with _lock:
+        _generation += 1
+        telephone = _numbers.pop(number.id, None) or normalize_phone(number.telephone)
+        if _phones.get(telephone) == number.user_id:
+            del _phones[telephone]
+
+
+def user_saved(user):
+    global _generation
+    with _lock:
+        _generation += 1
+        if user.id in _users:
+            _users[user.id] = _webhook_user(user)
+
+
+def user_deleted(user_id):
+    # Номера пользователя удаляются каскадом со своими сигналами
+    global _generation
+    with _lock:
+        _generation += 1
+        _users.pop(user_id, None)
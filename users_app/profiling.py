@@ -0,0 +1,233 @@
+"""
+Профилирование запросов по требованию.
+
+ProfilingMiddleware снимает cProfile-профиль и журнал SQL-запросов для доли
+запросов PROFILING_SAMPLE_RATE или для запросов, в которых заголовок
+PROFILING_HEADER равен PROFILING_SECRET. Без секрета заголовок игнорируется:
+за nginx REMOTE_ADDR у всех запросов 127.0.0.1, поэтому адрес сам по себе не
+подтверждает доступ; PROFILING_ALLOWED_IPS, если задан, дополнительно
+ограничивает адреса. Результаты сохраняются в PROFILING_DIR
+(.prof для pstats/snakeviz и .json с журналом запросов к БД) и доступны
+персоналу на странице /admin/profiles/.
+
+При PROFILING_ENABLED=False middleware исключается из цепочки Django
+(MiddlewareNotUsed) и ничего не стоит.
+
+В async-view cProfile видит все корутины event loop за время запроса, в том
+числе чужие. Запросы к БД из потоков run_db попадают в журнал запроса, потому
+что run_db передает в поток контекст (contextvars).
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import secrets
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# Журнал SQL-запросов профилируемого запроса (None — запрос не профилируется)
+_query_log = contextvars.ContextVar('profiling_query_log', default=None)
+# В одном потоке может работать только один cProfile
+_state = threading.local()
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    log = _query_log.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        log.append({
+            'sql': sql,
+            'many': many,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def has_profiling_secret(request):
+    value = request.headers.get(settings.PROFILING_HEADER)
+    if not settings.PROFILING_SECRET or not value:
+        return False
+    if settings.PROFILING_ALLOWED_IPS and client_ip(request) not in settings.PROFILING_ALLOWED_IPS:
+        return False
+    return secrets.compare_digest(value.encode(), settings.PROFILING_SECRET.encode())
+
+
+def should_profile(request):
+    if has_profiling_secret(request):
+        return True
+    rate = settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+class RequestProfile:
+    """Профиль одного запроса: cProfile и журнал SQL."""
+
+    def __init__(self):
+        self.profiler = None
+        self.queries = []
+        self._token = None
+        self._started = None
+        self.duration = None
+
+    def start(self):
+        if not getattr(_state, 'profiling', False):
+            _state.profiling = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self._token = _query_log.set(self.queries)
+        self._started = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._started
+        if self.profiler is not None:
+            self.profiler.disable()
+            _state.profiling = False
+        _query_log.reset(self._token)
+
+    def save(self, request, response):
+        """Сохраняет профиль в PROFILING_DIR."""
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+
+        if self.profiler is not None:
+            self.profiler.dump_stats(os.path.join(directory, f'{name}.prof'))
+        meta = {
+            'name': name,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(self.duration * 1000, 1),
+            'has_profile': self.profiler is not None,
+            'query_count': len(self.queries),
+            'query_time_ms': round(sum(query['duration_ms'] for query in self.queries), 1),
+            'queries': self.queries,
+        }
+        with open(os.path.join(directory, f'{name}.json'), 'w') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+
+        cleanup(directory, settings.PROFILING_MAX_FILES)
+        logger.info(f"🔬 PROFILING: {request.method} {request.path} — {meta['duration_ms']} мс, "
+                    f"{meta['query_count']} SQL, профиль {name}")
+
+
+def cleanup(directory, keep):
+    """Удаляет самые старые профили сверх keep штук."""
+    names = sorted(filename[:-5] for filename in os.listdir(directory) if filename.endswith('.json'))
+    for name in names[:max(0, len(names) - keep)]:
+        for suffix in ('.json', '.prof'):
+            path = os.path.join(directory, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_profiles():
+    """Метаданные сохраненных профилей, новые первыми."""
+    directory = settings.PROFILING_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta.pop('queries', None)
+        profiles.append(meta)
+    return profiles
+
+
+def profile_path(filename):
+    """
+    Путь к файлу профиля или None, если такого файла нет.
+
+    Принимаются только имена файлов из PROFILING_DIR (без каталогов).
+    """
+    if os.path.basename(filename) != filename or not filename.endswith(('.prof', '.json')):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, filename)
+    return path if os.path.isfile(path) else None
+
+
+def stats_text(path, limit=60):
+    """Текстовый отчет pstats: самые тяжелые функции по суммарному времени."""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(_install_wrapper)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not should_profile(request):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        self._save(profile, request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not should_profile(request):
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        profile.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        await sync_to_async(self._save, thread_sensitive=False)(profile, request, response)
+        return response
+
+    def _save(self, profile, request, response):
+        try:
+            profile.save(request, response)
+        except Exception as e:
+            logger.error(f"💥 PROFILING: не удалось сохранить профиль: {e}")
@@ -0,0 +1,205 @@
+"""
+Ограничение скорости отправки в Telegram.
+
+Bot API допускает около 30 сообщений в секунду на бота, не больше 20 сообщений
+в минуту в одну группу и примерно одно сообщение в секунду в личный чат.
+TelegramRateLimiter выдерживает эти лимиты заранее (общее "ведро" токенов и
+ведро на каждый чат), а на RetryAfter приостанавливает чат и повторяет
+отправку вместо того, чтобы считать сообщение потерянным.
+
+Ни заранее рассчитанная пауза, ни пауза RetryAfter не бывают дольше
+max_retry_wait: иначе вызывающий RetryAfter получает сразу и сам переносит
+отправку (вебхук не держит запрос провайдера минутами, воркер очереди не
+держит пачку дольше OUTBOX_LOCK_TIMEOUT).
+
+Лимиты действуют в пределах процесса: при нескольких воркерах общий лимит
+TELEGRAM_GLOBAL_RATE нужно делить между ними.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from telegram.error import RetryAfter
+
+from users_app.metrics import TELEGRAM_RETRY_AFTER, TELEGRAM_SEND_SECONDS, TELEGRAM_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+# Сколько ведер чатов держать в памяти, прежде чем выбросить простаивающие
+MAX_CHAT_BUCKETS = 10000
+
+
+def retry_after_seconds(error):
+    """Возвращает задержку из RetryAfter в секундах."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """
+    Ведро токенов с резервированием.
+
+    reserve() сразу списывает токен (баланс может уйти в минус) и возвращает,
+    сколько нужно подождать до отправки. Так одновременные отправители
+    выстраиваются в очередь без циклов ожидания.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def release(self):
+        """Возвращает токен, зарезервированный для неотправленного сообщения."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds):
+        """Запрещает отправку на seconds секунд (после RetryAfter)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_idle(self, now):
+        return self.tokens >= self.capacity or now - self.updated_at > 60
+
+
+class TelegramRateLimiter:
+    """Обертка над bot.send_message с общим и початовым лимитами."""
+
+    def __init__(self, global_rate, group_rate_per_minute, private_rate, chat_burst, max_retries):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_rate_per_minute / 60
+        self.private_rate = private_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'sent': 0,
+            'throttled': 0,
+            'deferred': 0,
+        }
+
+    def _chat_bucket(self, chat_id):
+        chat_id = str(chat_id)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is not None:
+            return bucket
+
+        with self._lock:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for key in [key for key, item in self._chat_buckets.items() if item.is_idle(now)]:
+                    del self._chat_buckets[key]
+            # Отрицательный chat_id — группа или канал, положительный — личный чат
+            if chat_id.startswith('-'):
+                bucket = TokenBucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.chat_burst)
+            return self._chat_buckets.setdefault(chat_id, bucket)
+
+    def _defer(self, chat_id, delay, buckets):
+        for bucket in buckets:
+            bucket.release()
+        self.stats['deferred'] += 1
+        logger.warning(f"⏳ TELEGRAM: лимит для чата {chat_id}, отправка возможна через {delay:.1f} сек")
+        raise RetryAfter(math.ceil(delay))
+
+    async def _acquire(self, chat_id, max_wait):
+        """
+        Ждет своей очереди на отправку.
+
+        Токены чата и общего ведра резервируются одновременно, поэтому ждать
+        нужно до более позднего из двух моментов, а не сумму задержек.
+
+        Raises:
+            RetryAfter: Если ждать нужно дольше max_wait (токены возвращаются)
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        delay = chat_bucket.reserve()
+        if delay > max_wait:
+            self._defer(chat_id, delay, [chat_bucket])
+        wait = max(delay, self.global_bucket.reserve())
+        if wait > max_wait:
+            self._defer(chat_id, wait, [chat_bucket, self.global_bucket])
+        if wait:
+            await asyncio.sleep(wait)
+            self.stats['throttled'] += 1
+            TELEGRAM_THROTTLED.inc()
+
+    async def send_message(self, bot, chat_id, text, max_retry_wait=None):
+        """
+        Отправляет сообщение с соблюдением лимитов.
+
+        Args:
+            bot: telegram.Bot
+            chat_id: ID чата
+            text: Текст сообщения
+            max_retry_wait: Максимальная пауза (ограничителя или RetryAfter),
+                которую можно переждать на месте (по умолчанию
+                TELEGRAM_RETRY_AFTER_MAX_WAIT). Если ждать нужно дольше,
+                RetryAfter пробрасывается вызывающему, чтобы тот перенес
+                отправку (см. users_app/outbox.py).
+        """
+        if max_retry_wait is None:
+            max_retry_wait = settings.TELEGRAM_RETRY_AFTER_MAX_WAIT
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, max_retry_wait)
+            started = time.perf_counter()
+            try:
+                result = await bot.send_message(chat_id=chat_id, text=text)
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, result='ok')
+                self.stats['sent'] += 1
+                return result
+            except RetryAfter as e:
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, result='retry_after')
+                TELEGRAM_RETRY_AFTER.inc()
+                delay = retry_after_seconds(e)
+                self.stats['deferred'] += 1
+                self._chat_bucket(chat_id).pause(delay)
+                logger.warning(f"⏳ TELEGRAM: лимит для чата {chat_id}, повтор через {delay} сек")
+                if attempt == self.max_retries or delay > max_retry_wait:
+                    raise
+            except Exception:
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, result='error')
+                raise
+
+
+_limiter = None
+
+
+def get_limiter():
+    """Возвращает общий для процесса ограничитель скорости."""
+    global _limiter
+
+    if _limiter is None:
+        _limiter = TelegramRateLimiter(
+            global_rate=settings.TELEGRAM_GLOBAL_RATE,
+            group_rate_per_minute=settings.TELEGRAM_GROUP_RATE_PER_MINUTE,
+            private_rate=settings.TELEGRAM_PRIVATE_RATE,
+            chat_burst=settings.TELEGRAM_CHAT_BURST,
+            max_retries=settings.TELEGRAM_RETRY_AFTER_MAX_RETRIES,
+        )
+    return _limiter
@@ -0,0 +1,173 @@
+"""
+Единая политика повторов запросов к БД.
+
+Все повторы после потери соединения с MySQL (2006/2013) или ошибки
+подключения (2002/2003, ConnectError) идут через
+RetryPolicy: экспоненциальная задержка со случайным разбросом (full jitter),
+чтобы клиенты не повторяли запросы синхронно, и асинхронное ожидание, которое
+не занимает поток пула БД.
+
+Общий для процесса CircuitBreaker считает подряд идущие ошибки соединения.
+После DB_BREAKER_FAILURE_THRESHOLD ошибок он размыкается: запросы сразу
+получают CircuitOpenError (вебхук отвечает 503), а не копятся в потоках против
+недоступной БД. Через DB_BREAKER_RESET_TIMEOUT секунд пропускается один
+пробный запрос; при успехе цепь замыкается.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from users_app.db import is_connection_error, run_db
+from users_app.metrics import CIRCUIT_BREAKER_OPENED, DB_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Цепь разомкнута: ресурс считается недоступным."""
+
+
+def is_db_unavailable(error):
+    """Ошибка означает недоступность БД: нет соединения или разомкнутая цепь."""
+    return isinstance(error, CircuitOpenError) or is_connection_error(error)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Отклоняются ли сейчас запросы (цепь разомкнута или идет пробный запрос)."""
+        return self.state != self.CLOSED and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def retry_after(self):
+        """Через сколько секунд будет пробный запрос."""
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        """Можно ли выполнить запрос. После таймаута пропускает один пробный."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            # Новый пробный запрос и в том случае, если предыдущий так и не завершился
+            if now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"✅ BREAKER {self.name}: связь восстановлена")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                CIRCUIT_BREAKER_OPENED.inc(name=self.name)
+                logger.error(f"🚫 BREAKER {self.name}: цепь разомкнута на {self.reset_timeout} сек "
+                             f"после {self.failures} ошибок подряд")
+
+
+class RetryPolicy:
+    """
+    Args:
+        max_attempts: Сколько всего попыток
+        base_delay: Базовая задержка перед повтором, сек
+        max_delay: Максимальная задержка, сек
+        retry_on: Предикат: повторять ли запрос после этой ошибки
+        breaker: CircuitBreaker или None
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay, retry_on, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.breaker = breaker
+
+    def delay(self, attempt):
+        """Задержка перед попыткой attempt + 2 (full jitter)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, func, *args, operation='db', **kwargs):
+        """
+        Выполняет async-функцию с повторами.
+
+        Args:
+            func: Async-функция
+            operation: Название операции для логов и метрик
+
+        Returns:
+            Результат func
+
+        Raises:
+            CircuitOpenError: Если цепь разомкнута
+        """
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError(f'{self.breaker.name} недоступна')
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not self.retry_on(e):
+                    # Ошибка не связана с доступностью ресурса
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    raise
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    logger.error(f"💥 RETRY {operation}: ошибка после {attempt + 1} попыток: {e}")
+                    raise
+                delay = self.delay(attempt)
+                DB_RETRIES.inc(operation=operation)
+                logger.warning(f"⚠️ RETRY {operation}: нет соединения с БД (попытка {attempt + 1}/"
+                               f"{self.max_attempts}), повтор через {delay:.2f} сек: {e}")
+                await asyncio.sleep(delay)
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
+
+
+db_breaker = CircuitBreaker(
+    'db',
+    failure_threshold=settings.DB_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.DB_BREAKER_RESET_TIMEOUT,
+)
+
+db_retry = RetryPolicy(
+    max_attempts=settings.DB_RETRY_ATTEMPTS,
+    base_delay=settings.DB_RETRY_BASE_DELAY,
+    max_delay=settings.DB_RETRY_MAX_DELAY,
+    retry_on=is_connection_error,
+    breaker=db_breaker,
+)
+
+
+async def run_db_with_retry(func, *args, operation='db', **kwargs):
+    """run_db с общей политикой повторов и автоматическим выключателем БД."""
+    return await db_retry.call(run_db, func, *args, operation=operation, **kwargs)
@@ -0,0 +1,366 @@
+"""
+Скомпилированный индекс правил пересылки для горячего пути вебхука.
+
+Для каждого пользователя в памяти процесса хранится RulesIndex: словарь
+(номер получателя, отправитель) -> правила. Правила с отправителем
+ANY_SENDER лежат в отдельной "wildcard"-корзине того же номера, поэтому поиск
+подходящих правил для SMS — это два обращения к словарю вместо перебора всех
+правил пользователя.
+
+Условия по тексту SMS (Rules.text_match) проверяются только у правил, уже
+подошедших по номеру и отправителю. Ключевые слова всех правил пользователя
+собираются в один автомат Ахо — Корасик, а регулярные выражения — в одно
+общее выражение-фильтр: если оно не нашло совпадений, отдельные выражения не
+проверяются. Все это компилируется один раз при первой SMS, которой нужна
+проверка текста, и пересобирается только после изменения текстовых правил.
+
+Индекс обновляется инкрементально из сигналов (см. users_app/signals.py) при
+изменении Rules, NumbersService и TelegramChats. Сигналы срабатывают только в
+том процессе, где произошло изменение, поэтому каждый индекс дополнительно
+живет не дольше settings.RULES_INDEX_TTL секунд и затем строится заново.
+"""
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from users_app.models import ANY_SENDER, Rules
+from utils.aho_corasick import AhoCorasick
+
+logger = logging.getLogger(__name__)
+
+CompiledRule = namedtuple(
+    'CompiledRule',
+    ['id', 'sender', 'from_whom_id', 'telephone', 'to_whom_id', 'chat_id', 'chat_title',
+     'text_match', 'text_pattern']
+)
+
+# Поля для построения CompiledRule одним запросом без создания ORM-объектов
+COMPILED_RULE_FIELDS = (
+    'id',
+    'sender',
+    'from_whom_id',
+    'from_whom__telephone',
+    'to_whom_id',
+    'to_whom__chat_id',
+    'to_whom__title',
+    'text_match',
+    'text_pattern',
+)
+
+# Обратные ссылки (\1, (?P=name)) меняют смысл при объединении выражений
+_BACKREFERENCE = re.compile(r'\\\d|\(\?P=')
+
+
+def compile_rule(rule):
+    """
+    Собирает CompiledRule из ORM-объекта правила.
+
+    Args:
+        rule: Rules object
+
+    Returns:
+        CompiledRule
+    """
+    return CompiledRule(
+        id=rule.id,
+        sender=rule.sender,
+        from_whom_id=rule.from_whom_id,
+        telephone=rule.from_whom.telephone,
+        to_whom_id=rule.to_whom_id,
+        chat_id=rule.to_whom.chat_id,
+        chat_title=rule.to_whom.title,
+        text_match=rule.text_match,
+        text_pattern=rule.text_pattern,
+    )
+
+
+def parse_keywords(pattern):
+    """Разбирает ключевые слова правила: через запятую или с новой строки, без учета регистра."""
+    return [word.strip().casefold() for word in re.split(r'[,\n]', pattern) if word.strip()]
+
+
+def compile_pattern(pattern):
+    """Компилирует регулярное выражение правила (без учета регистра)."""
+    return re.compile(pattern, re.IGNORECASE)
+
+
+class TextMatcher:
+    """Скомпилированные текстовые условия всех правил пользователя."""
+
+    def __init__(self, rules):
+        keywords = []
+        self._regexes = {}
+        for rule in rules:
+            if rule.text_match == 'keywords':
+                keywords.extend((word, rule.id) for word in parse_keywords(rule.text_pattern))
+            elif rule.text_match == 'regex':
+                try:
+                    self._regexes[rule.id] = compile_pattern(rule.text_pattern)
+                except re.error as e:
+                    # Такое правило не срабатывает, но не ломает остальные
+                    logger.warning("Некорректное регулярное выражение в правиле %s: %s", rule.id, e)
+
+        self._automaton = AhoCorasick(keywords) if keywords else None
+        self._combined = self._combine(self._regexes.values())
+
+    @staticmethod
+    def _combine(regexes):
+        patterns = [regex.pattern for regex in regexes]
+        if not patterns or any(_BACKREFERENCE.search(pattern) for pattern in patterns):
+            return None
+        try:
+            return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), re.IGNORECASE)
+        except re.error:
+            # Например, глобальные флаги не в начале выражения — обходимся без фильтра
+            return None
+
+    def filter(self, rules, text):
+        """
+        Оставляет правила, текстовые условия которых выполнены.
+
+        Args:
+            rules: Правила, подошедшие по номеру и отправителю
+            text: Текст SMS
+
+        Returns:
+            list[CompiledRule]
+        """
+        keyword_hits = None
+        regex_possible = None
+        matched = []
+        for rule in rules:
+            if rule.text_match == 'keywords':
+                if keyword_hits is None:
+                    keyword_hits = self._automaton.search(text.casefold()) if self._automaton else set()
+                if rule.id in keyword_hits:
+                    matched.append(rule)
+            elif rule.text_match == 'regex':
+                if regex_possible is None:
+                    regex_possible = self._combined is None or self._combined.search(text) is not None
+                regex = self._regexes.get(rule.id)
+                if regex_possible and regex is not None and regex.search(text):
+                    matched.append(rule)
+            else:
+                matched.append(rule)
+        return matched
+
+
+class RulesIndex:
+    """
+    Индекс правил одного пользователя.
+
+    Корзины хранятся кортежами и заменяются целиком при изменении, поэтому
+    match() можно вызывать из event loop без блокировок, пока сигнал в другом
+    потоке обновляет индекс.
+    """
+
+    def __init__(self, rules=()):
+        self.built_at = time.monotonic()
+        self._by_id = {}
+        self._buckets = {}
+        self._text_rules = 0
+        self._text_matcher = None
+        # Увеличивается при изменении текстовых правил, пока строится TextMatcher
+        self._text_version = 0
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def is_expired(self, ttl):
+        return time.monotonic() - self.built_at > ttl
+
+    def add(self, rule):
+        """Добавляет правило (или заменяет правило с тем же id)."""
+        self.remove(rule.id)
+        key = (rule.telephone, rule.sender)
+        self._by_id[rule.id] = rule
+        self._buckets[key] = self._buckets.get(key, ()) + (rule,)
+        if rule.text_match != 'any':
+            self._text_rules += 1
+            self._text_version += 1
+            self._text_matcher = None
+
+    def remove(self, rule_id):
+        """Удаляет правило по id, если оно есть в индексе."""
+        rule = self._by_id.pop(rule_id, None)
+        if rule is None:
+            return
+        if rule.text_match != 'any':
+            self._text_rules -= 1
+            self._text_version += 1
+            self._text_matcher = None
+        key = (rule.telephone, rule.sender)
+        bucket = tuple(item for item in self._buckets.get(key, ()) if item.id != rule_id)
+        if bucket:
+            self._buckets[key] = bucket
+        else:
+            self._buckets.pop(key, None)
+
+    def replace_where(self, predicate, **changes):
+        """Обновляет поля у всех правил, удовлетворяющих predicate."""
+        for rule in [rule for rule in self._by_id.values() if predicate(rule)]:
+            self.add(rule._replace(**changes))
+
+    def remove_where(self, predicate):
+        """Удаляет все правила, удовлетворяющие predicate."""
+        for rule_id in [rule.id for rule in self._by_id.values() if predicate(rule)]:
+            self.remove(rule_id)
+
+    def _get_text_matcher(self):
+        matcher = self._text_matcher
+        if matcher is None:
+            version = self._text_version
+            matcher = TextMatcher(tuple(self._by_id.values()))
+            # Если правила изменились во время сборки, не кешируем устаревший результат
+            if version == self._text_version:
+                self._text_matcher = matcher
+        return matcher
+
+    def match(self, caller_did, caller_id, text=''):
+        """
+        Возвращает правила, подходящие под SMS, в порядке их id.
+
+        Args:
+            caller_did: Номер, на который пришла SMS (NumbersService.telephone)
+            caller_id: Отправитель SMS
+            text: Текст SMS для правил с условием по тексту
+
+        Returns:
+            list[CompiledRule]
+        """
+        wildcard = self._buckets.get((caller_did, ANY_SENDER), ())
+        if caller_id == ANY_SENDER:
+            candidates = wildcard
+        else:
+            exact = self._buckets.get((caller_did, caller_id), ())
+            if not wildcard:
+                candidates = exact
+            elif not exact:
+                candidates = wildcard
+            else:
+                candidates = sorted(exact + wildcard, key=lambda rule: rule.id)
+
+        if not self._text_rules or not any(rule.text_match != 'any' for rule in candidates):
+            return list(candidates)
+        return self._get_text_matcher().filter(candidates, str(text))
+
+
+# user_id -> RulesIndex
+_indexes = {}
+# user_id -> номер поколения; увеличивается при каждой инвалидации, чтобы
+# построение, начатое до изменения правил, не сохранило устаревший индекс
+_generations = {}
+_lock = threading.Lock()
+
+
+def get_cached_index(user_id):
+    """Возвращает актуальный индекс пользователя из памяти или None."""
+    index = _indexes.get(user_id)
+    if index is None or index.is_expired(settings.RULES_INDEX_TTL):
+        return None
+    return index
+
+
+def build_index(user_id):
+    """
+    Строит индекс пользователя одним запросом и кладет его в кеш.
+
+    Синхронная функция: из async-кода вызывается через sync_to_async.
+
+    Args:
+        user_id: ID пользователя
+
+    Returns:
+        RulesIndex
+    """
+    generation = _generations.get(user_id, 0)
+    return _store_index(user_id, generation, _index_rows(user_id))
+
+
+async def abuild_index(user_id):
+    """build_index на async ORM (settings.WEBHOOK_ASYNC_ORM)."""
+    generation = _generations.get(user_id, 0)
+    rows = [row async for row in _index_rows(user_id)]
+    return _store_index(user_id, generation, rows)
+
+
+def _index_rows(user_id):
+    return (
+        Rules.objects
+        .filter(user_id=user_id)
+        .order_by('id')
+        .values_list(*COMPILED_RULE_FIELDS)
+    )
+
+
+def _store_index(user_id, generation, rows):
+    index = RulesIndex(CompiledRule(*row) for row in rows)
+
+    with _lock:
+        if _generations.get(user_id, 0) == generation:
+            _indexes[user_id] = index
+    logger.debug("Индекс правил построен для пользователя %s: %s правил", user_id, len(index))
+    return index
+
+
+def invalidate(user_id):
+    """Удаляет индекс пользователя; он будет построен заново при следующем SMS."""
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        _indexes.pop(user_id, None)
+
+
+def _update(user_id, apply):
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        index = _indexes.get(user_id)
+        if index is not None:
+            apply(index)
+
+
+def rule_saved(rule):
+    if rule.user_id not in _indexes:
+        invalidate(rule.user_id)
+        return
+    # Связанные объекты могут потребовать запрос к БД — делаем его вне блокировки
+    compiled = compile_rule(rule)
+    _update(rule.user_id, lambda index: index.add(compiled))
+
+
+def rule_deleted(rule):
+    _update(rule.user_id, lambda index: index.remove(rule.id))
+
+
+def number_saved(number):
+    _update(
+        number.user_id,
+        lambda index: index.replace_where(
+            lambda rule: rule.from_whom_id == number.id,
+            telephone=number.telephone,
+        )
+    )
+
+
+def number_deleted(number):
+    _update(number.user_id, lambda index: index.remove_where(lambda rule: rule.from_whom_id == number.id))
+
+
+def chat_saved(chat):
+    _update(
+        chat.user_id,
+        lambda index: index.replace_where(
+            lambda rule: rule.to_whom_id == chat.id,
+            chat_id=chat.chat_id,
+            chat_title=chat.title,
+        )
+    )
+
+
+def chat_deleted(chat):
+    _update(chat.user_id, lambda index: index.remove_where(lambda rule: rule.to_whom_id == chat.id))
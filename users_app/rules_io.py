@@ -0,0 +1,266 @@
+"""
+Массовый импорт и экспорт правил пересылки (CSV и JSON).
+
+Файл проверяется целиком несколькими запросами на весь файл, а не на строку:
+номера пользователя, его каналы и уже существующие правила читаются по
+одному разу в словари и множества. Если в файле есть ошибки, ничего не
+сохраняется; иначе новые правила вставляются через bulk_create в одной
+транзакции. bulk_create не отправляет post_save, поэтому индекс правил и
+версия настроек пользователя обновляются явно после коммита.
+
+Экспорт — асинхронные генераторы для StreamingHttpResponse: правила читаются
+порциями по RULES_IMPORT_BATCH_SIZE (keyset по id) в пуле потоков run_db,
+поэтому под ASGI ответ отдается по мере чтения, а не собирается целиком в
+памяти.
+
+Колонки: sender, telephone, chat_id, text_match, text_pattern. Пустой sender
+или "*" означает любого отправителя; text_match по умолчанию 'any'.
+"""
+import csv
+import io
+import json
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from users_app import config_version, rules_index
+from users_app.db import run_db
+from users_app.models import ANY_SENDER, TEXT_MATCH_TYPES, NumbersService, Rules, TelegramChats
+from users_app.rules_index import compile_pattern, parse_keywords
+
+FIELDS = ('sender', 'telephone', 'chat_id', 'text_match', 'text_pattern')
+FORMATS = ('csv', 'json')
+
+TEXT_MATCH_VALUES = {value for value, _ in TEXT_MATCH_TYPES}
+SENDER_MAX_LENGTH = Rules._meta.get_field('sender').max_length
+# Сколько ошибок показывать пользователю
+MAX_REPORTED_ERRORS = 50
+
+
+class RulesFileError(Exception):
+    """Файл импорта не удалось разобрать."""
+
+
+def detect_format(filename, requested=None):
+    """Формат файла: явно выбранный или по расширению."""
+    if requested in FORMATS:
+        return requested
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else 'csv'
+
+
+def parse_rows(uploaded_file, file_format):
+    """
+    Читает строки файла импорта.
+
+    Args:
+        uploaded_file: Загруженный файл (UploadedFile)
+        file_format: 'csv' или 'json'
+
+    Returns:
+        Список dict с ключами FIELDS
+
+    Raises:
+        RulesFileError: Если файл не разбирается или в нем больше RULES_IMPORT_MAX_ROWS строк
+    """
+    try:
+        if file_format == 'json':
+            data = json.load(uploaded_file)
+            if isinstance(data, dict):
+                data = data.get('rules')
+            if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+                raise RulesFileError('Ожидается список объектов или {"rules": [...]}')
+            rows = data
+        else:
+            text = io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
+            # Разделитель берется из заголовка: в шаблонах текста бывают и запятые, и точки с запятой
+            header = text.readline()
+            text.seek(0)
+            delimiter = max(',;\t', key=header.count)
+            reader = csv.DictReader(text, delimiter=delimiter)
+            missing = {'telephone', 'chat_id'} - set(reader.fieldnames or ())
+            if missing:
+                raise RulesFileError(f'Нет обязательных колонок: {", ".join(sorted(missing))}')
+            rows = list(reader)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise RulesFileError(f'Не удалось прочитать файл: {e}')
+
+    if len(rows) > settings.RULES_IMPORT_MAX_ROWS:
+        raise RulesFileError(f'Слишком много строк: {len(rows)} (максимум {settings.RULES_IMPORT_MAX_ROWS})')
+    return [{field: str(row.get(field) or '').strip() for field in FIELDS} for row in rows]
+
+
+def text_condition_error(text_match, text_pattern, compiled_patterns):
+    """
+    Проверяет условие правила по тексту.
+
+    Args:
+        text_match: 'any', 'keywords' или 'regex'
+        text_pattern: Ключевые слова или регулярное выражение
+        compiled_patterns: dict для уже проверенных выражений (общий на файл или запрос)
+
+    Returns:
+        Текст ошибки или None
+    """
+    if text_match == 'keywords' and not parse_keywords(text_pattern):
+        return 'укажите хотя бы одно ключевое слово'
+    if text_match == 'regex':
+        if not text_pattern:
+            return 'укажите регулярное выражение'
+        if text_pattern not in compiled_patterns:
+            try:
+                compile_pattern(text_pattern)
+                compiled_patterns[text_pattern] = None
+            except re.error as e:
+                compiled_patterns[text_pattern] = f'некорректное регулярное выражение: {e}'
+        return compiled_patterns[text_pattern]
+    return None
+
+
+def validate_rows(user, rows, start=1):
+    """
+    Проверяет строки импорта по номерам и каналам пользователя.
+
+    Args:
+        user: Владелец правил
+        rows: Строки из parse_rows
+        start: Номер первой строки в сообщениях об ошибках
+
+    Returns:
+        (новые Rules без дублей, количество дублей, список ошибок вида
+        {'row': номер строки, 'error': текст})
+    """
+    numbers = dict(NumbersService.objects.filter(user=user).values_list('telephone', 'id'))
+    chats = dict(TelegramChats.objects.filter(user=user).values_list('chat_id', 'id'))
+    existing = set(
+        Rules.objects.filter(user=user)
+        .values_list('sender', 'from_whom_id', 'to_whom_id', 'text_match', 'text_pattern')
+    )
+
+    rules, duplicates, errors = [], 0, []
+    compiled_patterns = {}
+    for number, row in enumerate(rows, start=start):
+        sender = row['sender']
+        if not sender or sender == '*':
+            sender = ANY_SENDER
+        telephone = re.sub(r'\D', '', row['telephone'])
+        text_match = row['text_match'] or 'any'
+        text_pattern = row['text_pattern'] if text_match != 'any' else ''
+
+        if len(sender) > SENDER_MAX_LENGTH:
+            error = f'отправитель длиннее {SENDER_MAX_LENGTH} символов'
+        elif telephone not in numbers:
+            error = f'номер {row["telephone"] or "(пусто)"} не подключен'
+        elif row['chat_id'] not in chats:
+            error = f'канал {row["chat_id"] or "(пусто)"} не добавлен в бота'
+        elif text_match not in TEXT_MATCH_VALUES:
+            error = f'неизвестное условие по тексту {text_match}'
+        else:
+            error = text_condition_error(text_match, text_pattern, compiled_patterns)
+        if error:
+            errors.append({'row': number, 'error': error})
+            continue
+
+        key = (sender, numbers[telephone], chats[row['chat_id']], text_match, text_pattern)
+        if key in existing:
+            duplicates += 1
+            continue
+        existing.add(key)
+        rules.append(Rules(
+            user=user,
+            sender=sender,
+            from_whom_id=key[1],
+            to_whom_id=key[2],
+            text_match=text_match,
+            text_pattern=text_pattern,
+        ))
+    return rules, duplicates, errors
+
+
+def import_rules(user, uploaded_file, file_format=None):
+    """
+    Импортирует правила из файла: все или ничего.
+
+    Args:
+        user: Владелец правил
+        uploaded_file: Загруженный CSV или JSON
+        file_format: 'csv', 'json' или None (по расширению)
+
+    Returns:
+        dict с created, duplicates и errors (при ошибках ничего не сохраняется)
+
+    Raises:
+        RulesFileError: Если файл не разбирается
+    """
+    file_format = detect_format(uploaded_file.name, file_format)
+    rows = parse_rows(uploaded_file, file_format)
+    # Первая строка CSV — заголовок
+    rules, duplicates, errors = validate_rows(user, rows, start=2 if file_format == 'csv' else 1)
+    if errors:
+        return {
+            'created': 0,
+            'duplicates': duplicates,
+            'error_count': len(errors),
+            'errors': errors[:MAX_REPORTED_ERRORS],
+        }
+
+    with transaction.atomic():
+        Rules.objects.bulk_create(rules, batch_size=settings.RULES_IMPORT_BATCH_SIZE)
+        # Сигналы post_save при bulk_create не отправляются
+        transaction.on_commit(lambda: rules_index.invalidate(user.id))
+        config_version.bump(user.id)
+    return {'created': len(rules), 'duplicates': duplicates, 'error_count': 0, 'errors': []}
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: write возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def _export_chunk(user_id, after_id):
+    """Следующая порция правил после after_id (синхронная функция для run_db)."""
+    return list(
+        Rules.objects.filter(user_id=user_id, id__gt=after_id)
+        .order_by('id')
+        .values_list('id', 'sender', 'from_whom__telephone', 'to_whom__chat_id', 'text_match', 'text_pattern')
+        [:settings.RULES_IMPORT_BATCH_SIZE]
+    )
+
+
+async def _export_rows(user_id):
+    after_id = 0
+    while True:
+        rows = await run_db(_export_chunk, user_id, after_id)
+        for rule_id, sender, telephone, chat_id, text_match, text_pattern in rows:
+            yield {
+                'sender': '*' if sender == ANY_SENDER else sender,
+                'telephone': telephone,
+                'chat_id': chat_id,
+                'text_match': text_match,
+                'text_pattern': text_pattern,
+            }
+        if len(rows) < settings.RULES_IMPORT_BATCH_SIZE:
+            return
+        after_id = rows[-1][0]
+
+
+async def export_csv(user_id):
+    """Асинхронный генератор строк CSV со всеми правилами пользователя (для StreamingHttpResponse)."""
+    writer = csv.DictWriter(_Echo(), fieldnames=FIELDS)
+    # BOM, чтобы Excel открыл файл в UTF-8
+    yield '\ufeff' + writer.writeheader()
+    async for row in _export_rows(user_id):
+        yield writer.writerow(row)
+
+
+async def export_json(user_id):
+    """Асинхронный генератор JSON-массива со всеми правилами пользователя (для StreamingHttpResponse)."""
+    yield '['
+    separator = ''
+    async for row in _export_rows(user_id):
+        yield separator + json.dumps(row, ensure_ascii=False)
+        separator = ',\n'
+    yield ']\n'
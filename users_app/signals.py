@@ -0,0 +1,61 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users_app import config_version, phone_directory, rules_index, user_cache
+from users_app.models import Key, NumbersService, Rules, TelegramChats, User
+
+
+@receiver(post_save, sender=Rules)
+def rules_saved(sender, instance, **kwargs):
+    rules_index.rule_saved(instance)
+
+
+@receiver(post_delete, sender=Rules)
+def rules_deleted(sender, instance, **kwargs):
+    rules_index.rule_deleted(instance)
+
+
+@receiver(post_save, sender=NumbersService)
+def numbers_service_saved(sender, instance, **kwargs):
+    rules_index.number_saved(instance)
+    phone_directory.number_saved(instance)
+
+
+@receiver(post_delete, sender=NumbersService)
+def numbers_service_deleted(sender, instance, **kwargs):
+    rules_index.number_deleted(instance)
+    phone_directory.number_deleted(instance)
+
+
+@receiver(post_save, sender=TelegramChats)
+def telegram_chat_saved(sender, instance, **kwargs):
+    rules_index.chat_saved(instance)
+
+
+@receiver(post_delete, sender=TelegramChats)
+def telegram_chat_deleted(sender, instance, **kwargs):
+    rules_index.chat_deleted(instance)
+
+
+@receiver(post_save, sender=Rules)
+@receiver(post_delete, sender=Rules)
+@receiver(post_save, sender=NumbersService)
+@receiver(post_delete, sender=NumbersService)
+@receiver(post_save, sender=TelegramChats)
+@receiver(post_delete, sender=TelegramChats)
+@receiver(post_save, sender=Key)
+@receiver(post_delete, sender=Key)
+def user_config_changed(sender, instance, **kwargs):
+    config_version.bump(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    phone_directory.user_saved(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    rules_index.invalidate(instance.id)
+    phone_directory.user_deleted(instance.id)
+    user_cache.invalidate_user(instance.id, instance.token_url, telegram_id=instance.telegram_id, phone=instance.phone)
@@ -0,0 +1,154 @@
+"""
+Форматы входящих SMS провайдеров (KEY_TYPES: Novofon, Telfin, Mango).
+
+Формат — функция data -> dict с caller_id, caller_did, text (или None, если
+данные не в этом формате), зарегистрированная декоратором register.
+caller_did возвращается в виде NumbersService.telephone (только цифры), если
+провайдер присылает номер в другом написании.
+Распознанный для токена вебхука формат запоминается: следующие запросы этого
+токена сразу идут в его функцию, и только если она не подошла, перебираются
+остальные форматы. Новый формат добавляется функцией с @register и не
+удлиняет разбор для токенов, формат которых уже известен.
+"""
+import json
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+
+from users_app.metrics import SMS_FORMAT_DETECTIONS
+from users_app.phone_directory import normalize_phone
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SmsFormat = namedtuple('SmsFormat', ['name', 'provider', 'parse'])
+
+# Название -> SmsFormat, в порядке регистрации (порядок перебора)
+_formats = {}
+# Токен вебхука -> название последнего распознанного формата
+_formats_by_token = TTLCache(
+    maxsize=settings.WEBHOOK_TOKEN_CACHE_SIZE,
+    ttl=settings.SMS_FORMAT_CACHE_TTL,
+)
+
+
+def register(name, provider):
+    """
+    Регистрирует функцию разбора формата.
+
+    Args:
+        name: Название формата (попадает в лог вебхука)
+        provider: Провайдер из KEY_TYPES
+    """
+    def decorator(func):
+        _formats[name] = SmsFormat(name, provider, func)
+        return func
+    return decorator
+
+
+def parse(data, hint=None):
+    """
+    Извлекает данные SMS, начиная с формата hint.
+
+    Returns:
+        tuple: (dict с caller_id/caller_did/text, название формата) или (None, None)
+    """
+    if not isinstance(data, dict):
+        return None, None
+    if hint in _formats:
+        sms_data = _formats[hint].parse(data)
+        if sms_data is not None:
+            return sms_data, hint
+    for name, sms_format in _formats.items():
+        if name == hint:
+            continue
+        sms_data = sms_format.parse(data)
+        if sms_data is not None:
+            return sms_data, name
+    return None, None
+
+
+def detect(token, data):
+    """
+    parse с запомненным форматом токена; запоминает формат, если он сменился.
+
+    Args:
+        token: Токен вебхука (или другой ключ источника SMS)
+        data: Разобранный JSON запроса
+
+    Returns:
+        tuple: как у parse
+    """
+    hint = _formats_by_token.get(token, None)
+    sms_data, name = parse(data, hint)
+    if name is None:
+        SMS_FORMAT_DETECTIONS.inc(result='unknown')
+    elif name == hint:
+        SMS_FORMAT_DETECTIONS.inc(result='remembered')
+    else:
+        SMS_FORMAT_DETECTIONS.inc(result='detected')
+        _formats_by_token.set(token, name)
+        if hint is not None:
+            logger.info("🔁 WEBHOOK: формат SMS токена %s... сменился: %s -> %s", token[:8], hint, name)
+    return sms_data, name
+
+
+def _fields(block):
+    if isinstance(block, dict) and 'caller_id' in block and 'caller_did' in block and 'text' in block:
+        return block
+    return None
+
+
+@register('novofon', 'Novofon')
+def parse_novofon(data):
+    """Novofon: caller_id, caller_did и text в корне."""
+    return _fields(data)
+
+
+@register('novofon_result', 'Novofon')
+def parse_novofon_result(data):
+    """Novofon: поля в блоке result."""
+    return _fields(data.get('result'))
+
+
+@register('novofon_data', 'Novofon')
+def parse_novofon_data(data):
+    """Novofon: поля в блоке data."""
+    return _fields(data.get('data'))
+
+
+@register('telfin', 'Telfin')
+def parse_telfin(data):
+    """Telfin: from (номер отправителя), to, message или text; имя отправителя в sender."""
+    text = data.get('message', data.get('text'))
+    if 'from' not in data or 'to' not in data or text is None:
+        return None
+    return {
+        'caller_id': str(data.get('sender') or data['from']),
+        'caller_did': normalize_phone(data['to']),
+        'text': text,
+    }
+
+
+@register('mango', 'Mango')
+def parse_mango(data):
+    """
+    Mango Office: событие ВАТС с полями vpbx_api_key, sign и json, где json —
+    {"from": {"number": ...}, "to": {"line_number": ...}, "text": ...}.
+    """
+    payload = data.get('json')
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return None
+    if not isinstance(payload, dict) or 'text' not in payload:
+        return None
+    sender, recipient = payload.get('from'), payload.get('to')
+    if not isinstance(sender, dict) or not isinstance(recipient, dict):
+        return None
+    caller_did = normalize_phone(recipient.get('line_number') or recipient.get('number'))
+    if not sender.get('number') or not caller_did:
+        return None
+    return {'caller_id': str(sender['number']), 'caller_did': caller_did, 'text': payload['text']}
@@ -0,0 +1,182 @@
+"""
+История входящих SMS (модель InboundSms).
+
+Вебхук не пишет в БД на каждый запрос: записи складываются в буфер в памяти,
+а фоновый поток сохраняет их одним bulk_create, когда набирается
+SMS_HISTORY_BATCH_SIZE записей или проходит SMS_HISTORY_FLUSH_INTERVAL секунд.
+Остаток буфера сохраняется при остановке процесса (atexit и ASGI lifespan).
+
+Если нет соединения с БД, записи остаются в буфере до следующей попытки;
+сверх SMS_HISTORY_MAX_BUFFER самые старые записи отбрасываются. При других
+ошибках (например, пользователь уже удален) пачка сохраняется по одной записи,
+и отбрасываются только записи, которые сохранить нельзя.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+
+from users_app.db import is_connection_error, prepare_connection, reset_connection
+from users_app.models import InboundSms
+
+logger = logging.getLogger(__name__)
+
+
+class SmsHistoryBuffer:
+    """Буфер записей InboundSms с фоновым сохранением пачками."""
+
+    def __init__(self, batch_size, flush_interval, max_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._items = []
+        self._lock = threading.Lock()
+        # Один поток сохраняет за раз: фоновый или завершающий flush()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def add(self, item):
+        with self._lock:
+            self._items.append(item)
+            if len(self._items) > self.max_size:
+                dropped = len(self._items) - self.max_size
+                del self._items[:dropped]
+                logger.warning(f"⚠️ SMS HISTORY: буфер переполнен, отброшено записей: {dropped}")
+            full = len(self._items) >= self.batch_size
+            if self._thread is None and not self._stopped:
+                self._start()
+        if full:
+            self._wakeup.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='sms-history', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Сохраняет накопленные записи.
+
+        Returns:
+            int: Количество сохраненных записей
+        """
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+            if not items:
+                return 0
+
+            try:
+                prepare_connection()
+                InboundSms.objects.bulk_create(items, batch_size=self.batch_size)
+            except Exception as e:
+                if is_connection_error(e):
+                    reset_connection()
+                    logger.error(f"💥 SMS HISTORY: не удалось сохранить {len(items)} записей: {e}")
+                    self._requeue(items)
+                    return 0
+                logger.error(f"💥 SMS HISTORY: ошибка пакетного сохранения {len(items)} записей, "
+                             f"сохраняем по одной: {e}")
+                return self._save_one_by_one(items)
+
+            logger.debug(f"SMS HISTORY: сохранено записей: {len(items)}")
+            return len(items)
+
+    def _requeue(self, items):
+        # Возвращаем записи в начало буфера до следующей попытки
+        with self._lock:
+            self._items[:0] = items
+            if len(self._items) > self.max_size:
+                del self._items[:len(self._items) - self.max_size]
+
+    def _save_one_by_one(self, items):
+        saved = 0
+        for position, item in enumerate(items):
+            try:
+                item.save(force_insert=True)
+            except Exception as e:
+                if is_connection_error(e):
+                    reset_connection()
+                    self._requeue(items[position:])
+                    break
+                logger.error(f"💥 SMS HISTORY: запись отброшена ({item.caller_id} -> {item.caller_did}, "
+                             f"пользователь {item.user_id}): {e}")
+            else:
+                saved += 1
+        return saved
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = SmsHistoryBuffer(
+                    batch_size=settings.SMS_HISTORY_BATCH_SIZE,
+                    flush_interval=settings.SMS_HISTORY_FLUSH_INTERVAL,
+                    max_size=settings.SMS_HISTORY_MAX_BUFFER,
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def build(user_id, caller_id, caller_did, text, matched_rule_ids, delivery_status):
+    """
+    Создает запись истории, не сохраняя ее.
+
+    Args:
+        user_id: ID пользователя
+        caller_id: Отправитель SMS
+        caller_did: Номер, на который пришла SMS
+        text: Текст SMS
+        matched_rule_ids: ID сработавших правил
+        delivery_status: Значение из SMS_DELIVERY_STATUSES
+
+    Returns:
+        InboundSms или None, если история выключена
+    """
+    if not settings.SMS_HISTORY_ENABLED:
+        return None
+    return InboundSms(
+        user_id=user_id,
+        caller_id=str(caller_id)[:250],
+        caller_did=str(caller_did)[:250],
+        text=str(text),
+        matched_rule_ids=list(matched_rule_ids),
+        delivery_status=delivery_status,
+    )
+
+
+def record(*args):
+    """Добавляет входящую SMS в историю (без обращения к БД); аргументы как у build."""
+    item = build(*args)
+    if item is not None:
+        get_buffer().add(item)
+
+
+def flush():
+    """Сохраняет буфер немедленно (при остановке приложения)."""
+    if _buffer is not None:
+        return _buffer.flush()
+    return 0
@@ -1,13 +1,9 @@
 import random
 import string
-import time
 import logging
 
-from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import connection, connections
-from django.db.utils import OperationalError
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
@@ -15,7 +11,14 @@ from telegram.ext import (
     ContextTypes, MessageHandler, filters
 )
 
-from users_app.models import TelegramChats, User
+from users_app import user_cache
+from users_app.metrics import BOT_HANDLER_SECONDS
+from users_app.models import TelegramChats
+from users_app.retry import run_db_with_retry
+from users_app.telegram_client import build_bot
+from users_app.update_processor import KeyedUpdateProcessor
+from utils.cache import MISSING
+from utils.metrics import start_http_server, timed
 
 # Настройка logger
 logger = logging.getLogger(__name__)
@@ -31,340 +34,132 @@ def clean_phone_number(phone_number):
     return phone_number.lstrip('+')
 
 
-@sync_to_async
-def check_chat_exists(user, chat_id, max_retries=3):
+def _check_chat_exists(user, chat_id):
+    return TelegramChats.objects.filter(user=user, chat_id=chat_id).exists()
+
+
+async def check_chat_exists(user, chat_id):
     """
-    Проверяет существование чата с retry-механизмом.
-    
+    Проверяет существование чата (с повторами при потере соединения с БД).
+
     Args:
         user: User object
         chat_id: ID чата
-        max_retries: Максимальное количество попыток (по умолчанию 3)
-    
+
     Returns:
         bool: True если чат существует, False если нет
     """
-    for attempt in range(max_retries):
-        try:
-            # Принудительно закрываем все соединения перед новой попыткой
-            connections.close_all()
-            
-            # Убеждаемся, что новое соединение активно
-            connection.ensure_connection()
-            
-            # Логируем попытку
-            logger.info(f"Checking chat existence attempt {attempt + 1} for chat_id: {chat_id}")
-            
-            # Выполняем запрос
-            result = TelegramChats.objects.filter(user=user, chat_id=chat_id).exists()
-            
-            # Логируем успешное выполнение
-            logger.info(f"Chat existence check successful for chat_id: {chat_id}, result: {result}")
-            return result
-            
-        except OperationalError as e:
-            error_code = getattr(e, 'args', [None])[0]
-            
-            # Проверяем, что это именно ошибки потерянного соединения
-            if error_code in [2006, 2013] and attempt < max_retries - 1:
-                logger.warning(
-                    f"DB connection lost (error {error_code}), retry {attempt + 1}/{max_retries} "
-                    f"for chat_id: {chat_id}"
-                )
-                
-                # Exponential backoff: 1s, 2s, 3s
-                sleep_time = 1 * (attempt + 1)
-                time.sleep(sleep_time)
-                continue
-            else:
-                # Если это другая ошибка или закончились попытки
-                logger.error(f"DB error after {attempt + 1} attempts: {e}")
-                raise
-                
-        except Exception as e:
-            # Логируем неожиданные ошибки
-            logger.error(f"Unexpected DB error on attempt {attempt + 1}: {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                continue
-            raise
-    
-    # Эта строка никогда не должна выполниться, но для безопасности
-    return False
+    result = await run_db_with_retry(_check_chat_exists, user, chat_id, operation='check_chat_exists')
+    logger.info(f"Chat existence check for chat_id: {chat_id}, result: {result}")
+    return result
 
 
-@sync_to_async
-def create_telegram_chat(user, title, chat_id, max_retries=3):
+def _create_telegram_chat(user, title, chat_id):
+    return TelegramChats.objects.create(
+        user=user,
+        title=title,
+        chat_id=chat_id
+    )
+
+
+async def create_telegram_chat(user, title, chat_id):
     """
-    Создает новый чат в базе данных с retry-механизмом.
-    
+    Создает новый чат в базе данных (с повторами при потере соединения с БД).
+
     Args:
         user: User object
         title: Название чата
         chat_id: ID чата
-        max_retries: Максимальное количество попыток (по умолчанию 3)
-    
+
     Returns:
         TelegramChats object созданного чата
     """
-    for attempt in range(max_retries):
-        try:
-            # Принудительно закрываем все соединения перед новой попыткой
-            connections.close_all()
-            
-            # Убеждаемся, что новое соединение активно
-            connection.ensure_connection()
-            
-            # Логируем попытку
-            logger.info(f"Creating telegram chat attempt {attempt + 1} for chat_id: {chat_id}")
-            
-            # Выполняем создание
-            result = TelegramChats.objects.create(
-                user=user,
-                title=title,
-                chat_id=chat_id
-            )
-            
-            # Логируем успешное выполнение
-            logger.info(f"Telegram chat created successfully for chat_id: {chat_id}")
-            return result
-            
-        except OperationalError as e:
-            error_code = getattr(e, 'args', [None])[0]
-            
-            # Проверяем, что это именно ошибки потерянного соединения
-            if error_code in [2006, 2013] and attempt < max_retries - 1:
-                logger.warning(
-                    f"DB connection lost (error {error_code}), retry {attempt + 1}/{max_retries} "
-                    f"for chat_id: {chat_id}"
-                )
-                
-                # Exponential backoff: 1s, 2s, 3s
-                sleep_time = 1 * (attempt + 1)
-                time.sleep(sleep_time)
-                continue
-            else:
-                # Если это другая ошибка или закончились попытки
-                logger.error(f"DB error after {attempt + 1} attempts: {e}")
-                raise
-                
-        except Exception as e:
-            # Логируем неожиданные ошибки
-            logger.error(f"Unexpected DB error on attempt {attempt + 1}: {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                continue
-            raise
-    
-    # Эта строка никогда не должна выполниться, но для безопасности
-    return None
+    result = await run_db_with_retry(
+        _create_telegram_chat, user, title, chat_id, operation='create_telegram_chat'
+    )
+    logger.info(f"Telegram chat created successfully for chat_id: {chat_id}")
+    return result
 
 
-@sync_to_async
-def create_user(phone, telegram_id, password, max_retries=3):
+def _create_user(phone, telegram_id, password):
+    User = get_user_model()
+    new_user = User(
+        email=f'{phone}@example.com',
+        phone=phone,
+        telegram_id=telegram_id,
+        balance=0,
+    )
+    new_user.set_password(password)
+    new_user.save()
+    return new_user
+
+
+async def create_user(phone, telegram_id, password):
     """
-    Создает нового пользователя с retry-механизмом.
-    
+    Создает нового пользователя (с повторами при потере соединения с БД).
+
     Args:
         phone: Номер телефона пользователя
         telegram_id: ID пользователя в Telegram
         password: Пароль для пользователя
-        max_retries: Максимальное количество попыток (по умолчанию 3)
-    
+
     Returns:
         User object созданного пользователя
     """
-    User = get_user_model()
     phone = clean_phone_number(phone)
-    
-    for attempt in range(max_retries):
-        try:
-            # Принудительно закрываем все соединения перед новой попыткой
-            connections.close_all()
-            
-            # Убеждаемся, что новое соединение активно
-            connection.ensure_connection()
-            
-            # Логируем попытку
-            logger.info(f"Creating user attempt {attempt + 1} for phone: {phone}")
-            
-            # Выполняем создание пользователя
-            new_user = User(
-                email=f'{phone}@example.com',
-                phone=phone,
-                telegram_id=telegram_id,
-                balance=0,
-            )
-            new_user.set_password(password)
-            new_user.save()
-            
-            # Логируем успешное выполнение
-            logger.info(f"Создан новый пользователь: {phone} (TG ID: {telegram_id})")
-            return new_user
-            
-        except OperationalError as e:
-            error_code = getattr(e, 'args', [None])[0]
-            
-            # Проверяем, что это именно ошибки потерянного соединения
-            if error_code in [2006, 2013] and attempt < max_retries - 1:
-                logger.warning(
-                    f"DB connection lost (error {error_code}), retry {attempt + 1}/{max_retries} "
-                    f"for user creation: {phone}"
-                )
-                
-                # Exponential backoff: 1s, 2s, 3s
-                sleep_time = 1 * (attempt + 1)
-                time.sleep(sleep_time)
-                continue
-            else:
-                # Если это другая ошибка или закончились попытки
-                logger.error(f"DB error after {attempt + 1} attempts: {e}")
-                raise
-                
-        except Exception as e:
-            # Логируем неожиданные ошибки
-            logger.error(f"Unexpected DB error on attempt {attempt + 1}: {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                continue
-            raise
-    
-    # Эта строка никогда не должна выполниться, но для безопасности
-    return None
+    new_user = await run_db_with_retry(_create_user, phone, telegram_id, password, operation='create_user')
+    logger.info(f"Создан новый пользователь: {phone} (TG ID: {telegram_id})")
+    return new_user
+
 
+def _get_user_by_telegram_id(telegram_id):
+    return get_user_model().objects.filter(telegram_id=telegram_id).first()
 
-@sync_to_async
-def get_existing_user_by_telegram_id(telegram_id, max_retries=3):
+
+async def get_existing_user_by_telegram_id(telegram_id):
     """
-    Получает пользователя по telegram_id с retry-механизмом.
-    
+    Получает пользователя по telegram_id: из кеша или из БД (с повторами при
+    потере соединения).
+
     Args:
         telegram_id: ID пользователя в Telegram
-        max_retries: Максимальное количество попыток (по умолчанию 3)
-    
+
     Returns:
         User object или None
     """
-    User = get_user_model()
-    
-    for attempt in range(max_retries):
-        try:
-            # Принудительно закрываем все соединения перед новой попыткой
-            connections.close_all()
-            
-            # Убеждаемся, что новое соединение активно
-            connection.ensure_connection()
-            
-            # Логируем попытку подключения
-            logger.info(f"DB query attempt {attempt + 1} for telegram_id: {telegram_id}")
-            
-            # Выполняем запрос
-            result = User.objects.filter(telegram_id=telegram_id).first()
-            
-            # Логируем успешное выполнение
-            logger.info(f"DB query successful for telegram_id: {telegram_id}")
-            return result
-            
-        except OperationalError as e:
-            error_code = getattr(e, 'args', [None])[0]
-            
-            # Проверяем, что это именно ошибки потерянного соединения
-            if error_code in [2006, 2013] and attempt < max_retries - 1:
-                logger.warning(
-                    f"DB connection lost (error {error_code}), retry {attempt + 1}/{max_retries} "
-                    f"for telegram_id: {telegram_id}"
-                )
-                
-                # Exponential backoff: 1s, 2s, 3s
-                sleep_time = 1 * (attempt + 1)
-                time.sleep(sleep_time)
-                continue
-            else:
-                # Если это другая ошибка или закончились попытки
-                logger.error(f"DB error after {attempt + 1} attempts: {e}")
-                raise
-                
-        except Exception as e:
-            # Логируем неожиданные ошибки
-            logger.error(f"Unexpected DB error on attempt {attempt + 1}: {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                continue
-            raise
-    
-    # Эта строка никогда не должна выполниться, но для безопасности
-    return None
+    cached = user_cache.get_bot_user('telegram_id', telegram_id)
+    if cached is not MISSING:
+        return cached
+    user = await run_db_with_retry(
+        _get_user_by_telegram_id, telegram_id, operation='get_existing_user_by_telegram_id'
+    )
+    return user_cache.remember_bot_user('telegram_id', telegram_id, user)
+
 
+def _get_user_by_phone(phone):
+    return get_user_model().objects.filter(phone=phone).first()
 
-@sync_to_async
-def get_existing_user_by_phone(phone, max_retries=3):
+
+async def get_existing_user_by_phone(phone):
     """
-    Получает пользователя по номеру телефона с retry-механизмом.
-    
+    Получает пользователя по номеру телефона: из кеша или из БД (с повторами
+    при потере соединения).
+
     Args:
         phone: Номер телефона пользователя
-        max_retries: Максимальное количество попыток (по умолчанию 3)
-    
+
     Returns:
         User object или None
     """
-    User = get_user_model()
     phone = clean_phone_number(phone)
-    
-    for attempt in range(max_retries):
-        try:
-            # Принудительно закрываем все соединения перед новой попыткой
-            connections.close_all()
-            
-            # Убеждаемся, что новое соединение активно
-            connection.ensure_connection()
-            
-            # Логируем попытку подключения
-            logger.info(f"DB query attempt {attempt + 1} for phone: {phone}")
-            
-            # Выполняем запрос
-            result = User.objects.filter(phone=phone).first()
-            
-            # Логируем успешное выполнение
-            logger.info(f"DB query successful for phone: {phone}")
-            return result
-            
-        except OperationalError as e:
-            error_code = getattr(e, 'args', [None])[0]
-            
-            # Проверяем, что это именно ошибки потерянного соединения
-            if error_code in [2006, 2013] and attempt < max_retries - 1:
-                logger.warning(
-                    f"DB connection lost (error {error_code}), retry {attempt + 1}/{max_retries} "
-                    f"for phone: {phone}"
-                )
-                
-                # Exponential backoff: 1s, 2s, 3s
-                sleep_time = 1 * (attempt + 1)
-                time.sleep(sleep_time)
-                continue
-            else:
-                # Если это другая ошибка или закончились попытки
-                logger.error(f"DB error after {attempt + 1} attempts: {e}")
-                raise
-                
-        except Exception as e:
-            # Логируем неожиданные ошибки
-            logger.error(f"Unexpected DB error on attempt {attempt + 1}: {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                continue
-            raise
-    
-    # Эта строка никогда не должна выполниться, но для безопасности
-    return None
+    cached = user_cache.get_bot_user('phone', phone)
+    if cached is not MISSING:
+        return cached
+    user = await run_db_with_retry(_get_user_by_phone, phone, operation='get_existing_user_by_phone')
+    return user_cache.remember_bot_user('phone', phone, user)
 
 
+@timed(BOT_HANDLER_SECONDS, handler='start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обрабатывает команду /start.
@@ -443,6 +238,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"START: команда завершена для пользователя {telegram_id}")
 
 
+@timed(BOT_HANDLER_SECONDS, handler='contact')
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_contact = update.message.contact
     phone = user_contact.phone_number
@@ -478,13 +274,44 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Этот Telegram ID уже зарегистрирован.")
 
 
+def build_application(bot, polling=True):
+    """
+    Создает Application бота с обработчиками команд.
+
+    Args:
+        bot: Неинициализированный или общий Bot (см. users_app/telegram_client.py)
+        polling: False — без Updater: обновления приходят через вебхук
+            (см. users_app/bot_webhook.py)
+
+    Returns:
+        Application
+    """
+    builder = ApplicationBuilder().bot(bot).concurrent_updates(
+        KeyedUpdateProcessor(settings.TELEGRAM_BOT_CONCURRENT_UPDATES)
+    )
+    if not polling:
+        builder = builder.updater(None)
+    app = builder.build()
+
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(MessageHandler(filters.CONTACT, handle_contact))
+    return app
+
+
 def main():
+    if settings.TELEGRAM_BOT_MODE == 'webhook':
+        # getUpdates не работает, пока у бота установлен вебхук
+        logger.error("TELEGRAM_BOT_MODE=webhook: обновления бота принимает ASGI-приложение, "
+                     "run_bot не нужен")
+        return
+
     logger.info("Запуск Telegram бота...")
+    if settings.BOT_METRICS_PORT:
+        # У процесса бота нет Django-сервера: метрики отдаются отдельным портом
+        start_http_server(settings.BOT_METRICS_PORT, settings.METRICS_BIND_ADDR)
+        logger.info(f"Метрики бота доступны на {settings.METRICS_BIND_ADDR}:{settings.BOT_METRICS_PORT}")
     try:
-        app = ApplicationBuilder().token(settings.TOKEN_BOT).build()
-
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(MessageHandler(filters.CONTACT, handle_contact))
+        app = build_application(build_bot())
 
         logger.info("Telegram бот запущен и готов к работе")
         app.run_polling(allowed_updates=Update.ALL_TYPES)
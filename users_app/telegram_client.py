@@ -0,0 +1,145 @@
+"""
+Общий клиент Telegram Bot API.
+
+Один инициализированный telegram.Bot на процесс (точнее, на event loop):
+httpx-клиент с пулом соединений и keep-alive переиспользуется между
+запросами вебхука, поэтому TLS-рукопожатие с api.telegram.org не повторяется
+на каждую SMS. Бот закрывается при остановке ASGI-приложения
+(см. sms_analizator_service/asgi.py).
+
+Общий бот возможен только под ASGI, где event loop один на процесс. Под WSGI
+каждый async-view выполняется в своем loop, поэтому bot_session() выдает
+временный бот, который закрывается в конце запроса.
+"""
+import asyncio
+import contextlib
+import logging
+
+import httpx
+from django.conf import settings
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+_bot = None
+_bot_loop = None
+_bot_initialized = None
+# Постоянный event loop ASGI-сервера (см. bind_loop)
+_shared_loop = None
+
+
+def build_request(pool_size):
+    """
+    Создает HTTP-транспорт для Bot API с пулом соединений и keep-alive.
+
+    Args:
+        pool_size: Максимальное количество одновременных соединений
+    """
+    return HTTPXRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=settings.TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=settings.TELEGRAM_READ_TIMEOUT,
+        write_timeout=settings.TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=settings.TELEGRAM_POOL_TIMEOUT,
+        httpx_kwargs={
+            'limits': httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=settings.TELEGRAM_KEEPALIVE_EXPIRY,
+            ),
+        },
+    )
+
+
+def build_bot():
+    """
+    Создает (не инициализируя) Bot с настроенным пулом соединений.
+
+    Используется и для общего бота вебхука, и для Application в
+    users_app/telegram_bot.py.
+    """
+    return Bot(
+        settings.TOKEN_BOT,
+        base_url=settings.TELEGRAM_API_BASE_URL,
+        request=build_request(settings.TELEGRAM_POOL_SIZE),
+        get_updates_request=build_request(1),
+    )
+
+
+def bind_loop():
+    """Запоминает текущий event loop как постоянный (вызывается из ASGI lifespan)."""
+    global _shared_loop
+    _shared_loop = asyncio.get_running_loop()
+
+
+@contextlib.asynccontextmanager
+async def bot_session():
+    """
+    Bot для отправки в пределах одного запроса.
+
+    В постоянном loop ASGI-сервера — общий бот из get_bot(). В loop, который
+    живет один запрос (async-view под WSGI, runserver), — временный бот,
+    закрываемый на выходе: иначе его соединения остались бы открытыми в
+    закрытом loop.
+    """
+    if asyncio.get_running_loop() is _shared_loop:
+        yield await get_bot()
+        return
+    async with build_bot() as bot:
+        yield bot
+
+
+async def get_bot():
+    """
+    Возвращает общий инициализированный Bot для текущего event loop.
+
+    httpx-клиент привязан к event loop, в котором создан. Под ASGI loop один
+    на процесс, и бот создается один раз. Если loop сменился, прежний бот
+    закрывается в своем loop (если тот еще работает) и создается новый.
+    """
+    global _bot, _bot_loop, _bot_initialized
+
+    loop = asyncio.get_running_loop()
+    if _bot is None or _bot_loop is not loop:
+        if _bot is not None:
+            _close_stale_bot(_bot, _bot_loop)
+        logger.info("Создание общего клиента Telegram Bot API")
+        _bot = build_bot()
+        _bot_loop = loop
+        # Одновременные первые запросы ждут одну и ту же инициализацию
+        _bot_initialized = loop.create_task(_bot.initialize())
+
+    bot, initialized = _bot, _bot_initialized
+    try:
+        await initialized
+    except Exception:
+        if _bot is bot:
+            _bot = _bot_loop = _bot_initialized = None
+        raise
+    return bot
+
+
+def _close_stale_bot(bot, loop):
+    if loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(bot.shutdown(), loop)
+        return
+    # Закрытый loop уже не выполнит shutdown: соединения закроются при сборке мусора
+    logger.warning(
+        "⚠️ Общий клиент Telegram Bot API пересоздается: event loop сменился. "
+        "Запускайте приложение под ASGI (uvicorn), чтобы соединения переиспользовались"
+    )
+
+
+async def shutdown_bot():
+    """Закрывает соединения общего бота."""
+    global _bot, _bot_loop, _bot_initialized
+
+    if _bot is None:
+        return
+    bot, _bot, _bot_loop, _bot_initialized = _bot, None, None, None
+    try:
+        await bot.shutdown()
+        logger.info("Клиент Telegram Bot API закрыт")
+    except Exception as e:
+        logger.error(f"Ошибка закрытия клиента Telegram Bot API: {e}")
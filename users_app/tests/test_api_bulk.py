@@ -0,0 +1,47 @@
+"""POST bulk/ API настроек: id созданных объектов и формат номеров."""
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from users_app.models import NumbersService, TelegramChats, User
+
+
+class BulkCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(password='password', phone='79000000010', email='bulk@example.com')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_ids_without_returning(self):
+        # Как на MySQL: bulk_create не возвращает id созданных строк
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', False):
+            response = self.client.post('/api/chats/bulk/', [
+                {'title': 'Канал', 'chat_id': '-1'},
+                {'title': 'Канал', 'chat_id': '-1'},
+                {'title': 'Другой', 'chat_id': '-2'},
+            ], format='json')
+        self.assertEqual(response.status_code, 201)
+        created = dict(TelegramChats.objects.filter(user=self.user).values_list('id', 'chat_id'))
+        ids = [item['id'] for item in response.json()]
+        self.assertEqual(sorted(ids), sorted(created))
+        self.assertEqual([created[pk] for pk in ids], ['-1', '-1', '-2'])
+
+    def test_telephone_format(self):
+        response = self.client.post('/api/numbers/bulk/', [
+            {'name': 'Novofon', 'telephone': '+7 (999) 000-11-22'},
+            {'name': 'Novofon', 'telephone': '8 999 000 11 23'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertIn('telephone', response.json()[1])
+        self.assertFalse(NumbersService.objects.exists())
+
+        response = self.client.post('/api/numbers/', {'name': 'Novofon', 'telephone': '+7 (999) 000-11-22'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['telephone'], '79990001122')
@@ -0,0 +1,61 @@
+"""Дедупликация повторных SMS: dedup.claim."""
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+
+from users_app import dedup
+from users_app.models import User, WebhookFingerprint
+
+
+class ClaimTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(password='password', phone='79000000020', email='dedup@example.com')
+
+    def setUp(self):
+        dedup._recent.clear()
+
+    def fingerprints(self, count, prefix='sms'):
+        return [dedup.fingerprint(self.user.id, {'caller_id': 'A', 'caller_did': '1', 'text': f'{prefix} {i}'})
+                for i in range(count)]
+
+    def test_new_then_duplicate(self):
+        fingerprints = self.fingerprints(3)
+        self.assertEqual(dedup.claim(self.user.id, fingerprints), [True, True, True])
+        self.assertEqual(dedup.claim(self.user.id, fingerprints), [False, False, False])
+        self.assertEqual(WebhookFingerprint.objects.count(), 3)
+
+    def test_duplicate_inside_batch(self):
+        first, second = self.fingerprints(2)
+        self.assertEqual(dedup.claim(self.user.id, [first, second, first]), [True, True, False])
+
+    def test_expired_fingerprint_is_new(self):
+        fresh, expired = self.fingerprints(2)
+        dedup.claim(self.user.id, [fresh, expired])
+        old = timezone.now() - timedelta(seconds=settings.WEBHOOK_DEDUP_WINDOW + 1)
+        WebhookFingerprint.objects.filter(fingerprint=expired).update(created_at=old)
+
+        self.assertEqual(dedup.claim(self.user.id, [fresh, expired]), [False, True])
+        self.assertEqual(dedup.claim(self.user.id, [expired]), [False])
+
+    def test_row_of_another_claim_is_duplicate(self):
+        # Строку вставил параллельный воркер: ее created_at не совпадает с нашим
+        fp = self.fingerprints(1)[0]
+        WebhookFingerprint.objects.create(fingerprint=fp, user=self.user)
+        self.assertEqual(dedup.claim(self.user.id, [fp]), [False])
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        old = timezone.now() - timedelta(seconds=settings.WEBHOOK_DEDUP_WINDOW + 1)
+        for size in (3, 100):
+            with self.subTest(size=size):
+                expired = self.fingerprints(size, prefix=f'expired {size}')
+                dedup.claim(self.user.id, expired)
+                WebhookFingerprint.objects.filter(fingerprint__in=expired).update(created_at=old)
+                fingerprints = self.fingerprints(size, prefix=f'new {size}') + expired
+                # SELECT существующих, INSERT, UPDATE устаревших, SELECT занятых
+                with self.assertNumQueries(4):
+                    self.assertTrue(all(dedup.claim(self.user.id, fingerprints)))
+                with self.assertNumQueries(1):
+                    self.assertFalse(any(dedup.claim(self.user.id, fingerprints)))
@@ -0,0 +1,32 @@
+"""Доступ к /metrics/."""
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=[])
+class MetricsAccessTests(SimpleTestCase):
+    def get(self, **extra):
+        return self.client.get(reverse('metrics'), **extra)
+
+    def test_closed_by_default(self):
+        # За nginx все запросы приходят с 127.0.0.1
+        self.assertEqual(self.get(REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='m3trics')
+    def test_bearer_token(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.get(HTTP_AUTHORIZATION='Bearer m3trics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE', response.content)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_allowed_ips(self):
+        self.assertEqual(self.get(REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.5').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='m3trics', METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_token_and_ips_both_checked(self):
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.5').status_code, 403)
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.6', HTTP_AUTHORIZATION='Bearer m3trics').status_code, 403)
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.5', HTTP_AUTHORIZATION='Bearer m3trics').status_code, 200)
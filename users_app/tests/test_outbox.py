@@ -0,0 +1,163 @@
+"""Очередь доставки в Telegram: порядок в чате, повторы и итог в истории SMS."""
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from telegram.error import NetworkError, RetryAfter
+
+from users_app import outbox
+from users_app.delivery import ChatSkipped
+from users_app.models import InboundSms, TelegramOutbox, User
+from users_app.rate_limit import TelegramRateLimiter
+from users_app.rules_index import CompiledRule
+
+
+def rule(chat_id):
+    return CompiledRule(
+        id=None, sender='Bank', from_whom_id=1, telephone='79990000001', to_whom_id=1,
+        chat_id=chat_id, chat_title='Канал', text_match='any', text_pattern='',
+    )
+
+
+def history(user, key):
+    return InboundSms(user=user, caller_id='Bank', caller_did='79990000001', text='SMS',
+                      matched_rule_ids=[], delivery_status='queued', delivery_key=key)
+
+
+class OutboxTestMixin:
+    def create_user(self):
+        return User.objects.create_user(password='password', phone='79000000040', email='outbox@example.com')
+
+    def enqueue(self, *messages, key=''):
+        """messages — пары (chat_id, текст)."""
+        outbox.enqueue(self.user.id, [(rule(chat_id), text) for chat_id, text in messages],
+                       delivery_keys=[key] * len(messages))
+        return list(TelegramOutbox.objects.order_by('id').values_list('id', flat=True))[-len(messages):]
+
+    def texts(self, items):
+        return [item.text for item in items]
+
+
+@override_settings(OUTBOX_MAX_ATTEMPTS=3, OUTBOX_LOCK_TIMEOUT=300)
+class ClaimAndCompleteTests(OutboxTestMixin, TestCase):
+    def setUp(self):
+        self.user = self.create_user()
+
+    def test_batch_in_enqueue_order(self):
+        self.enqueue(('-1', 'a1'), ('-2', 'b1'), ('-1', 'a2'), ('-1', 'a3'))
+        items = outbox.claim_batch(10)
+        self.assertEqual(self.texts(items), ['a1', 'b1', 'a2', 'a3'])
+        self.assertEqual(set(TelegramOutbox.objects.values_list('status', flat=True)), {'sending'})
+
+    def test_failed_message_holds_later_messages_of_its_chat(self):
+        self.enqueue(('-1', 'a1'), ('-1', 'a2'), ('-2', 'b1'), ('-1', 'a3'))
+        items = outbox.claim_batch(10)
+        skipped = ChatSkipped('Ожидает доставки предыдущего сообщения в чат -1')
+        outbox.complete_batch(items, [NetworkError('timeout'), skipped, None, skipped])
+
+        first = TelegramOutbox.objects.get(text='a1')
+        self.assertEqual((first.status, first.attempts), ('pending', 1))
+        self.assertGreater(first.next_attempt_at, timezone.now())
+        self.assertEqual(first.last_error, 'timeout')
+        # Пропущенные сообщения ждут без траты попытки
+        self.assertEqual(
+            list(TelegramOutbox.objects.filter(text__in=['a2', 'a3']).values_list('status', 'attempts')),
+            [('pending', 0), ('pending', 0)],
+        )
+        self.assertEqual(TelegramOutbox.objects.get(text='b1').status, 'sent')
+
+        # a2 и a3 уже готовы к отправке, но не обгоняют отложенное a1
+        self.enqueue(('-2', 'b2'))
+        self.assertEqual(self.texts(outbox.claim_batch(10)), ['b2'])
+
+        TelegramOutbox.objects.filter(text='a1').update(next_attempt_at=timezone.now())
+        self.assertEqual(self.texts(outbox.claim_batch(10)), ['a1', 'a2', 'a3'])
+
+    def test_message_sent_by_another_worker_blocks_its_chat(self):
+        self.enqueue(('-1', 'a1'), ('-1', 'a2'), ('-2', 'b1'))
+        self.assertEqual(self.texts(outbox.claim_batch(1)), ['a1'])
+        # Второй воркер не берет a2, пока a1 отправляется
+        self.assertEqual(self.texts(outbox.claim_batch(10)), ['b1'])
+
+    def test_stale_lock_returns_to_queue(self):
+        self.enqueue(('-1', 'a1'))
+        outbox.claim_batch(10)
+        TelegramOutbox.objects.update(locked_at=timezone.now() - timedelta(seconds=301))
+        self.assertEqual(self.texts(outbox.claim_batch(10)), ['a1'])
+
+    def test_retry_backoff_until_failed(self):
+        self.enqueue(('-1', 'a1'))
+        for attempt in range(1, 4):
+            TelegramOutbox.objects.update(next_attempt_at=timezone.now())
+            items = outbox.claim_batch(10)
+            started = timezone.now()
+            outbox.complete_batch(items, [NetworkError('timeout')])
+            item = TelegramOutbox.objects.get()
+            self.assertEqual(item.attempts, attempt)
+            if attempt < 3:
+                self.assertEqual(item.status, 'pending')
+                delay = (item.next_attempt_at - started).total_seconds()
+                self.assertAlmostEqual(delay, outbox.retry_delay(attempt), delta=1)
+        self.assertEqual(item.status, 'failed')
+        self.assertEqual(outbox.claim_batch(10), [])
+        self.assertEqual([outbox.retry_delay(n) for n in (1, 2, 3, 10)], [5, 10, 20, 600])
+
+    def test_retry_after_reschedules_without_attempt(self):
+        self.enqueue(('-1', 'a1'))
+        items = outbox.claim_batch(10)
+        started = timezone.now()
+        outbox.complete_batch(items, [RetryAfter(30)])
+        item = TelegramOutbox.objects.get()
+        self.assertEqual((item.status, item.attempts), ('pending', 0))
+        self.assertAlmostEqual((item.next_attempt_at - started).total_seconds(), 30, delta=1)
+
+    def test_history_status_after_last_message(self):
+        outbox.enqueue(self.user.id, [(rule('-1'), 'a1'), (rule('-2'), 'b1')], ['k1', 'k1'],
+                       history=[history(self.user, 'k1')])
+        outbox.enqueue(self.user.id, [(rule('-3'), 'c1')], ['k2'], history=[history(self.user, 'k2')])
+
+        items = outbox.claim_batch(10)
+        outbox.complete_batch(items, [None, NetworkError('timeout'), None])
+        # У k1 одно сообщение ждет повтора
+        self.assertEqual(InboundSms.objects.get(delivery_key='k1').delivery_status, 'queued')
+        self.assertEqual(InboundSms.objects.get(delivery_key='k2').delivery_status, 'sent')
+
+        TelegramOutbox.objects.filter(text='b1').update(attempts=2, next_attempt_at=timezone.now())
+        outbox.complete_batch(outbox.claim_batch(10), [NetworkError('timeout')])
+        self.assertEqual(InboundSms.objects.get(delivery_key='k1').delivery_status, 'partial')
+
+
+class FakeBot:
+    def __init__(self, fail_texts=()):
+        self.fail_texts = set(fail_texts)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if text in self.fail_texts:
+            self.fail_texts.discard(text)
+            raise NetworkError('timeout')
+        self.sent.append(text)
+
+
+@override_settings(OUTBOX_MAX_ATTEMPTS=3)
+class ProcessBatchTests(OutboxTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        limiter = TelegramRateLimiter(global_rate=1000, group_rate_per_minute=60000, private_rate=1000,
+                                      chat_burst=1000, max_retries=0)
+        patcher = mock.patch('users_app.delivery.get_limiter', return_value=limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_chat_order_kept_after_failure(self):
+        self.enqueue(('-1', 'a1'), ('-1', 'a2'), ('-2', 'b1'))
+        bot = FakeBot(fail_texts={'a1'})
+        self.assertEqual(asyncio.run(outbox.process_batch(bot, 10)), 3)
+        self.assertEqual(bot.sent, ['b1'])
+
+        TelegramOutbox.objects.filter(text='a1').update(next_attempt_at=timezone.now())
+        asyncio.run(outbox.process_batch(bot, 10))
+        self.assertEqual(bot.sent, ['b1', 'a1', 'a2'])
+        self.assertEqual(set(TelegramOutbox.objects.values_list('status', flat=True)), {'sent'})
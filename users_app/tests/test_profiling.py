@@ -0,0 +1,27 @@
+"""Запуск профилирования по заголовку PROFILING_HEADER."""
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from users_app.profiling import should_profile
+
+
+@override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_HEADER='X-Profile', PROFILING_ALLOWED_IPS=[])
+class ShouldProfileTests(SimpleTestCase):
+    def request(self, value=None, ip='127.0.0.1'):
+        headers = {} if value is None else {'HTTP_X_PROFILE': value}
+        return RequestFactory().get('/', REMOTE_ADDR=ip, **headers)
+
+    @override_settings(PROFILING_SECRET='')
+    def test_header_ignored_without_secret(self):
+        # За nginx все запросы приходят с 127.0.0.1
+        self.assertFalse(should_profile(self.request('1')))
+
+    @override_settings(PROFILING_SECRET='s3cret')
+    def test_secret_required(self):
+        self.assertFalse(should_profile(self.request()))
+        self.assertFalse(should_profile(self.request('1')))
+        self.assertTrue(should_profile(self.request('s3cret', ip='203.0.113.7')))
+
+    @override_settings(PROFILING_SECRET='s3cret', PROFILING_ALLOWED_IPS=['10.0.0.1'])
+    def test_allowed_ips_restrict_secret(self):
+        self.assertFalse(should_profile(self.request('s3cret', ip='203.0.113.7')))
+        self.assertTrue(should_profile(self.request('s3cret', ip='10.0.0.1')))
@@ -0,0 +1,34 @@
+"""Ожидание очереди в TelegramRateLimiter."""
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+from telegram.error import RetryAfter
+
+from users_app.rate_limit import TelegramRateLimiter
+
+
+class AcquireTests(SimpleTestCase):
+    def limiter(self):
+        return TelegramRateLimiter(global_rate=1, group_rate_per_minute=60, private_rate=1,
+                                   chat_burst=1, max_retries=0)
+
+    def test_waits_for_the_later_limit_not_the_sum(self):
+        limiter = self.limiter()
+        limiter.global_bucket.reserve()
+        limiter._chat_bucket(1).reserve()
+        with mock.patch('users_app.rate_limit.asyncio.sleep', new=mock.AsyncMock()) as sleep:
+            asyncio.run(limiter._acquire(1, max_wait=1.5))
+        # Оба ведра освободятся примерно через секунду: одна пауза около 1 сек, а не 2
+        sleep.assert_awaited_once()
+        self.assertAlmostEqual(sleep.await_args.args[0], 1, delta=0.05)
+
+    def test_defers_when_wait_exceeds_max_wait(self):
+        limiter = self.limiter()
+        limiter.global_bucket.reserve()
+        limiter._chat_bucket(1).reserve()
+        with self.assertRaises(RetryAfter):
+            asyncio.run(limiter._acquire(1, max_wait=0.5))
+        # Зарезервированные токены возвращены
+        self.assertGreaterEqual(limiter.global_bucket.tokens, -0.01)
+        self.assertGreaterEqual(limiter._chat_bucket(1).tokens, -0.01)
@@ -0,0 +1,71 @@
+"""Повторы запросов к БД и выключатель при недоступной БД."""
+import asyncio
+from unittest import mock
+
+from django.db import connections
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase, override_settings
+
+from users_app import retry
+from users_app.db import ConnectError
+from users_app.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, db_breaker, is_db_unavailable
+
+
+def refuse_connection():
+    # Так MySQLdb сообщает о недоступном сервере; Django оборачивает в OperationalError
+    raise OperationalError(2003, "Can't connect to MySQL server on 'db' (111)")
+
+
+class DbUnavailableTests(SimpleTestCase):
+    def setUp(self):
+        db_breaker.record_success()
+        self.addCleanup(db_breaker.record_success)
+
+    def test_connect_errors_are_unavailability(self):
+        self.assertTrue(is_db_unavailable(OperationalError(2002, "Can't connect to local MySQL server")))
+        self.assertTrue(is_db_unavailable(OperationalError(2003, "Can't connect to MySQL server")))
+        self.assertTrue(is_db_unavailable(ConnectError('unable to open database file')))
+        self.assertTrue(is_db_unavailable(OperationalError(2006, 'MySQL server has gone away')))
+        self.assertFalse(is_db_unavailable(OperationalError(1213, 'Deadlock found')))
+
+    def test_refused_connection_opens_breaker(self):
+        func = mock.Mock(return_value='ok')
+        connection = connections['default']
+        policy = RetryPolicy(max_attempts=1, base_delay=0, max_delay=0,
+                             retry_on=retry.db_retry.retry_on, breaker=db_breaker)
+
+        async def call():
+            return await policy.call(retry.run_db, func, operation='test')
+
+        with mock.patch.object(type(connection), 'ensure_connection', side_effect=refuse_connection):
+            for _ in range(db_breaker.failure_threshold):
+                with self.assertRaises(ConnectError):
+                    asyncio.run(call())
+        self.assertTrue(db_breaker.is_open())
+        func.assert_not_called()
+
+        # Пока цепь разомкнута, запрос не занимает поток пула БД
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(call())
+        func.assert_not_called()
+
+    def test_other_errors_do_not_open_breaker(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60)
+        policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0,
+                             retry_on=retry.db_retry.retry_on, breaker=breaker)
+        func = mock.AsyncMock(side_effect=OperationalError(1213, 'Deadlock found'))
+        with self.assertRaises(OperationalError):
+            asyncio.run(policy.call(func))
+        self.assertEqual(func.await_count, 1)
+        self.assertFalse(breaker.is_open())
+
+    @override_settings(DB_HEALTH_CHECK_INTERVAL=0)
+    def test_breaker_closes_after_successful_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+        policy = RetryPolicy(max_attempts=1, base_delay=0, max_delay=0,
+                             retry_on=retry.db_retry.retry_on, breaker=breaker)
+        with self.assertRaises(OperationalError):
+            asyncio.run(policy.call(mock.AsyncMock(side_effect=OperationalError(2002, 'refused'))))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(asyncio.run(policy.call(mock.AsyncMock(return_value='ok'))), 'ok')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
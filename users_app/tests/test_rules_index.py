@@ -0,0 +1,138 @@
+"""Индекс правил вебхука: корзины, обновления из сигналов, защита от устаревшей сборки."""
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from users_app import rules_index
+from users_app.models import ANY_SENDER, NumbersService, Rules, TelegramChats, User
+from users_app.rules_index import CompiledRule, RulesIndex
+
+
+def compiled(rule_id, sender, telephone='79990000001', text_match='any', text_pattern=''):
+    return CompiledRule(
+        id=rule_id, sender=sender, from_whom_id=1, telephone=telephone, to_whom_id=1,
+        chat_id='-1', chat_title='Канал', text_match=text_match, text_pattern=text_pattern,
+    )
+
+
+def ids(rules):
+    return [rule.id for rule in rules]
+
+
+class RulesIndexMatchTests(SimpleTestCase):
+    def test_exact_and_wildcard_merged_in_id_order(self):
+        index = RulesIndex([
+            compiled(5, 'Bank'),
+            compiled(2, ANY_SENDER),
+            compiled(7, ANY_SENDER),
+            compiled(3, 'Bank'),
+            compiled(4, 'Shop'),
+            compiled(6, 'Bank', telephone='79990000002'),
+        ])
+        self.assertEqual(ids(index.match('79990000001', 'Bank')), [2, 3, 5, 7])
+        self.assertEqual(ids(index.match('79990000001', 'Unknown')), [2, 7])
+        self.assertEqual(ids(index.match('79990000001', ANY_SENDER)), [2, 7])
+        self.assertEqual(ids(index.match('79990000002', 'Bank')), [6])
+        self.assertEqual(index.match('79990000003', 'Bank'), [])
+
+    def test_only_exact_or_only_wildcard(self):
+        index = RulesIndex([compiled(1, 'Bank'), compiled(2, ANY_SENDER, telephone='79990000002')])
+        self.assertEqual(ids(index.match('79990000001', 'Bank')), [1])
+        self.assertEqual(ids(index.match('79990000002', 'Bank')), [2])
+
+    def test_add_replaces_rule_with_same_id(self):
+        index = RulesIndex([compiled(1, 'Bank'), compiled(2, 'Bank')])
+        index.add(compiled(1, 'Shop'))
+        self.assertEqual(ids(index.match('79990000001', 'Bank')), [2])
+        self.assertEqual(ids(index.match('79990000001', 'Shop')), [1])
+        self.assertEqual(len(index), 2)
+
+    def test_remove_drops_empty_bucket(self):
+        index = RulesIndex([compiled(1, 'Bank')])
+        index.remove(1)
+        index.remove(1)
+        self.assertEqual(index.match('79990000001', 'Bank'), [])
+        self.assertEqual(index._buckets, {})
+
+    def test_text_rules_filtered_after_number_and_sender(self):
+        index = RulesIndex([
+            compiled(1, 'Bank'),
+            compiled(2, 'Bank', text_match='keywords', text_pattern='код, пароль'),
+            compiled(3, ANY_SENDER, text_match='regex', text_pattern=r'\d{4}'),
+        ])
+        self.assertEqual(ids(index.match('79990000001', 'Bank', 'Ваш КОД 1234')), [1, 2, 3])
+        self.assertEqual(ids(index.match('79990000001', 'Bank', 'Пароль: abc')), [1, 2])
+        self.assertEqual(ids(index.match('79990000001', 'Bank', 'Привет')), [1])
+        # Изменение текстового правила пересобирает фильтр
+        index.add(compiled(2, 'Bank', text_match='keywords', text_pattern='привет'))
+        self.assertEqual(ids(index.match('79990000001', 'Bank', 'Привет')), [1, 2])
+
+
+class RulesIndexSignalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(password='password', phone='79000000030', email='index@example.com')
+        cls.number = NumbersService.objects.create(user=cls.user, name='Novofon', telephone='79990000001')
+        cls.chat = TelegramChats.objects.create(user=cls.user, title='Канал', chat_id='-100')
+        cls.rule = Rules.objects.create(user=cls.user, sender='Bank', from_whom=cls.number, to_whom=cls.chat)
+
+    def setUp(self):
+        rules_index._indexes.clear()
+        rules_index._generations.clear()
+        self.addCleanup(rules_index._indexes.clear)
+
+    def build(self):
+        index = rules_index.build_index(self.user.id)
+        self.assertIs(rules_index.get_cached_index(self.user.id), index)
+        return index
+
+    def test_signals_update_cached_index(self):
+        index = self.build()
+        wildcard = Rules.objects.create(user=self.user, sender=ANY_SENDER, from_whom=self.number, to_whom=self.chat)
+        self.assertIs(rules_index.get_cached_index(self.user.id), index)
+        self.assertEqual(ids(index.match('79990000001', 'Bank')), [self.rule.id, wildcard.id])
+
+        self.rule.sender = 'Shop'
+        self.rule.save()
+        self.assertEqual(ids(index.match('79990000001', 'Shop')), [self.rule.id, wildcard.id])
+        self.assertEqual(ids(index.match('79990000001', 'Bank')), [wildcard.id])
+
+        self.number.telephone = '79990000009'
+        self.number.save()
+        self.assertEqual(index.match('79990000001', 'Shop'), [])
+        self.assertEqual(ids(index.match('79990000009', 'Shop')), [self.rule.id, wildcard.id])
+
+        self.chat.chat_id = '-200'
+        self.chat.save()
+        self.assertEqual({rule.chat_id for rule in index.match('79990000009', 'Shop')}, {'-200'})
+
+        wildcard.delete()
+        self.assertEqual(ids(index.match('79990000009', 'Shop')), [self.rule.id])
+
+        self.chat.delete()
+        self.assertEqual(len(index), 0)
+        self.assertIs(rules_index.get_cached_index(self.user.id), index)
+
+    def test_rule_saved_without_cached_index_invalidates(self):
+        Rules.objects.create(user=self.user, sender='Shop', from_whom=self.number, to_whom=self.chat)
+        self.assertIsNone(rules_index.get_cached_index(self.user.id))
+        self.assertEqual(len(self.build()), 2)
+
+    def test_build_started_before_change_is_not_cached(self):
+        rows = list(rules_index._index_rows(self.user.id))
+
+        def rows_then_change(user_id):
+            # Правило меняется, пока индекс строится по уже прочитанным строкам
+            Rules.objects.create(user=self.user, sender='Shop', from_whom=self.number, to_whom=self.chat)
+            return rows
+
+        with mock.patch.object(rules_index, '_index_rows', side_effect=rows_then_change):
+            stale = rules_index.build_index(self.user.id)
+        self.assertEqual(len(stale), 1)
+        self.assertIsNone(rules_index.get_cached_index(self.user.id))
+        self.assertEqual(len(self.build()), 2)
+
+    def test_expired_index_is_rebuilt(self):
+        self.build()
+        with self.settings(RULES_INDEX_TTL=-1):
+            self.assertIsNone(rules_index.get_cached_index(self.user.id))
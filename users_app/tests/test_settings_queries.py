@@ -0,0 +1,84 @@
+"""
+Количество запросов страниц настроек не зависит от числа правил, ключей и
+номеров пользователя: связанные объекты читаются JOIN, списки — постранично.
+"""
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from users_app.models import Key, NumbersService, Rules, TelegramChats, User
+
+
+def create_user(phone, count):
+    """Пользователь с count правилами, ключами и номерами."""
+    user = User.objects.create_user(password='password', phone=phone, email=f'{phone}@example.com')
+    numbers = [
+        NumbersService.objects.create(user=user, name='Novofon', telephone=f'{phone}{i:03d}')
+        for i in range(count)
+    ]
+    chats = TelegramChats.objects.bulk_create(
+        TelegramChats(user=user, title=f'Канал {i}', chat_id=str(-1000 - i)) for i in range(count)
+    )
+    Key.objects.bulk_create(
+        Key(user=user, name='Novofon', title=f'Ключ {i}', token=f'token-{phone}-{i}') for i in range(count)
+    )
+    Rules.objects.bulk_create(
+        Rules(user=user, sender=f'Банк {i}', from_whom=numbers[i], to_whom=chats[i]) for i in range(count)
+    )
+    return user
+
+
+class SettingsPagesQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.small_user = create_user('79000000001', 3)
+        cls.large_user = create_user('79000000002', 100)
+
+    def count_queries(self, user, url):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url, variants):
+        expected = self.count_queries(self.small_user, url)
+        for params in variants:
+            with self.subTest(params=params):
+                self.client.force_login(self.large_user)
+                with self.assertNumQueries(expected):
+                    response = self.client.get(url + params)
+                self.assertEqual(response.status_code, 200)
+
+    def test_rules_page(self):
+        self.assert_constant_queries(reverse('settings_rules'), [
+            '',
+            '?page=2',
+            '?q=Банк',
+            '?q=Канал&page=3',
+        ])
+
+    def test_rules_page_search_matches_small_user(self):
+        url = reverse('settings_rules')
+        self.assertEqual(
+            self.count_queries(self.small_user, url + '?q=Банк'),
+            self.count_queries(self.large_user, url + '?q=Банк&page=2'),
+        )
+
+    def test_services_page(self):
+        self.assert_constant_queries(reverse('settings_service'), [
+            '',
+            '?keys_page=2',
+            '?numbers_page=3&keys_page=2',
+            '?q=Novofon',
+            '?q=Novofon&keys_page=2&numbers_page=3',
+        ])
+
+    def test_large_user_pages_are_not_empty(self):
+        self.client.force_login(self.large_user)
+        response = self.client.get(reverse('settings_rules') + '?page=2')
+        self.assertEqual(response.context['user_rules'].number, 2)
+        self.assertTrue(response.context['user_rules'].object_list)
+        response = self.client.get(reverse('settings_service') + '?numbers_page=3')
+        self.assertEqual(response.context['user_numbers'].number, 3)
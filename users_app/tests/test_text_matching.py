@@ -0,0 +1,81 @@
+"""Условия по тексту SMS: TextMatcher и автомат Ахо — Корасик."""
+import random
+
+from django.test import SimpleTestCase
+
+from users_app.rules_index import CompiledRule, TextMatcher
+from utils.aho_corasick import AhoCorasick
+
+
+def compiled(rule_id, text_match='any', text_pattern=''):
+    return CompiledRule(
+        id=rule_id, sender='Bank', from_whom_id=1, telephone='79990000001', to_whom_id=1,
+        chat_id='-1', chat_title='Канал', text_match=text_match, text_pattern=text_pattern,
+    )
+
+
+def ids(rules):
+    return [rule.id for rule in rules]
+
+
+class AhoCorasickTests(SimpleTestCase):
+    def test_overlapping_and_nested_patterns(self):
+        automaton = AhoCorasick([('he', 1), ('she', 2), ('his', 3), ('hers', 4), ('', 5)])
+        self.assertEqual(automaton.search('ushers'), {1, 2, 4})
+        self.assertEqual(automaton.search('ahishe'), {1, 2, 3})
+        self.assertEqual(automaton.search(''), set())
+
+    def test_same_word_for_several_values(self):
+        automaton = AhoCorasick([('код', 1), ('код', 2), ('пароль', 3)])
+        self.assertEqual(automaton.search('ваш код 1234'), {1, 2})
+
+    def test_matches_naive_substring_search(self):
+        rng = random.Random(13)
+        for _ in range(200):
+            words = [''.join(rng.choices('abc', k=rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+            text = ''.join(rng.choices('abcd', k=rng.randint(0, 30)))
+            patterns = list(enumerate(words))
+            expected = {value for value, word in patterns if word in text}
+            with self.subTest(words=words, text=text):
+                self.assertEqual(AhoCorasick((word, value) for value, word in patterns).search(text), expected)
+
+
+class TextMatcherTests(SimpleTestCase):
+    def test_keywords_case_insensitive(self):
+        rules = [
+            compiled(1, 'keywords', 'Код, пароль'),
+            compiled(2, 'keywords', 'перевод\nзачисление'),
+            compiled(3),
+        ]
+        matcher = TextMatcher(rules)
+        self.assertEqual(ids(matcher.filter(rules, 'Ваш КОД: 1234')), [1, 3])
+        self.assertEqual(ids(matcher.filter(rules, 'Зачисление 500 р, пароль не сообщайте')), [1, 2, 3])
+        self.assertEqual(ids(matcher.filter(rules, 'Привет')), [3])
+
+    def test_regex(self):
+        rules = [compiled(1, 'regex', r'\b\d{4}\b'), compiled(2, 'regex', r'^баланс')]
+        matcher = TextMatcher(rules)
+        self.assertIsNotNone(matcher._combined)
+        self.assertEqual(ids(matcher.filter(rules, 'Код 1234')), [1])
+        self.assertEqual(ids(matcher.filter(rules, 'БАЛАНС 12345')), [2])
+        self.assertEqual(matcher.filter(rules, 'Привет'), [])
+
+    def test_backreference_disables_combined_filter(self):
+        # В общем выражении номер группы \1 указывал бы на чужую группу
+        rules = [compiled(1, 'regex', r'(a)(b)'), compiled(2, 'regex', r'(\d)\1')]
+        matcher = TextMatcher(rules)
+        self.assertIsNone(matcher._combined)
+        self.assertEqual(ids(matcher.filter(rules, 'код 1123')), [2])
+        self.assertEqual(ids(matcher.filter(rules, 'ab')), [1])
+        self.assertEqual(matcher.filter(rules, 'код 1234'), [])
+
+    def test_named_backreference(self):
+        rules = [compiled(1, 'regex', r'(?P<d>\d)(?P=d)')]
+        matcher = TextMatcher(rules)
+        self.assertIsNone(matcher._combined)
+        self.assertEqual(ids(matcher.filter(rules, '55')), [1])
+
+    def test_invalid_regex_does_not_break_other_rules(self):
+        rules = [compiled(1, 'regex', '('), compiled(2, 'regex', 'код'), compiled(3, 'keywords', 'код')]
+        matcher = TextMatcher(rules)
+        self.assertEqual(ids(matcher.filter(rules, 'Код')), [2, 3])
@@ -0,0 +1,72 @@
+"""Кеш пользователей вебхука и бота: сброс и ограничение размера."""
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from users_app import user_cache
+from users_app.models import User
+from utils.cache import MISSING, TTLCache
+
+
+def clear_caches():
+    for cache in (user_cache._token_cache, user_cache._unknown_token_cache, user_cache._tokens_by_user,
+                  user_cache._bot_user_cache, user_cache._bot_keys_by_user):
+        cache.clear()
+
+
+class InvalidationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(password='password', phone='79000000050', email='cache@example.com',
+                                            telegram_id='555')
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+
+    def remember(self):
+        user_cache.remember_webhook_user(self.user.token_url, self.user)
+        user_cache.remember_bot_user('telegram_id', '555', self.user)
+        self.assertIsNot(user_cache.get_webhook_user(self.user.token_url), MISSING)
+
+    def test_queryset_update_invalidates(self):
+        self.remember()
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertIs(user_cache.get_webhook_user(self.user.token_url), MISSING)
+        self.assertIs(user_cache.get_bot_user('telegram_id', '555'), MISSING)
+
+    def test_token_change_drops_old_token(self):
+        self.remember()
+        old_token = self.user.token_url
+        self.user.token_url = 'new-token'
+        self.user.save()
+        self.assertIs(user_cache.get_webhook_user(old_token), MISSING)
+
+    def test_delete_invalidates(self):
+        self.remember()
+        token = self.user.token_url
+        self.user.delete()
+        self.assertIs(user_cache.get_webhook_user(token), MISSING)
+        self.assertIs(user_cache.get_bot_user('telegram_id', '555'), MISSING)
+
+
+class BoundedReverseMapsTests(SimpleTestCase):
+    def test_reverse_maps_do_not_grow_past_cache_size(self):
+        patches = [
+            mock.patch.object(user_cache, name, TTLCache(maxsize=10, ttl=60))
+            for name in ('_token_cache', '_tokens_by_user', '_bot_user_cache', '_bot_keys_by_user')
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        for user_id in range(100):
+            user = User(id=user_id, phone=f'7900000{user_id:04d}', is_active=True)
+            user_cache.remember_webhook_user(f'token-{user_id}', user)
+            user_cache.remember_bot_user('phone', user.phone, user)
+        self.assertEqual(len(user_cache._tokens_by_user), 10)
+        self.assertEqual(len(user_cache._bot_keys_by_user), 10)
+
+        user_cache.invalidate_user(99)
+        self.assertIs(user_cache.get_webhook_user('token-99'), MISSING)
+        self.assertIs(user_cache.get_bot_user('phone', '79000000099'), MISSING)
@@ -0,0 +1,73 @@
+"""
+Параллельная обработка обновлений Telegram-бота.
+
+Обновления разных пользователей обрабатываются одновременно (не больше
+TELEGRAM_BOT_CONCURRENT_UPDATES), поэтому долгий повтор запроса к БД у одного
+пользователя не задерживает /start остальных. Обновления одного и того же
+пользователя или чата выполняются строго по очереди: два контакта от одного
+человека не могут одновременно пройти проверку get_existing_user_by_phone и
+оба дойти до create_user.
+"""
+import asyncio
+import contextlib
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_keys(update):
+    """
+    Ключи сериализации обновления: пользователь и чат.
+
+    Returns:
+        Отсортированный список ключей (единый порядок захвата блокировок
+        исключает взаимную блокировку)
+    """
+    if not isinstance(update, Update):
+        return []
+    keys = set()
+    if update.effective_user is not None:
+        keys.add(('user', update.effective_user.id))
+    if update.effective_chat is not None:
+        keys.add(('chat', update.effective_chat.id))
+    return sorted(keys)
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Ограничивает число одновременно обрабатываемых обновлений и сериализует
+    обновления с общим пользователем или чатом.
+
+    Обновление, ждущее своей очереди, занимает место в лимите: лимит
+    ограничивает и число ожидающих задач.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # Ключ -> [asyncio.Lock, сколько обновлений держат или ждут блокировку]
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                # Блокировки не копятся для всех когда-либо писавших пользователей
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        async with contextlib.AsyncExitStack() as stack:
+            for key in update_keys(update):
+                await stack.enter_async_context(self._lock(key))
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
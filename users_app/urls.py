@@ -11,9 +11,15 @@ urlpatterns = [
     path('faq/', views.faq, name='faq'),
     path('settings_rules/', views.settings_rules, name='settings_rules'),
     path('settings_rules/delete/<int:rule_id>/', views.delete_rule, name='delete_rule'),
+    path('settings_rules/import/', views.import_rules, name='import_rules'),
+    path('settings_rules/export/', views.export_rules, name='export_rules'),
     path('settings_service/', views.settings_service, name='settings_service'),
     path('settings_service/delete/<int:key_id>/', views.delete_service, name='delete_service'),
     path('webhook/<str:token>/', views.get_webhook, name='webhook'),
+    path('webhook/<str:token>/batch/', views.get_webhook_batch, name='webhook_batch'),
+    path('provider/webhook/<str:token>/', views.provider_webhook, name='provider_webhook'),
+    path('telegram/webhook/', views.telegram_webhook, name='telegram_webhook'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('delete_number_service/<int:id>/', views.delete_number_service, name='delete_number_service')
 
 ]
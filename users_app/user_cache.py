@@ -0,0 +1,157 @@
+"""
+Кеши пользователей для вебхука и Telegram-бота.
+
+token_url -> WebhookUser (id, phone, is_active) хранится в ограниченном
+TTL/LRU-кеше, неизвестные токены — в отдельном негативном кеше, чтобы перебор
+случайных токенов не вытеснял настоящих пользователей и не нагружал MySQL.
+
+Бот ищет пользователей по telegram_id и телефону на каждый /start в группе и
+на каждый контакт. Эти поиски кешируются отдельно (BOT_USER_CACHE_*), вместе
+с отрицательными результатами: незарегистрированный пользователь, который
+снова и снова нажимает /start, не идет каждый раз в MySQL.
+
+Записи сбрасываются из User.save() (в том числе при регистрации через
+create_user), из User.objects...update() (UserQuerySet в users_app/managers.py)
+и сигнала удаления пользователя. Обновление в обход ORM (сырой SQL) кеш не
+сбрасывает. В других процессах изменения видны не позже чем через
+WEBHOOK_TOKEN_CACHE_TTL / BOT_USER_CACHE_TTL секунд.
+
+Обратные индексы user_id -> ключи кешей ограничены так же, как сами кеши:
+запись индекса живет столько же, сколько запись кеша, ради которой она
+создана.
+"""
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+from utils.cache import MISSING, TTLCache
+
+WebhookUser = namedtuple('WebhookUser', ['id', 'phone', 'is_active'])
+
+_token_cache = TTLCache(
+    maxsize=settings.WEBHOOK_TOKEN_CACHE_SIZE,
+    ttl=settings.WEBHOOK_TOKEN_CACHE_TTL,
+)
+_unknown_token_cache = TTLCache(
+    maxsize=settings.WEBHOOK_TOKEN_CACHE_SIZE,
+    ttl=settings.WEBHOOK_TOKEN_NEGATIVE_TTL,
+)
+# user_id -> token_url, чтобы сбросить запись при смене токена пользователя
+_tokens_by_user = TTLCache(
+    maxsize=settings.WEBHOOK_TOKEN_CACHE_SIZE,
+    ttl=settings.WEBHOOK_TOKEN_CACHE_TTL,
+)
+# (поле, значение) -> User или None (пользователь не найден)
+_bot_user_cache = TTLCache(
+    maxsize=settings.BOT_USER_CACHE_SIZE,
+    ttl=settings.BOT_USER_CACHE_TTL,
+)
+# user_id -> ключи _bot_user_cache, чтобы сбросить записи при смене telegram_id или телефона
+_bot_keys_by_user = TTLCache(
+    maxsize=settings.BOT_USER_CACHE_SIZE,
+    ttl=settings.BOT_USER_CACHE_TTL,
+)
+_lock = threading.Lock()
+
+
+def get_webhook_user(token):
+    """
+    Ищет пользователя вебхука в кеше.
+
+    Returns:
+        WebhookUser, None если токен заведомо неизвестен, или MISSING если
+        в кеше ничего нет и нужно идти в БД
+    """
+    user = _token_cache.get(token)
+    if user is not MISSING:
+        return user
+    if _unknown_token_cache.get(token) is not MISSING:
+        return None
+    return MISSING
+
+
+def remember_webhook_user(token, user):
+    """
+    Сохраняет результат поиска пользователя по токену.
+
+    Args:
+        token: token_url из URL вебхука
+        user: User object или None, если пользователь не найден
+
+    Returns:
+        WebhookUser или None
+    """
+    if user is None:
+        _unknown_token_cache.set(token, True)
+        return None
+
+    webhook_user = WebhookUser(id=user.id, phone=user.phone, is_active=user.is_active)
+    _tokens_by_user.set(user.id, token)
+    _token_cache.set(token, webhook_user)
+    return webhook_user
+
+
+def get_bot_user(field, value):
+    """
+    Ищет пользователя бота в кеше.
+
+    Args:
+        field: 'telegram_id' или 'phone'
+        value: Значение поля (телефон без '+')
+
+    Returns:
+        User, None если пользователя заведомо нет, или MISSING если в кеше
+        ничего нет и нужно идти в БД
+    """
+    return _bot_user_cache.get((field, str(value)))
+
+
+def remember_bot_user(field, value, user):
+    """
+    Сохраняет результат поиска пользователя бота.
+
+    Args:
+        field: 'telegram_id' или 'phone'
+        value: Значение поля (телефон без '+')
+        user: User object или None, если пользователь не найден
+
+    Returns:
+        user
+    """
+    key = (field, str(value))
+    if user is None:
+        _bot_user_cache.set(key, None, ttl=settings.BOT_USER_NEGATIVE_TTL)
+        return None
+
+    with _lock:
+        _bot_keys_by_user.set(user.id, _bot_keys_by_user.get(user.id, frozenset()) | {key})
+    _bot_user_cache.set(key, user)
+    return user
+
+
+def invalidate_user(user_id, token=None, telegram_id=None, phone=None):
+    """
+    Сбрасывает кешированные записи пользователя.
+
+    Args:
+        user_id: ID пользователя
+        token: Текущий token_url (сбрасывает негативную запись нового токена)
+        telegram_id: Текущий telegram_id (сбрасывает негативную запись бота)
+        phone: Текущий телефон (сбрасывает негативную запись бота)
+    """
+    old_token = _tokens_by_user.pop(user_id, None)
+    with _lock:
+        bot_keys = set(_bot_keys_by_user.pop(user_id, ()))
+    if old_token is not None:
+        _token_cache.pop(old_token)
+    if token:
+        _token_cache.pop(token)
+        _unknown_token_cache.pop(token)
+
+    if telegram_id:
+        bot_keys.add(('telegram_id', str(telegram_id)))
+    if phone:
+        bot_keys.add(('phone', str(phone)))
+    for key in bot_keys:
+        _bot_user_cache.pop(key)
@@ -0,0 +1,23 @@
+"""Проверки данных, общие для форм сайта и REST API."""
+import re
+
+from django.core.exceptions import ValidationError
+
+
+def clean_service_phone(value):
+    """
+    Приводит номер NumbersService к формату 7XXXXXXXXXX.
+
+    Args:
+        value: Номер в любом написании (+7 (999) 123-45-67, 8-999-...)
+
+    Returns:
+        str: 11 цифр, начинающихся с 7
+
+    Raises:
+        ValidationError: Если номер не в формате 7XXXXXXXXXX
+    """
+    telephone = re.sub(r'\D', '', str(value or ''))
+    if len(telephone) != 11 or not telephone.startswith('7'):
+        raise ValidationError('Номер телефона должен быть в формате 7XXXXXXXXXX (11 цифр, начинающихся с 7).')
+    return telephone
@@ -1,20 +1,34 @@
+import asyncio
+import hmac
 import json
 import logging
+import random
 import time
-from django.db import connections
+import uuid
 
-from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseForbidden
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.http import (
+    FileResponse, Http404, HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
+)
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
-from django.db.utils import OperationalError
-from telegram import Bot
 
-from users_app.forms import ServiceForm, ServiceKeyForm
-from users_app.models import NumbersService, Rules, Key, User
+from users_app import (
+    bot_webhook, dedup, outbox, phone_directory, profiling, rules_index, rules_io, sms_formats, sms_history,
+    telegram_client, user_cache
+)
+from users_app.delivery import format_sms_message, send_to_chats
+from users_app.forms import RulesImportForm, ServiceForm, ServiceKeyForm
+from users_app.metrics import WEBHOOK_REQUESTS, WEBHOOK_STAGE_SECONDS
+from users_app.models import ANY_SENDER, NumbersService, Rules, Key, User
+from users_app.retry import db_breaker, db_retry, is_db_unavailable, run_db_with_retry
+from utils import metrics
+from utils.cache import MISSING
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +75,21 @@ def faq(request):
     return render(request, 'html/a_faq.html')
 
 
+def paginate(request, queryset, param='page'):
+    """
+    Страница queryset по номеру из GET-параметра param.
+
+    У страницы есть param и querystring (остальные GET-параметры: поиск,
+    номера других списков) для ссылок в html/partials/pagination.html.
+    """
+    page = Paginator(queryset, settings.SETTINGS_PAGE_SIZE).get_page(request.GET.get(param))
+    query = request.GET.copy()
+    query.pop(param, None)
+    page.param = param
+    page.querystring = query.urlencode()
+    return page
+
+
 @login_required
 def settings_rules(request):
     if request.method == 'POST':
@@ -71,7 +100,7 @@ def settings_rules(request):
             # Проверяем, установлен ли флаг "Любой отправитель"
             any_sender = form.cleaned_data.get('any_sender', False)
             if any_sender:  # Если флаг установлен
-                sender = 'Любой отправитель'
+                sender = ANY_SENDER
             else:
                 sender = form.cleaned_data['sender']
 
@@ -83,7 +112,9 @@ def settings_rules(request):
                 user=request.user,
                 sender=sender,
                 from_whom=telephone,
-                to_whom=telegram_chat
+                to_whom=telegram_chat,
+                text_match=form.cleaned_data['text_match'],
+                text_pattern=form.cleaned_data['text_pattern']
             )
             
             logger.info(f"Создано новое правило (ID: {rule.id}) для пользователя {request.user.phone}: {sender} -> {telegram_chat.title}")
@@ -97,10 +128,70 @@ def settings_rules(request):
     else:
         form = ServiceForm(user=request.user)
 
-    # Получаем все правила для текущего пользователя
-    user_rules = Rules.objects.filter(user=request.user)
+    # Номер и канал читаются одним JOIN, а не отдельным запросом на каждое правило
+    user_rules = Rules.objects.filter(user=request.user).select_related('from_whom', 'to_whom').order_by('id')
+    search = request.GET.get('q', '').strip()
+    if search:
+        user_rules = user_rules.filter(
+            Q(sender__icontains=search)
+            | Q(from_whom__telephone__icontains=search)
+            | Q(to_whom__title__icontains=search)
+            | Q(to_whom__chat_id__icontains=search)
+        )
+
+    return render(request, 'html/a_my_forms.html', {
+        'form': form,
+        'import_form': RulesImportForm(),
+        'user_rules': paginate(request, user_rules),
+        'search': search,
+    })
+
+
+@login_required
+def import_rules(request):
+    """Массовый импорт правил из CSV или JSON (см. users_app/rules_io.py)."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'errors': 'Method not allowed'}, status=405)
+    form = RulesImportForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors})
+
+    uploaded_file = form.cleaned_data['file']
+    started = time.perf_counter()
+    try:
+        result = rules_io.import_rules(request.user, uploaded_file, form.cleaned_data['format'])
+    except rules_io.RulesFileError as e:
+        logger.warning(f"Импорт правил пользователя {request.user.phone}: {e}")
+        return JsonResponse({'success': False, 'errors': str(e)})
+
+    duration_ms = (time.perf_counter() - started) * 1000
+    if result['error_count']:
+        logger.warning(f"Импорт правил пользователя {request.user.phone} отклонен: "
+                       f"{result['error_count']} ошибок в {uploaded_file.name}")
+        return JsonResponse({'success': False, **result})
+    logger.info(f"📥 Пользователь {request.user.phone} импортировал {result['created']} правил "
+                f"из {uploaded_file.name} (дублей: {result['duplicates']}) за {duration_ms:.0f} мс")
+    return JsonResponse({'success': True, **result})
 
-    return render(request, 'html/a_my_forms.html', {'form': form, 'user_rules': user_rules})
+
+@login_required
+def export_rules(request):
+    """
+    Потоковая выгрузка всех правил пользователя (?format=csv|json).
+
+    Тело — асинхронный генератор: под ASGI Django отдает его по частям, не
+    собирая весь файл в список.
+    """
+    file_format = request.GET.get('format', 'csv')
+    if file_format == 'json':
+        response = StreamingHttpResponse(rules_io.export_json(request.user.id), content_type='application/json')
+    else:
+        file_format = 'csv'
+        response = StreamingHttpResponse(
+            rules_io.export_csv(request.user.id), content_type='text/csv; charset=utf-8'
+        )
+    response['Content-Disposition'] = f'attachment; filename="rules.{file_format}"'
+    return response
 
 
 @login_required
@@ -142,14 +233,22 @@ def settings_service(request):
     else:
         form = ServiceKeyForm()
 
-    # Получаем все объекты для текущего пользователя
-    user_keys = Key.objects.filter(user=request.user)
-    user_numbers = NumbersService.objects.filter(user=request.user)
+    user_keys = Key.objects.filter(user=request.user).order_by('id')
+    user_numbers = NumbersService.objects.filter(user=request.user).order_by('id')
+    search = request.GET.get('q', '').strip()
+    if search:
+        user_keys = user_keys.filter(Q(name__icontains=search) | Q(title__icontains=search))
+        user_numbers = user_numbers.filter(Q(name__icontains=search) | Q(telephone__icontains=search))
 
     return render(
         request,
         'html/a_my_input.html',
-        {'form': form, 'user_keys': user_keys, 'user_numbers': user_numbers}
+        {
+            'form': form,
+            'user_keys': paginate(request, user_keys, 'keys_page'),
+            'user_numbers': paginate(request, user_numbers, 'numbers_page'),
+            'search': search,
+        }
     )
 
 
@@ -175,185 +274,625 @@ def delete_service(request, key_id):
     return render(request, 'html/confirm_delete.html', {'key': key})
 
 
-async def get_user_by_token_with_retry(token, max_retries=3):
-    """Получение пользователя по токену с ретраями"""
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"🔍 WEBHOOK: попытка {attempt + 1} получения пользователя по токену {token[:8]}...")
-            user = await sync_to_async(User.objects.get)(token_url=token)
-            logger.info(f"✅ WEBHOOK: пользователь найден: {user.phone} (ID: {user.id})")
-            return user
-        except User.DoesNotExist:
-            logger.warning(f"❌ WEBHOOK: пользователь с токеном {token[:8]}... не найден")
-            return None
-        except OperationalError as e:
-            if e.args[0] in (2006, 2013):  # MySQL connection errors
-                logger.warning(f"⚠️ WEBHOOK: ошибка подключения к БД (попытка {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    connections.close_all()
-                    await sync_to_async(time.sleep)(0.5 * (2 ** attempt))
-                    continue
-            raise
-        except Exception as e:
-            logger.error(f"💥 WEBHOOK: неожиданная ошибка при получении пользователя: {e}")
-            raise
-    
-    logger.error(f"💥 WEBHOOK: все попытки получения пользователя исчерпаны")
-    raise Exception("Failed to get user after all retries")
-
-
-async def get_rules_with_retry(user, max_retries=3):
-    """Получение правил пользователя с ретраями"""
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"🔍 WEBHOOK: попытка {attempt + 1} получения правил для пользователя {user.phone}")
-            # Используем select_related для загрузки связанных объектов
-            rules_queryset = Rules.objects.filter(user=user).select_related('to_whom', 'from_whom')
-            rules_list = await sync_to_async(lambda: list(rules_queryset))()
-            logger.info(f"✅ WEBHOOK: найдено {len(rules_list)} правил для пользователя {user.phone}")
-            return rules_list
-        except OperationalError as e:
-            if e.args[0] in (2006, 2013):  # MySQL connection errors
-                logger.warning(f"⚠️ WEBHOOK: ошибка подключения к БД при получении правил (попытка {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    connections.close_all()
-                    await sync_to_async(time.sleep)(0.5 * (2 ** attempt))
-                    continue
-            raise
-        except Exception as e:
-            logger.error(f"💥 WEBHOOK: ошибка при получении правил: {e}")
-            raise
-    
-    logger.error(f"💥 WEBHOOK: все попытки получения правил исчерпаны")
-    raise Exception("Failed to get rules after all retries")
+async def get_user_by_token_with_retry(token):
+    """Получение пользователя по токену с кешем и ретраями"""
+    cached = user_cache.get_webhook_user(token)
+    if cached is not MISSING:
+        if cached is None:
+            logger.debug("❌ WEBHOOK: токен %s... в кеше неизвестных токенов", token[:8])
+        else:
+            logger.debug("✅ WEBHOOK: пользователь взят из кеша: %s (ID: %s)", cached.phone, cached.id)
+        return cached
 
+    users = User.objects.only('id', 'phone', 'is_active')
+    try:
+        if settings.WEBHOOK_ASYNC_ORM:
+            user = await db_retry.call(users.aget, token_url=token, operation='webhook_user')
+        else:
+            user = await run_db_with_retry(users.get, token_url=token, operation='webhook_user')
+    except User.DoesNotExist:
+        logger.warning(f"❌ WEBHOOK: пользователь с токеном {token[:8]}... не найден")
+        return user_cache.remember_webhook_user(token, None)
+    logger.debug("✅ WEBHOOK: пользователь найден: %s (ID: %s)", user.phone, user.id)
+    return user_cache.remember_webhook_user(token, user)
+
+
+async def get_rules_index_with_retry(user):
+    """Получение скомпилированного индекса правил пользователя с ретраями"""
+    index = rules_index.get_cached_index(user.id)
+    if index is not None:
+        logger.debug("✅ WEBHOOK: индекс правил пользователя %s взят из памяти (%s правил)", user.phone, len(index))
+        return index
+
+    if settings.WEBHOOK_ASYNC_ORM:
+        index = await db_retry.call(rules_index.abuild_index, user.id, operation='webhook_rules')
+    else:
+        index = await run_db_with_retry(rules_index.build_index, user.id, operation='webhook_rules')
+    logger.debug("✅ WEBHOOK: индекс построен, %s правил для пользователя %s", len(index), user.phone)
+    return index
+
+
+def database_unavailable_response():
+    """Ответ при разомкнутом выключателе БД: провайдер повторит запрос позже."""
+    response = JsonResponse({'status': 'error', 'message': 'База данных временно недоступна'}, status=503)
+    response['Retry-After'] = str(max(1, round(db_breaker.retry_after())))
+    return response
+
+
+def log_webhook_summary(summary):
+    """
+    Пишет одну структурированную строку на запрос вебхука.
+
+    Успешные запросы логируются с вероятностью WEBHOOK_LOG_SAMPLE_RATE,
+    ошибки — всегда.
+    """
+    status = summary['status']
+    if status < 400:
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        if settings.WEBHOOK_LOG_SAMPLE_RATE < 1 and random.random() >= settings.WEBHOOK_LOG_SAMPLE_RATE:
+            return
+        level = logging.INFO
+    else:
+        level = logging.WARNING
+
+    logger.log(level, "WEBHOOK %s", ' '.join(f'{key}={value}' for key, value in summary.items()))
 
-@csrf_exempt
-async def get_webhook(request, token):
-    # Логируем КАЖДЫЙ запрос с временной меткой
-    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-    client_ip = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR', 'unknown'))
-    
-    logger.info(f"🌍 WEBHOOK ЗАПРОС [{timestamp}]: {request.method} от IP {client_ip}, токен: {token[:8]}...")
-    
-    if request.method != 'POST':
-        logger.warning(f"❌ WEBHOOK: неподдерживаемый метод {request.method}")
-        return JsonResponse({'status': 'error', 'message': 'Только POST-запросы поддерживаются'}, status=405)
 
+async def handle_webhook(request, summary, endpoint, process, *args):
+    """
+    Общая обертка вебхуков: выключатель БД, ошибки, метрики и строка лога.
+
+    Args:
+        summary: Итоги запроса для log_webhook_summary
+        endpoint: Метка метрик ('single', 'batch', 'provider')
+        process: Корутина обработки, вызывается как process(request, *args, summary)
+    """
+    started = time.perf_counter()
+    summary['ip'] = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR', 'unknown'))
     try:
-        # Логируем сырые данные запроса
-        raw_body = request.body
-        logger.info(f"📥 WEBHOOK: получены сырые данные ({len(raw_body)} байт): {raw_body[:500]}")
-        
-        # Парсим JSON
-        try:
-            data = json.loads(raw_body)
-            logger.info(f"📋 WEBHOOK: JSON успешно распарсен: {json.dumps(data, ensure_ascii=False, indent=2)}")
-        except json.JSONDecodeError as e:
-            logger.error(f"💥 WEBHOOK: ошибка парсинга JSON: {e}")
-            logger.error(f"💥 WEBHOOK: проблемные данные: {raw_body}")
-            return JsonResponse({'status': 'error', 'message': 'Неверный формат JSON'}, status=400)
-
-        # Получаем пользователя
-        user = await get_user_by_token_with_retry(token)
-        if user is None:
-            return HttpResponseForbidden('Неверный токен')
-
-        # Ищем данные SMS в разных форматах Novofon
-        sms_data = None
-        
-        # Вариант 1: данные в корне
-        if all(key in data for key in ['caller_id', 'caller_did', 'text']):
-            sms_data = data
-            logger.info(f"📱 WEBHOOK: обнаружен формат SMS в корне JSON")
-            
-        # Вариант 2: данные в блоке 'result'
-        elif 'result' in data and isinstance(data['result'], dict):
-            result = data['result']
-            if all(key in result for key in ['caller_id', 'caller_did', 'text']):
-                sms_data = result
-                logger.info(f"📱 WEBHOOK: обнаружен формат SMS в блоке 'result'")
-                
-        # Вариант 3: другие возможные вложенности
-        elif 'data' in data and isinstance(data['data'], dict):
-            if all(key in data['data'] for key in ['caller_id', 'caller_did', 'text']):
-                sms_data = data['data']
-                logger.info(f"📱 WEBHOOK: обнаружен формат SMS в блоке 'data'")
+        if db_breaker.is_open():
+            # БД недоступна: отвечаем сразу, не занимая потоки пула
+            summary['error'] = 'db_unavailable'
+            response = database_unavailable_response()
+        else:
+            response = await process(request, *args, summary)
+    except Exception as e:
+        if is_db_unavailable(e):
+            summary['error'] = 'db_unavailable'
+            response = database_unavailable_response()
+        else:
+            logger.exception(f"💥 WEBHOOK: критическая ошибка обработки ({endpoint}, токен: {summary.get('token', '-')}...)")
+            response = JsonResponse({'status': 'error', 'message': 'Внутренняя ошибка сервера'}, status=500)
 
-        if sms_data is None:
-            logger.warning(f"❌ WEBHOOK: не найдены данные SMS в известных форматах")
-            logger.warning(f"❌ WEBHOOK: структура данных: {list(data.keys())}")
-            return JsonResponse({'status': 'error', 'message': 'Данные SMS не найдены в известных форматах'}, status=400)
-
-        # Извлекаем данные SMS
-        caller_id = sms_data.get('caller_id', 'Не указан')
-        caller_did = sms_data.get('caller_did', 'Не указан') 
-        text = sms_data.get('text', 'Не указан')
-
-        logger.info(f"📱 WEBHOOK: SMS данные извлечены:")
-        logger.info(f"   📞 От: {caller_id}")
-        logger.info(f"   📞 На: {caller_did}")
-        logger.info(f"   💬 Текст: {text[:100]}{'...' if len(text) > 100 else ''}")
-
-        # Получаем правила с ретраями
-        rules = await get_rules_with_retry(user)
-        
-        # Фильтруем подходящие правила
-        matched_rules = []
-        for rule in rules:
-            from_whom_phone = rule.from_whom.telephone if rule.from_whom else 'Не указан'
-            logger.info(f"🔍 WEBHOOK: проверка правила ID {rule.id}: '{rule.sender}' (номер: {from_whom_phone}) -> {rule.to_whom.title if rule.to_whom else 'None'}")
-            
-            # Проверяем отправителя И получателя SMS
-            sender_matches = rule.sender in [caller_id, "Любой отправитель"]
-            recipient_matches = rule.from_whom and rule.from_whom.telephone == caller_did
-            
-            if sender_matches and recipient_matches:
-                matched_rules.append(rule)
-                logger.info(f"✅ WEBHOOK: правило ID {rule.id} подходит (отправитель: {sender_matches}, получатель: {recipient_matches})")
-            else:
-                logger.info(f"❌ WEBHOOK: правило ID {rule.id} не подходит (отправитель: {sender_matches}, получатель: {recipient_matches})")
+    duration = time.perf_counter() - started
+    WEBHOOK_STAGE_SECONDS.observe(duration, stage='total' if endpoint == 'single' else f'total_{endpoint}')
+    WEBHOOK_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    summary['status'] = response.status_code
+    summary['duration_ms'] = round(duration * 1000, 1)
+    log_webhook_summary(summary)
+    return response
 
-        logger.info(f"📋 WEBHOOK: найдено {len(matched_rules)} подходящих правил из {len(rules)} общих")
 
-        if matched_rules:
-            logger.info(f"🚀 WEBHOOK: начинаем отправку в Telegram...")
-            tg_bot = Bot(settings.TOKEN_BOT)
-            sent_count = 0
-            
+@csrf_exempt
+async def get_webhook(request, token):
+    summary = {'status': None, 'token': token[:8]}
+    return await handle_webhook(request, summary, 'single', process_webhook, token)
+
+
+def find_sms_data(data, token=None):
+    """
+    Ищет данные SMS в форматах провайдеров (см. users_app/sms_formats.py).
+
+    Args:
+        data: Разобранное тело запроса
+        token: Токен вебхука; если указан, первым пробуется запомненный для него формат
+
+    Returns:
+        tuple: (dict с caller_id/caller_did/text, название формата) или (None, None)
+    """
+    if token is None:
+        return sms_formats.parse(data)
+    return sms_formats.detect(token, data)
+
+
+def load_request_data(request):
+    """
+    Тело запроса вебхука: JSON или поля формы (так события присылает Mango Office).
+
+    Raises:
+        json.JSONDecodeError: Если JSON не разбирается
+    """
+    if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        return request.POST.dict()
+    return json.loads(request.body)
+
+
+async def dispatch_sms(user, index, messages):
+    """
+    Находит правила для пачки SMS и отправляет (или ставит в очередь) все
+    сообщения одним вызовом.
+
+    Args:
+        user: WebhookUser
+        index: RulesIndex пользователя
+        messages: Список dict с caller_id, caller_did, text
+
+    Returns:
+        list[dict]: Результат для каждой SMS в формате ответа вебхука
+    """
+    matches = []
+    deliveries = []  # пары (правило, текст сообщения)
+    match_started = time.perf_counter()
+    for sms in messages:
+        caller_id = sms.get('caller_id', 'Не указан')
+        caller_did = sms.get('caller_did', 'Не указан')
+        matched_rules = index.match(caller_did, caller_id, sms.get('text', ''))
+        if logger.isEnabledFor(logging.DEBUG):
             for rule in matched_rules:
-                try:
-                    logger.info(f"📤 WEBHOOK: отправка в канал '{rule.to_whom.title}' (ID: {rule.to_whom.chat_id})")
-
-                    message_text = (f'Пришло сообщение от {caller_id}\n'
-                                    f'На номер: {caller_did}\n'
-                                    f'Текст: {text}')
-                    
-                    await tg_bot.send_message(chat_id=rule.to_whom.chat_id, text=message_text)
-                    sent_count += 1
-                    logger.info(f"✅ WEBHOOK: SMS успешно переслана в канал '{rule.to_whom.title}'")
-                    
-                except Exception as e:
-                    logger.error(f"💥 WEBHOOK: ошибка отправки в канал '{rule.to_whom.title}': {e}")
-
-            logger.info(f"📊 WEBHOOK: отправлено в {sent_count} из {len(matched_rules)} каналов")
-                    
-            return JsonResponse({
+                logger.debug("✅ WEBHOOK: правило ID %s подходит: '%s' (номер: %s) -> %s",
+                             rule.id, rule.sender, rule.telephone, rule.chat_title)
+
+        message_text = format_sms_message(caller_id, caller_did, sms.get('text', 'Не указан'))
+        matches.append((len(deliveries), matched_rules))
+        deliveries.extend((rule, message_text) for rule in matched_rules)
+
+    WEBHOOK_STAGE_SECONDS.observe(time.perf_counter() - match_started, stage='match')
+
+    errors = []
+    if deliveries and settings.TELEGRAM_OUTBOX_ENABLED:
+        # История SMS с правилами сохраняется вместе с очередью: воркер
+        # обновит ее статус по ключу доставки
+        history, delivery_keys = [], []
+        for sms, (_, matched_rules) in zip(messages, matches):
+            if not matched_rules:
+                continue
+            entry = sms_history.build(
+                user.id,
+                sms.get('caller_id', 'Не указан'),
+                sms.get('caller_did', 'Не указан'),
+                sms.get('text', 'Не указан'),
+                [rule.id for rule in matched_rules],
+                'queued',
+            )
+            key = ''
+            if entry is not None:
+                key = entry.delivery_key = uuid.uuid4().hex
+                history.append(entry)
+            delivery_keys.extend([key] * len(matched_rules))
+        with WEBHOOK_STAGE_SECONDS.time(stage='enqueue'):
+            await run_db_with_retry(
+                outbox.enqueue, user.id, deliveries, delivery_keys, history, operation='outbox_enqueue'
+            )
+    elif deliveries:
+        with WEBHOOK_STAGE_SECONDS.time(stage='send'):
+            async with telegram_client.bot_session() as tg_bot:
+                errors = await send_to_chats(tg_bot, [(rule.chat_id, text) for rule, text in deliveries])
+        for (rule, _), error in zip(deliveries, errors):
+            if error is None:
+                logger.debug("✅ WEBHOOK: SMS переслана в канал '%s'", rule.chat_title)
+            else:
+                logger.error("💥 WEBHOOK: ошибка отправки в канал '%s' (правило %s): %s",
+                             rule.chat_title, rule.id, error)
+
+    results = []
+    for sms, (offset, matched_rules) in zip(messages, matches):
+        if not matched_rules:
+            delivery_status = 'no_rules'
+            results.append({
+                'status': 'success',
+                'message': 'Данные получены, но правило не найдено'
+            })
+        elif settings.TELEGRAM_OUTBOX_ENABLED:
+            results.append({
+                'status': 'success',
+                'message': 'Данные получены и поставлены в очередь',
+                'rules_count': len(matched_rules),
+                'queued_count': len(matched_rules)
+            })
+            # Запись истории уже сохранена вместе с очередью
+            continue
+        else:
+            item_errors = errors[offset:offset + len(matched_rules)]
+            sent_count = sum(1 for error in item_errors if error is None)
+            if sent_count == len(matched_rules):
+                delivery_status = 'sent'
+            elif sent_count:
+                delivery_status = 'partial'
+            else:
+                delivery_status = 'failed'
+            results.append({
                 'status': 'success',
                 'message': 'Данные получены и обработаны',
                 'rules_count': len(matched_rules),
                 'sent_count': sent_count
-            }, status=200)
+            })
+
+        sms_history.record(
+            user.id,
+            sms.get('caller_id', 'Не указан'),
+            sms.get('caller_did', 'Не указан'),
+            sms.get('text', 'Не указан'),
+            [rule.id for rule in matched_rules],
+            delivery_status,
+        )
+    return results
+
+
+DUPLICATE_RESULT = {
+    'status': 'success',
+    'message': 'SMS уже обработана (повторный запрос)',
+    'duplicate': True
+}
+
+
+async def claim_new_sms(user, items):
+    """
+    Отсеивает повторно присланные SMS (см. users_app/dedup.py).
+
+    Args:
+        user: WebhookUser
+        items: Пары (данные SMS, исходный JSON, в котором они найдены)
+
+    Returns:
+        list: Отпечаток для новой SMS или None для дубля, в порядке items
+    """
+    fingerprints = [dedup.fingerprint(user.id, sms_data, data) for sms_data, data in items]
+    if not settings.WEBHOOK_DEDUP_ENABLED:
+        return fingerprints
+
+    with WEBHOOK_STAGE_SECONDS.time(stage='dedup'):
+        # Недавние отпечатки этого процесса проверяем без БД
+        result = [None if dedup.is_recent(fp) else fp for fp in fingerprints]
+        to_claim = [fp for fp in result if fp is not None]
+        if to_claim:
+            claimed = iter(await run_db_with_retry(dedup.claim, user.id, to_claim, operation='dedup_claim'))
+            result = [fp if fp is not None and next(claimed) else None for fp in result]
+    return result
+
+
+async def dispatch_claimed_sms(user, index, messages, fingerprints):
+    """dispatch_sms, при ошибке которого отпечатки освобождаются, чтобы повтор провайдера прошел."""
+    try:
+        return await dispatch_sms(user, index, messages)
+    except Exception:
+        if settings.WEBHOOK_DEDUP_ENABLED:
+            await run_db_with_retry(dedup.release, fingerprints, operation='dedup_release')
+        raise
+
+
+def summarize_results(summary, results):
+    summary['matched'] = sum(result.get('rules_count', 0) for result in results)
+    if settings.TELEGRAM_OUTBOX_ENABLED:
+        summary['queued'] = sum(result.get('queued_count', 0) for result in results)
+    else:
+        summary['sent'] = sum(result.get('sent_count', 0) for result in results)
+
+
+async def authenticate_webhook(request, token, summary):
+    """
+    Общие проверки вебхука: метод, JSON и токен.
+
+    Returns:
+        tuple: (WebhookUser, данные JSON, None) или (None, None, ответ с ошибкой)
+    """
+    if request.method != 'POST':
+        summary['error'] = f'method_{request.method}'
+        return None, None, JsonResponse(
+            {'status': 'error', 'message': 'Только POST-запросы поддерживаются'}, status=405
+        )
+
+    raw_body = request.body
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📥 WEBHOOK: получены сырые данные (%s байт): %r", len(raw_body), raw_body[:500])
+
+    # Парсим JSON
+    try:
+        with WEBHOOK_STAGE_SECONDS.time(stage='parse'):
+            data = load_request_data(request)
+    except json.JSONDecodeError as e:
+        summary['error'] = 'invalid_json'
+        logger.warning("💥 WEBHOOK: ошибка парсинга JSON: %s, данные: %r", e, raw_body[:500])
+        return None, None, JsonResponse({'status': 'error', 'message': 'Неверный формат JSON'}, status=400)
+
+    # Получаем пользователя
+    with WEBHOOK_STAGE_SECONDS.time(stage='user_lookup'):
+        user = await get_user_by_token_with_retry(token)
+    if user is None:
+        summary['error'] = 'unknown_token'
+        return None, None, HttpResponseForbidden('Неверный токен')
+    summary['user'] = user.id
+    if not user.is_active:
+        summary['error'] = 'inactive_user'
+        return None, None, HttpResponseForbidden('Неверный токен')
+
+    return user, data, None
+
+
+async def process_webhook(request, token, summary):
+    """Обработка запроса вебхука; итоги складываются в summary для лога."""
+    user, data, error_response = await authenticate_webhook(request, token, summary)
+    if error_response is not None:
+        return error_response
+
+    sms_data, sms_format = find_sms_data(data, token)
+    if sms_data is None:
+        summary['error'] = 'unknown_format'
+        logger.warning("❌ WEBHOOK: не найдены данные SMS в известных форматах, ключи: %s",
+                       list(data) if isinstance(data, dict) else type(data).__name__)
+        return JsonResponse({'status': 'error', 'message': 'Данные SMS не найдены в известных форматах'}, status=400)
+    summary.update(format=sms_format, caller_id=sms_data.get('caller_id'), caller_did=sms_data.get('caller_did'))
+
+    # Повтор провайдера подтверждаем сразу, без правил и отправки
+    fingerprints = await claim_new_sms(user, [(sms_data, data)])
+    if fingerprints[0] is None:
+        summary['duplicate'] = True
+        return JsonResponse(DUPLICATE_RESULT, status=200)
+
+    # Получаем индекс правил с ретраями
+    with WEBHOOK_STAGE_SECONDS.time(stage='rule_load'):
+        index = await get_rules_index_with_retry(user)
+    summary['rules'] = len(index)
+
+    results = await dispatch_claimed_sms(user, index, [sms_data], fingerprints)
+    summarize_results(summary, results)
+    return JsonResponse(results[0], status=200)
+
+
+@csrf_exempt
+async def get_webhook_batch(request, token):
+    """
+    Пакетный вебхук: массив SMS (или {"messages": [...]}) в тех же форматах,
+    что и get_webhook. Пользователь и правила загружаются один раз на пачку.
+    """
+    summary = {'status': None, 'batch': True, 'token': token[:8]}
+    return await handle_webhook(request, summary, 'batch', process_webhook_batch, token)
+
+
+def parse_batch(data, summary):
+    """
+    Список SMS пакетного запроса.
+
+    Returns:
+        tuple: (список элементов, None) или (None, ответ с ошибкой)
+    """
+    items = data.get('messages') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        summary['error'] = 'not_a_list'
+        return None, JsonResponse({'status': 'error', 'message': 'Ожидается массив SMS'}, status=400)
+    if len(items) > settings.WEBHOOK_BATCH_MAX_SIZE:
+        summary['error'] = 'batch_too_large'
+        return None, JsonResponse({
+            'status': 'error',
+            'message': f'Не больше {settings.WEBHOOK_BATCH_MAX_SIZE} SMS в одном запросе'
+        }, status=413)
+    summary['items'] = len(items)
+    return items, None
+
+
+async def process_user_sms(user, items, summary):
+    """
+    Дедупликация, правила и отправка SMS одного пользователя.
+
+    Args:
+        user: WebhookUser
+        items: Пары (данные SMS, исходный JSON)
+        summary: Итоги запроса; rules и duplicates суммируются по пользователям
+
+    Returns:
+        list: Результат для каждой пары, в порядке items
+    """
+    fingerprints = await claim_new_sms(user, items)
+    new = [(sms_data, fp) for (sms_data, _), fp in zip(items, fingerprints) if fp is not None]
+    summary['duplicates'] = summary.get('duplicates', 0) + len(items) - len(new)
+
+    dispatched = iter([])
+    if new:
+        with WEBHOOK_STAGE_SECONDS.time(stage='rule_load'):
+            index = await get_rules_index_with_retry(user)
+        summary['rules'] = summary.get('rules', 0) + len(index)
+        dispatched = iter(await dispatch_claimed_sms(
+            user, index, [sms_data for sms_data, _ in new], [fp for _, fp in new]
+        ))
+    return [DUPLICATE_RESULT if fp is None else next(dispatched) for fp in fingerprints]
+
+
+async def process_webhook_batch(request, token, summary):
+    user, data, error_response = await authenticate_webhook(request, token, summary)
+    if error_response is not None:
+        return error_response
+
+    items, error_response = parse_batch(data, summary)
+    if error_response is not None:
+        return error_response
+
+    parsed = [find_sms_data(item, token)[0] for item in items]
+    valid = [(sms_data, item) for sms_data, item in zip(parsed, items) if sms_data is not None]
+    processed = iter(await process_user_sms(user, valid, summary))
+    results = [
+        {'status': 'error', 'message': 'Данные SMS не найдены в известных форматах'} if sms_data is None
+        else next(processed)
+        for sms_data in parsed
+    ]
+
+    summary['invalid'] = len(parsed) - len(valid)
+    summarize_results(summary, results)
+    return JsonResponse({'status': 'success', 'results': results}, status=200)
+
+
+# Ключ запомненного формата SMS общего вебхука провайдера (токены пользователей длиннее)
+PROVIDER_FORMAT_KEY = 'provider'
+
+
+async def get_users_by_phones_with_retry(phones):
+    """Владельцы номеров из справочника phone_directory; неизвестные номера — одним запросом к БД"""
+    if phone_directory.claim_reload():
+        await run_db_with_retry(phone_directory.load, operation='phone_directory')
+
+    users = {phone: phone_directory.get(phone) for phone in phones}
+    missing = [phone for phone, user in users.items() if user is MISSING]
+    if missing:
+        if settings.WEBHOOK_ASYNC_ORM:
+            users.update(await db_retry.call(phone_directory.aload_phones, missing, operation='phone_directory'))
         else:
-            logger.info(f"ℹ️ WEBHOOK: для SMS от {caller_id} не найдено подходящих правил")
-            return JsonResponse({
-                'status': 'success',
-                'message': 'Данные получены, но правило не найдено'
-            }, status=200)
+            users.update(await run_db_with_retry(phone_directory.load_phones, missing, operation='phone_directory'))
+    return users
 
-    except Exception as e:
-        logger.error(f"💥 WEBHOOK: критическая ошибка: {e}")
-        logger.error(f"💥 WEBHOOK: тип ошибки: {type(e).__name__}")
-        import traceback
-        logger.error(f"💥 WEBHOOK: полный traceback:\n{traceback.format_exc()}")
-        return JsonResponse({'status': 'error', 'message': 'Внутренняя ошибка сервера'}, status=500) 
+
+def is_sms_batch(data):
+    """Пакет провайдера — массив SMS или {"messages": [...]}, иначе одна SMS."""
+    return isinstance(data, list) or (isinstance(data, dict) and isinstance(data.get('messages'), list))
+
+
+@csrf_exempt
+async def provider_webhook(request, token):
+    """
+    Общий вебхук аккаунта провайдера: одна SMS или массив SMS (как в
+    get_webhook_batch) любых клиентов. Клиент определяется по caller_did через
+    справочник номеров (см. users_app/phone_directory.py), токен пользователя
+    не нужен.
+    """
+    if not settings.PROVIDER_WEBHOOK_TOKEN:
+        raise Http404
+    summary = {'status': None, 'provider': True}
+    return await handle_webhook(request, summary, 'provider', process_provider_webhook, token)
+
+
+async def process_provider_webhook(request, token, summary):
+    if request.method != 'POST':
+        summary['error'] = f'method_{request.method}'
+        return JsonResponse({'status': 'error', 'message': 'Только POST-запросы поддерживаются'}, status=405)
+    if not hmac.compare_digest(token.encode(), settings.PROVIDER_WEBHOOK_TOKEN.encode()):
+        summary['error'] = 'invalid_provider_token'
+        return HttpResponseForbidden('Неверный токен')
+
+    try:
+        with WEBHOOK_STAGE_SECONDS.time(stage='parse'):
+            data = load_request_data(request)
+    except json.JSONDecodeError:
+        summary['error'] = 'invalid_json'
+        return JsonResponse({'status': 'error', 'message': 'Неверный формат JSON'}, status=400)
+
+    single = not is_sms_batch(data)
+    if single:
+        items = [data]
+    else:
+        items, error_response = parse_batch(data, summary)
+        if error_response is not None:
+            return error_response
+
+    parsed = [find_sms_data(item, PROVIDER_FORMAT_KEY)[0] for item in items]
+    if single and parsed[0] is None:
+        summary['error'] = 'unknown_format'
+        return JsonResponse({'status': 'error', 'message': 'Данные SMS не найдены в известных форматах'}, status=400)
+    phones = [
+        None if sms_data is None else phone_directory.normalize_phone(sms_data.get('caller_did'))
+        for sms_data in parsed
+    ]
+    with WEBHOOK_STAGE_SECONDS.time(stage='user_lookup'):
+        users = await get_users_by_phones_with_retry({phone for phone in phones if phone is not None})
+
+    # Группируем SMS по владельцам номеров, сохраняя позиции для ответа
+    results = [None] * len(items)
+    groups = {}
+    for position, (item, sms_data, phone) in enumerate(zip(items, parsed, phones)):
+        if sms_data is None:
+            results[position] = {'status': 'error', 'message': 'Данные SMS не найдены в известных форматах'}
+            continue
+        user = users[phone]
+        if user is None or not user.is_active:
+            results[position] = {'status': 'error', 'message': 'Номер не подключен'}
+            continue
+        if sms_data.get('caller_did') != phone:
+            # Правила индексируются по номеру в том виде, в каком он сохранен
+            sms_data = {**sms_data, 'caller_did': phone}
+        groups.setdefault(user, []).append((position, sms_data, item))
+
+    # Клиенты обрабатываются параллельно, SMS одного клиента — одной пачкой
+    processed = await asyncio.gather(*(
+        process_user_sms(user, [(sms_data, item) for _, sms_data, item in group], summary)
+        for user, group in groups.items()
+    ))
+    for group, group_results in zip(groups.values(), processed):
+        for (position, _, _), result in zip(group, group_results):
+            results[position] = result
+
+    summary['users'] = len(groups)
+    summary['unrouted'] = len(items) - sum(len(group) for group in groups.values())
+    summarize_results(summary, results)
+    if single:
+        status = 404 if results[0].get('message') == 'Номер не подключен' else 200
+        return JsonResponse(results[0], status=status)
+    return JsonResponse({'status': 'success', 'results': results}, status=200)
+
+
+@csrf_exempt
+async def telegram_webhook(request):
+    """
+    Обновления Telegram-бота в режиме TELEGRAM_BOT_MODE=webhook
+    (см. users_app/bot_webhook.py).
+    """
+    if not bot_webhook.is_enabled():
+        raise Http404
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+    if not bot_webhook.check_secret(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+        logger.warning("🚫 BOT WEBHOOK: неверный секретный токен")
+        return HttpResponseForbidden('Доступ запрещен')
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+
+    try:
+        await bot_webhook.process(data)
+    except Exception:
+        # Telegram повторит обновление, если ответ не 2xx
+        logger.exception("💥 BOT WEBHOOK: ошибка приема обновления")
+        return HttpResponse(status=500)
+    return HttpResponse(status=200)
+
+
+def has_metrics_access(request):
+    """
+    Доступ к /metrics: заголовок Authorization: Bearer METRICS_TOKEN и/или
+    адрес из METRICS_ALLOWED_IPS — проверяется все, что задано. Если не задано
+    ничего, метрики закрыты: за nginx REMOTE_ADDR у всех запросов 127.0.0.1.
+    """
+    token, allowed_ips = settings.METRICS_TOKEN, settings.METRICS_ALLOWED_IPS
+    if not token and not allowed_ips:
+        return False
+    if allowed_ips and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return False
+    if token:
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), token.encode())
+    return True
+
+
+async def metrics_view(request):
+    """Метрики процесса в формате Prometheus (доступ — см. has_metrics_access)."""
+    if not has_metrics_access(request):
+        return HttpResponseForbidden('Доступ запрещен')
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@staff_member_required
+def profiles_list(request):
+    """Список сохраненных профилей запросов (см. users_app/profiling.py)."""
+    return render(request, 'html/profiles.html', {
+        'profiles': profiling.list_profiles(),
+        'profiling_enabled': settings.PROFILING_ENABLED,
+        'title': 'Профили запросов',
+    })
+
+
+@staff_member_required
+def profile_download(request, filename):
+    """Скачивание .prof/.json профиля; ?view=1 показывает отчет pstats."""
+    path = profiling.profile_path(filename)
+    if path is None:
+        raise Http404('Профиль не найден')
+    if request.GET.get('view') and filename.endswith('.prof'):
+        return HttpResponse(profiling.stats_text(path), content_type='text/plain; charset=utf-8')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
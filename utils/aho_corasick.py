@@ -0,0 +1,73 @@
+"""
+Автомат Ахо — Корасик для поиска многих подстрок за один проход по тексту.
+
+Используется для ключевых слов в правилах (users_app/rules_index.py): время
+поиска зависит от длины текста, а не от количества ключевых слов.
+"""
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Args:
+        patterns: Пары (подстрока, значение). search() возвращает значения
+            всех подстрок, найденных в тексте.
+    """
+
+    def __init__(self, patterns):
+        # Состояние автомата — индекс в этих списках; 0 — корень
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+
+        for word, value in patterns:
+            if word:
+                self._insert(word, value)
+        self._build()
+
+    def _insert(self, word, value):
+        state = 0
+        for char in word:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].add(value)
+
+    def _build(self):
+        # Обход в ширину: ссылка неудачи ведет в состояние самого длинного
+        # собственного суффикса, который тоже есть в боре
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # Совпадения суффиксов тоже считаются найденными
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """
+        Args:
+            text: Текст для поиска
+
+        Returns:
+            set: Значения найденных подстрок
+        """
+        found = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
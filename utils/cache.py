@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Маркер отсутствия записи: позволяет хранить в кеше None как "известно, что нет"
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кеш с ограничением размера и временем жизни записей.
+
+    Args:
+        maxsize: Максимальное количество записей; самые давние вытесняются
+        ttl: Время жизни записи в секундах
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,47 @@
+import atexit
+import copy
+import logging
+import queue
+from logging.handlers import QueueListener
+
+
+class QueueStreamHandler(logging.Handler):
+    """
+    Неблокирующий вывод логов в поток (stdout/stderr).
+
+    emit() только подставляет аргументы в сообщение и кладет запись в
+    очередь. Форматирование и запись в поток выполняет QueueListener в
+    отдельном потоке, поэтому логирование не блокирует event loop.
+
+    Args:
+        stream: Поток вывода (по умолчанию sys.stderr)
+    """
+
+    def __init__(self, stream=None):
+        super().__init__()
+        self.queue = queue.SimpleQueue()
+        self.target = logging.StreamHandler(stream)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        try:
+            # Аргументы подставляем сразу: к моменту записи объекты в args
+            # могут измениться, а их __str__ может обращаться к БД
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
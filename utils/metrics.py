@@ -0,0 +1,206 @@
+"""
+Минимальные метрики в текстовом формате Prometheus.
+
+Counter и Histogram хранят значения в памяти процесса. У каждой серии меток
+своя блокировка, которая держится на время пары арифметических операций, так
+что запись метрики стоит доли микросекунды и ее можно оставлять на горячем
+пути. Общая блокировка метрики берется только при появлении новой серии.
+
+Метрики одного процесса: при нескольких воркерах Prometheus опрашивает
+каждый из них.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Метрика без меток видна со значением 0 до первого события
+            self._get_series({})
+        registry.register(self)
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _get_series(self, labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+
+class _CounterSeries:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount=1, **labels):
+        series = self._get_series(labels)
+        with series.lock:
+            series.value += amount
+
+    def render(self):
+        for key, series in self._items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(series.value)}'
+
+
+class _HistogramSeries:
+    __slots__ = ('counts', 'sum', 'count', 'lock')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_series(self):
+        # Последняя ячейка — значения больше самой крупной границы (+Inf)
+        return _HistogramSeries(len(self.buckets) + 1)
+
+    def observe(self, value, **labels):
+        series = self._get_series(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with series.lock:
+            series.counts[position] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время выполнения блока with в секундах."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        for key, series in self._items():
+            with series.lock:
+                counts, total, count = list(series.counts), series.sum, series.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+def timed(histogram, **labels):
+    """Декоратор async-функции: время выполнения пишется в histogram."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr='127.0.0.1', registry=REGISTRY):
+    """
+    Отдает метрики по HTTP из фонового потока — для процессов без Django-сервера
+    (бот, воркер очереди). Доступа по токену нет, поэтому по умолчанию сервер
+    слушает только localhost.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server